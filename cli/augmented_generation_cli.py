@@ -1,6 +1,6 @@
-import json
 import argparse
 from lib import config, hybrid_search, search_utils, augmented_generation
+from lib.documents import load_documents
 
 
 def main():
@@ -29,8 +29,7 @@ def main():
             query = args.query
 
             # Load movies json
-            with open(config.DATA_FILE_PATH, "r") as f:
-                documents = json.load(f)["movies"]
+            documents = load_documents()
             hs = hybrid_search.HybridSearch(documents)
 
             rrf_data = hs.rrf_search(query, search_utils.DEFAULT_RRF_K, 5)
@@ -46,8 +45,7 @@ def main():
             query = args.query
 
             # Load movies json
-            with open(config.DATA_FILE_PATH, "r") as f:
-                documents = json.load(f)["movies"]
+            documents = load_documents()
             hs = hybrid_search.HybridSearch(documents)
 
             rrf_data = hs.rrf_search(query, search_utils.DEFAULT_RRF_K, args.limit)
@@ -63,8 +61,7 @@ def main():
             query = args.query
 
             # Load movies json
-            with open(config.DATA_FILE_PATH, "r") as f:
-                documents = json.load(f)["movies"]
+            documents = load_documents()
             hs = hybrid_search.HybridSearch(documents)
 
             rrf_data = hs.rrf_search(query, search_utils.DEFAULT_RRF_K, args.limit)
@@ -80,8 +77,7 @@ def main():
             question = args.question
 
             # Load movies json
-            with open(config.DATA_FILE_PATH, "r") as f:
-                documents = json.load(f)["movies"]
+            documents = load_documents()
             hs = hybrid_search.HybridSearch(documents)
 
             rrf_data = hs.rrf_search(question, search_utils.DEFAULT_RRF_K, args.limit)
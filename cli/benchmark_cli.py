@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+import argparse
+from lib import search_utils
+from benchmarks import keyword_index, startup, vector_search
+from lib.models import ENCODER_BACKENDS
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Search Benchmark CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available commands")
+
+    index_memory_parser = subparsers.add_parser("index_memory", help="Compare keyword index memory of posting lists against the dict/set/Counter layout")
+    index_memory_parser.add_argument("--scale", type=int, default=10, help="Number of copies of the catalog in the synthetic corpus")
+
+    bm25_parser = subparsers.add_parser("bm25", help="Compare vectorized BM25 scoring against per-posting scoring")
+    bm25_parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+    bm25_parser.add_argument("--limit", type=int, default=search_utils.SEARCH_LIMIT, help="Results per query")
+
+    pruning_parser = subparsers.add_parser("pruning", help="Check WAND and Block-Max WAND results against exhaustive BM25 scoring")
+    pruning_parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+    pruning_parser.add_argument("--limit", type=int, default=search_utils.SEARCH_LIMIT, help="Results per query")
+
+    index_load_parser = subparsers.add_parser("index_load", help="Compare opening the memory-mapped index segment against unpickling the old caches")
+    index_load_parser.add_argument("--scale", type=int, default=10, help="Number of copies of the catalog in the synthetic corpus")
+
+    ingest_parser = subparsers.add_parser("ingest", help="Compare peak memory of streaming the catalog against json.load")
+    ingest_parser.add_argument("--scale", type=int, default=10, help="Number of copies of the catalog to write out and read back")
+
+    subparsers.add_parser("preprocess", help="Compare tokens per second of the cached preprocessing pipeline against the uncached one")
+
+    positional_parser = subparsers.add_parser("positional", help="Check phrase and NEAR/k results against a scan of every document's token positions")
+    positional_parser.add_argument("--queries", type=int, default=100, help="Number of sampled queries")
+
+    result_cache_parser = subparsers.add_parser("result_cache", help="Replay a skewed BM25 query workload with and without the result cache")
+    result_cache_parser.add_argument("--queries", type=int, default=2000, help="Number of searches to run")
+    result_cache_parser.add_argument("--distinct", type=int, default=400, help="Number of distinct queries they are drawn from")
+    result_cache_parser.add_argument("--limit", type=int, default=search_utils.SEARCH_LIMIT, help="Results per query")
+
+    spelling_parser = subparsers.add_parser("spelling", help="Measure the local spelling corrector on misspelled vocabulary words")
+    spelling_parser.add_argument("--words", type=int, default=2000, help="Number of misspelled words to correct")
+
+    bm25f_parser = subparsers.add_parser("bm25f", help="Compare BM25 and BM25F on known-item queries mixing title and description words")
+    bm25f_parser.add_argument("--queries", type=int, default=500, help="Number of sampled queries")
+    bm25f_parser.add_argument("--limit", type=int, default=search_utils.SEARCH_LIMIT, help="Results per query")
+
+    filters_parser = subparsers.add_parser("filters", help="Compare over-fetching and post-filtering with bitmap pre-filtering")
+    filters_parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+    filters_parser.add_argument("--limit", type=int, default=search_utils.SEARCH_LIMIT, help="Results per query")
+
+    vector_parser = subparsers.add_parser("vector", help="Compare the per-row cosine loop with normalized matrix-vector search")
+    vector_parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000], help="Embedding counts to measure")
+    vector_parser.add_argument("--dim", type=int, default=384, help="Embedding dimensions")
+    vector_parser.add_argument("--queries", type=int, default=20, help="Queries for the matrix-vector search")
+    vector_parser.add_argument("--loop-queries", type=int, default=2, help="Queries for the much slower loop")
+    vector_parser.add_argument("--limit", type=int, default=search_utils.SEARCH_LIMIT, help="Results per query")
+
+    ivf_parser = subparsers.add_parser("ivf", help="Recall@k and latency of the IVF index against exact search on clustered embeddings")
+    ivf_parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000], help="Embedding counts to measure")
+    ivf_parser.add_argument("--dim", type=int, default=384, help="Embedding dimensions")
+    ivf_parser.add_argument("--queries", type=int, default=100, help="Number of queries")
+    ivf_parser.add_argument("-k", type=int, default=10, help="Neighbours per query")
+    ivf_parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64], help="Lists to probe per query")
+
+    quantization_parser = subparsers.add_parser("quantization", help="Memory, latency and recall@k of float16, int8 and product-quantized embeddings")
+    quantization_parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000], help="Embedding counts to measure")
+    quantization_parser.add_argument("--dim", type=int, default=384, help="Embedding dimensions")
+    quantization_parser.add_argument("--queries", type=int, default=20, help="Number of queries")
+    quantization_parser.add_argument("--limit", type=int, default=10, help="k, results compared per query")
+    quantization_parser.add_argument("--rescore-factor", type=int, default=search_utils.RESCORE_FACTOR, help="Shortlist limit * factor rows for float32 rescoring")
+    shared_parser = subparsers.add_parser("shared_embeddings", help="Startup time and memory of worker processes reading vs memory-mapping one embeddings file")
+    shared_parser.add_argument("--rows", type=int, default=200_000, help="Embedding rows")
+    shared_parser.add_argument("--dim", type=int, default=384, help="Embedding dimensions")
+    shared_parser.add_argument("--workers", type=int, default=4, help="Worker processes opening the file at once")
+    query_cache_parser = subparsers.add_parser("query_cache", help="Replay a skewed query stream over several runs through the query embedding cache")
+    query_cache_parser.add_argument("--queries", type=int, default=2000, help="Queries per run")
+    query_cache_parser.add_argument("--distinct", type=int, default=400, help="Number of distinct queries they are drawn from")
+    query_cache_parser.add_argument("--runs", type=int, default=3, help="Runs, each starting with an empty in-memory cache")
+    query_cache_parser.add_argument("--encode-ms", type=float, default=10.0, help="Stand-in cost of encoding one query")
+    query_cache_parser.add_argument("--dtype", type=str, default=search_utils.QUERY_CACHE_DTYPE, choices=["float32", "float16"], help="On-disk vector type")
+    pooling_parser = subparsers.add_parser("chunk_pooling", help="Load chunk metadata and pool chunk scores into movie scores: JSON and a dict loop vs columnar arrays")
+    pooling_parser.add_argument("--movies", type=int, default=200_000, help="Movies, with 1 to 8 chunks each")
+    pooling_parser.add_argument("--repeats", type=int, default=5, help="Poolings timed per method")
+    pooling_parser.add_argument("--top-n", type=int, default=search_utils.CHUNK_POOLING_TOP_N, help="Chunks averaged by mean_top_n pooling")
+
+    cold_start_parser = subparsers.add_parser("cold_start", help="Time each *_cli.py --help in a fresh interpreter, with heavy imports deferred vs imported up front")
+    cold_start_parser.add_argument("--runs", type=int, default=5, help="Runs per CLI; the median is reported")
+
+    backends_parser = subparsers.add_parser("encoder_backends", help="Latency, throughput and agreement with the float model of each encoder and cross-encoder backend")
+    backends_parser.add_argument("--backends", type=str, nargs="+", choices=ENCODER_BACKENDS, default=list(ENCODER_BACKENDS), help="Backends to compare against torch")
+    backends_parser.add_argument("--queries", type=int, default=100, help="Queries encoded one at a time")
+    backends_parser.add_argument("--docs", type=int, default=1000, help="Movies encoded in batches")
+    backends_parser.add_argument("--rerank-docs", type=int, default=20, help="Movies reranked per query")
+    backends_parser.add_argument("--min-cosine", type=float, default=search_utils.ENCODER_AGREEMENT_MIN_COSINE, help="Lowest cosine to the float embeddings a backend may reach")
+
+    rrf_parser = subparsers.add_parser("rrf_qps", help="Queries per second of rrf_search with the keyword index reloaded per query vs kept resident")
+    rrf_parser.add_argument("--queries", type=int, default=200, help="Distinct queries per pass")
+    rrf_parser.add_argument("--k", type=int, default=search_utils.DEFAULT_RRF_K, help="RRF k")
+    rrf_parser.add_argument("--limit", type=int, default=search_utils.SEARCH_LIMIT, help="Results per query")
+
+    args = parser.parse_args()
+
+    match args.command:
+        case "index_memory":
+            res = keyword_index.compare_index_memory(args.scale)
+            mb = 1024 * 1024
+            print(f"Documents: {res['documents']}")
+            print(f"dict/set/Counter layout: {res['legacy_bytes'] / mb:.2f} MB")
+            print(f"Posting list layout: {res['posting_bytes'] / mb:.2f} MB")
+            print(f"Reduction: {res['legacy_bytes'] / res['posting_bytes']:.2f}x")
+        case "bm25":
+            try:
+                res = keyword_index.compare_bm25_scoring(args.queries, args.limit)
+            except FileNotFoundError as e:
+                print("Error:", e)
+                return
+            print(f"Queries: {res['queries']}")
+            print(f"Per-posting scoring: {res['per_posting_secs']:.3f}s")
+            print(f"Vectorized scoring: {res['vectorized_secs']:.3f}s")
+            print(f"Speedup: {res['per_posting_secs'] / res['vectorized_secs']:.1f}x")
+            print(f"Ranking mismatches: {res['mismatches']}")
+        case "pruning":
+            try:
+                res = keyword_index.compare_pruned_bm25(args.queries, args.limit)
+            except FileNotFoundError as e:
+                print("Error:", e)
+                return
+            print(f"Queries: {res['queries']}")
+            print(f"Exhaustive: {res['exhaustive_secs']:.3f}s")
+            print(f"WAND: {res['wand_secs']:.3f}s, mismatches: {res['wand_mismatches']}")
+            print(f"Block-Max WAND: {res['bmw_secs']:.3f}s, mismatches: {res['bmw_mismatches']}")
+        case "index_load":
+            res = keyword_index.compare_index_load(args.scale)
+            mb = 1024 * 1024
+            print(f"Documents: {res['documents']}")
+            print(f"Pickles: {res['pickle_bytes'] / mb:.2f} MB, load {res['pickle_secs'] * 1000:.1f} ms")
+            print(f"Segment: {res['segment_bytes'] / mb:.2f} MB, open {res['segment_secs'] * 1000:.2f} ms")
+            print(f"First term + document lookup on the segment: {res['first_lookup_secs'] * 1000:.2f} ms")
+        case "ingest":
+            res = keyword_index.compare_ingest(args.scale)
+            mb = 1024 * 1024
+            print(f"Documents: {res['documents']}, catalog file: {res['file_bytes'] / mb:.1f} MB")
+            print(f"json.load: peak {res['json_load_peak_bytes'] / mb:.1f} MB, {res['json_load_secs']:.2f}s")
+            print(f"Streamed JSON: peak {res['stream_json_peak_bytes'] / mb:.1f} MB, {res['stream_json_secs']:.2f}s")
+            print(f"Streamed JSON Lines: peak {res['stream_jsonl_peak_bytes'] / mb:.1f} MB, {res['stream_jsonl_secs']:.2f}s")
+        case "preprocess":
+            res = keyword_index.compare_preprocessing()
+            tokens = res["tokens"]
+            print(f"Documents: {res['documents']}, tokens: {tokens}")
+            print(f"Uncached: {res['legacy_secs']:.2f}s, {tokens / res['legacy_secs']:,.0f} tokens/s")
+            print(f"Cached, cold: {res['cold_secs']:.2f}s, {tokens / res['cold_secs']:,.0f} tokens/s")
+            print(f"Cached, warm: {res['warm_secs']:.2f}s, {tokens / res['warm_secs']:,.0f} tokens/s")
+            print(f"Stem cache hit ratio: {res['stem_hit_ratio']:.1%}, mismatches: {res['mismatches']}")
+            print(f"Index build: {res['build_secs']:.2f}s")
+        case "positional":
+            try:
+                res = keyword_index.compare_positional_search(args.queries)
+            except FileNotFoundError as e:
+                print("Error:", e)
+                return
+            print(f"Queries: {res['queries']}, matching documents: {res['matches']}")
+            print(f"Position scan: {res['scan_secs']:.3f}s")
+            for mode, name in [("exhaustive", "Exhaustive"), ("wand", "WAND"), ("bmw", "Block-Max WAND")]:
+                print(f"{name}: {res[f'{mode}_secs']:.3f}s, mismatches: {res[f'{mode}_mismatches']}")
+        case "result_cache":
+            try:
+                res = keyword_index.compare_result_cache(args.queries, args.distinct, args.limit)
+            except FileNotFoundError as e:
+                print("Error:", e)
+                return
+            stats = res["stats"]
+            print(f"Queries: {res['queries']} ({res['distinct']} distinct)")
+            print(f"Uncached: {res['uncached_secs']:.3f}s")
+            print(f"Cached: {res['cached_secs']:.3f}s, mismatches: {res['mismatches']}")
+            print(f"Hits: {stats['hits']}, misses: {stats['misses']}, evictions: {stats['evictions']}, hit ratio: {stats['hit_ratio']:.1%}")
+        case "spelling":
+            try:
+                res = keyword_index.compare_spelling(args.words)
+            except FileNotFoundError as e:
+                print("Error:", e)
+                return
+            print(f"Vocabulary: {res['vocabulary']} words, {res['deletes']} deletes, {res['file_bytes'] / 1024 / 1024:.2f} MB")
+            print(f"Build: {res['build_secs']:.2f}s, load: {res['load_secs'] * 1000:.1f} ms")
+            print(f"Corrected {res['words']} words: {res['correct_secs'] / res['words'] * 1e6:.0f} us per word, accuracy {res['accuracy']:.1%}")
+        case "bm25f":
+            try:
+                res = keyword_index.compare_bm25f(args.queries, args.limit)
+            except (FileNotFoundError, ValueError) as e:
+                print("Error:", e)
+                return
+            print(f"Queries: {res['queries']}")
+            for name, label in [("bm25", "BM25"), ("bm25f", "BM25F")]:
+                print(f"{label}: {res[f'{name}_secs']:.3f}s, recall@1 {res[f'{name}_recall_at_1']:.1%}, recall@{args.limit} {res[f'{name}_recall']:.1%}, MRR {res[f'{name}_mrr']:.3f}")
+        case "filters":
+            try:
+                res = keyword_index.compare_filters(args.queries, args.limit)
+            except FileNotFoundError as e:
+                print("Error:", e)
+                return
+            print(f"Queries: {res['queries']}, documents: {res['documents']}")
+            for row in res["selectivities"]:
+                print(f"Filter keeping {row['fraction']:.0%}: bitmap {row['bitmap_bytes'] / 1024:.1f} KB, Python set {row['set_bytes'] / 1024:.1f} KB")
+                for mode, name in [("exhaustive", "Exhaustive"), ("wand", "WAND")]:
+                    print(f"  {name}: post-filter {row[f'{mode}_post_secs']:.3f}s, pre-filter {row[f'{mode}_pre_secs']:.3f}s, mismatches: {row[f'{mode}_mismatches']}")
+            print(f"Predicate filter bitmap: {res['predicate_cold_secs'] * 1000:.2f} ms cold, {res['predicate_cached_secs'] * 1000:.3f} ms cached")
+        case "vector":
+            for rows in args.rows:
+                res = vector_search.compare_vector_search(rows, args.dim, args.queries, args.loop_queries, args.limit)
+                print(f"{res['rows']:,} x {res['dim']} embeddings (normalized once in {res['normalize_secs']:.2f}s)")
+                print(f"  Loop: {res['loop_secs'] * 1000:.1f} ms per query")
+                print(f"  Matrix-vector: {res['matmul_secs'] * 1000:.2f} ms per query, {res['loop_secs'] / res['matmul_secs']:.0f}x faster")
+                print(f"  Ranking mismatches: {res['mismatches']}/{res['loop_queries']}, max score difference: {res['max_score_diff']:.1e}")
+        case "ivf":
+            for rows in args.rows:
+                res = vector_search.compare_ivf(rows, args.dim, args.queries, args.k, args.nprobe)
+                print(f"{res['rows']:,} x {res['dim']} embeddings, {res['lists']} lists, built in {res['build_secs']:.1f}s")
+                for p in res["points"]:
+                    print(f"  nprobe {p['nprobe']}: recall@{args.k} {p['recall']:.3f}, {p['secs'] * 1000:.2f} ms per query (exact {p['exact_secs'] * 1000:.2f} ms)")
+        case "quantization":
+            mb = 1024 * 1024
+            for rows in args.rows:
+                res = vector_search.compare_quantization(rows, args.dim, args.queries, args.limit, args.rescore_factor)
+                print(f"{res['rows']:,} x {res['dim']} embeddings, recall@{args.limit} against float32")
+                for row in res["modes"]:
+                    line = f"  {row['mode']}: {row['bytes'] / mb:.1f} MB, {row['approx_secs'] * 1000:.1f} ms per query, recall {row['approx_recall']:.3f}"
+                    if "rescored_secs" in row:
+                        line += f"; rescored: {row['rescored_secs'] * 1000:.1f} ms, recall {row['rescored_recall']:.3f}; encoded in {row['encode_secs']:.1f}s"
+                    print(line)
+        case "shared_embeddings":
+            res = vector_search.compare_shared_embeddings(args.rows, args.dim, args.workers)
+            mb = 1024 * 1024
+            print(f"{res['workers']} workers, {res['rows']:,} x {res['dim']} embeddings ({res['file_bytes'] / mb:.1f} MB file)")
+            for name in ["read", "mmap"]:
+                r = res[name]
+                print(f"  {name}: load {r['load_secs'] * 1000:.1f} ms, first query {r['query_secs'] * 1000:.1f} ms, RSS {r['rss'] / mb:.1f} MB, PSS {r['pss'] / mb:.1f} MB in total")
+        case "query_cache":
+            try:
+                res = vector_search.compare_query_cache(args.queries, args.distinct, args.runs, args.encode_ms, args.dtype)
+            except FileNotFoundError as e:
+                print("Error:", e)
+                return
+            print(f"Queries per run: {res['queries']} ({res['distinct']} distinct), uncached: {res['uncached_secs']:.3f}s")
+            for i, run in enumerate(res["runs"], start=1):
+                print(f"Run {i}: {run['secs']:.3f}s, {run['memory_hits']} memory hits, {run['disk_hits']} disk hits, {run['misses']} encoded, hit ratio {run['hit_ratio']:.1%} ({run['memory_hit_ratio']:.1%} in memory)")
+            print(f"Store on disk: {res['file_bytes'] / 1024:.1f} KiB")
+        case "chunk_pooling":
+            res = vector_search.compare_chunk_pooling(args.movies, args.repeats, args.top_n)
+            print(f"{res['movies']:,} movies, {res['chunks']:,} chunks")
+            print(f"Metadata load: JSON {res['json_load_secs']:.3f}s, memory-mapped .npy {res['npy_load_secs'] * 1000:.2f} ms")
+            for name, secs in res["secs"].items():
+                print(f"  {name}: {secs * 1000:.1f} ms per query")
+            print(f"Largest difference from the dict loop: max {res['max_max_diff']:.2g}, mean_top_n {res['mean_top_n_max_diff']:.2g}")
+        case "cold_start":
+            res = startup.compare_cold_start(args.runs)
+            if res["missing"]:
+                print(f"Not installed, so not preloaded: {', '.join(res['missing'])}")
+            for name, row in res["clis"].items():
+                print(f"{name}: eager {row['eager_secs'] * 1000:.0f} ms, lazy {row['lazy_secs'] * 1000:.0f} ms ({row['eager_secs'] / row['lazy_secs']:.1f}x)")
+        case "encoder_backends":
+            try:
+                res = vector_search.compare_encoder_backends(args.backends, args.queries, args.docs, args.rerank_docs, args.min_cosine)
+            except ImportError as e:
+                print("Error:", e)
+                return
+            print(f"{res['queries']} queries, {res['docs']} movies, {res['rerank_docs']} reranked per query")
+            for backend, row in res["backends"].items():
+                print(f"{backend}: loaded in {row['load_secs']:.1f}s, {row['query_secs'] * 1000:.1f} ms per query, {row['docs_per_sec']:.0f} movies/s, rerank {row['rerank_secs'] * 1000:.1f} ms per query")
+                if "passes" in row:
+                    print(f"  cosine to float: queries min {row['query_agreement']['min_cosine']:.4f} mean {row['query_agreement']['mean_cosine']:.4f}, movies min {row['doc_agreement']['min_cosine']:.4f} mean {row['doc_agreement']['mean_cosine']:.4f} ({'pass' if row['passes'] else 'FAIL'})")
+                    print(f"  top-10 overlap {row['top10_overlap']:.1%}, rerank top-5 overlap {row['rerank_top5_overlap']:.1%}, max rerank score difference {row['rerank_max_diff']:.3f}")
+        case "rrf_qps":
+            try:
+                res = startup.compare_rrf_qps(args.queries, args.k, args.limit)
+            except FileNotFoundError as e:
+                print("Error:", e)
+                return
+            print(f"{res['queries']} queries per pass")
+            for label, row in res["legs"].items():
+                print(f"{label}: keyword leg {row['keyword_qps']:.1f} QPS, rrf_search {row['rrf_qps']:.1f} QPS")
+        case _:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
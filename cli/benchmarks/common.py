@@ -0,0 +1,50 @@
+from lib import config
+from lib.documents import load_documents
+from lib.vectors import normalize_rows
+import numpy as np
+import tracemalloc
+import random
+
+
+def load_movies() -> list[dict]:
+    return load_documents(config.DATA_FILE_PATH)
+
+def sample_queries(movies: list[dict], count: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        words = rng.choice(movies)["description"].split()
+        n = rng.randint(1, min(4, len(words)))
+        start = rng.randrange(len(words) - n + 1)
+        queries.append(" ".join(words[start:start + n]))
+    return queries
+
+def traced_size(build, *args) -> int:
+    tracemalloc.start()
+    layout = build(*args)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del layout
+    return size
+
+def traced_peak(run, *args) -> int:
+    tracemalloc.start()
+    run(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def clustered_embeddings(rows: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    # Unit vectors around topics that themselves gather around broader themes, closer to
+    # how text embeddings cluster than uniformly random vectors, which no ANN index can
+    # do much with
+    themes = normalize_rows(rng.standard_normal((max(1, rows // 2000), dim), dtype=np.float32))
+    spread = np.float32(1.0 / np.sqrt(dim))
+    topics = themes[rng.integers(0, len(themes), max(1, rows // 20))]
+    topics = normalize_rows(topics + rng.standard_normal(topics.shape, dtype=np.float32) * spread)
+    res = np.empty((rows, dim), dtype=np.float32)
+    for start in range(0, rows, 1 << 16):
+        end = min(rows, start + (1 << 16))
+        noise = rng.standard_normal((end - start, dim), dtype=np.float32) * spread
+        res[start:end] = normalize_rows(topics[rng.integers(0, len(topics), end - start)] + noise)
+    return res
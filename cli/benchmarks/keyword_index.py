@@ -0,0 +1,451 @@
+from collections import Counter
+from lib import config, search_utils
+from lib.keyword_search import InvertedIndex, PostingList, parse_query, preprocess_positions, preprocess_text, preprocess_texts, stem, stemmer
+from lib.index_segment import IndexSegment, write_segment
+from lib.documents import iter_documents, batched
+from lib.result_cache import ResultCache
+from lib.filters import DocFilter
+from lib.spelling import SpellingCorrector
+from benchmarks.common import load_movies, sample_queries, traced_peak, traced_size
+import numpy as np
+import tempfile
+import string
+import pickle
+import random
+import time
+import json
+import os
+
+
+def enlarged_corpus_tokens(movies: list[dict], scale: int) -> list[tuple[int, list[str]]]:
+    # Each copy of the catalog gets fresh IDs but reuses the token lists, so the
+    # enlarged corpus costs no extra stemming and adds nothing to the measured layouts
+    base_tokens = [preprocess_text(f"{m['title']} {m['description']}") for m in movies]
+    max_id = max(m["id"] for m in movies)
+    res = []
+    for copy in range(scale):
+        for m, tokens in zip(movies, base_tokens):
+            res.append((copy * max_id + m["id"], tokens))
+    return res
+
+def build_legacy_layout(docs: list[tuple[int, list[str]]]) -> tuple:
+    index: dict[str, set[int]] = {}
+    term_frequencies: dict[int, Counter] = {}
+    doc_lengths: dict[int, int] = {}
+    for doc_id, tokens in docs:
+        doc_lengths[doc_id] = len(tokens)
+        for t in tokens:
+            if doc_id not in term_frequencies:
+                term_frequencies[doc_id] = Counter()
+            term_frequencies[doc_id][t] += 1
+            if t in index:
+                index[t].add(doc_id)
+            else:
+                index[t] = set([doc_id])
+    return index, term_frequencies, doc_lengths
+
+def build_posting_layout(docs: list[tuple[int, list[str]]]) -> tuple:
+    index: dict[str, PostingList] = {}
+    doc_lengths: dict[int, int] = {}
+    for doc_id, tokens in docs:
+        doc_lengths[doc_id] = len(tokens)
+        for t, tf in Counter(tokens).items():
+            if t not in index:
+                index[t] = PostingList()
+            index[t].append(doc_id, tf)
+    return index, doc_lengths
+
+def compare_index_memory(scale: int) -> dict:
+    docs = enlarged_corpus_tokens(load_movies(), scale)
+    legacy = traced_size(build_legacy_layout, docs)
+    postings = traced_size(build_posting_layout, docs)
+    return {
+        "documents": len(docs),
+        "legacy_bytes": legacy,
+        "posting_bytes": postings,
+    }
+
+def per_posting_bm25_search(idx: InvertedIndex, query: str, limit: int) -> list[tuple[int, float]]:
+    # The scoring path bm25_search used before vectorization: one bm25() call per posting
+    scores: dict[int, float] = {}
+    for t in preprocess_text(query):
+        if t not in idx.index:
+            continue
+        for doc_id in idx.index[t].doc_ids:
+            scores[doc_id] = scores.get(doc_id, 0.0) + idx.bm25(doc_id, t)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+def compare_bm25_scoring(num_queries: int, limit: int) -> dict:
+    idx = InvertedIndex()
+    idx.load()
+    idx.cache = ResultCache(maxsize=0) # time the searches themselves
+    queries = sample_queries(list(idx.docmap.values()), num_queries)
+
+    start = time.perf_counter()
+    reference = [per_posting_bm25_search(idx, q, limit) for q in queries]
+    per_posting_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    vectorized = [idx.bm25_search(q, limit) for q in queries]
+    vectorized_secs = time.perf_counter() - start
+
+    return {
+        "queries": len(queries),
+        "per_posting_secs": per_posting_secs,
+        "vectorized_secs": vectorized_secs,
+        "mismatches": sum(1 for a, b in zip(reference, vectorized) if a != b),
+    }
+
+def compare_pruned_bm25(num_queries: int, limit: int) -> dict:
+    idx = InvertedIndex()
+    idx.load()
+    idx.cache = ResultCache(maxsize=0) # time the searches themselves
+    queries = sample_queries(list(idx.docmap.values()), num_queries)
+    res = {"queries": len(queries)}
+    exhaustive = None
+    for mode in ["exhaustive", "wand", "bmw"]:
+        start = time.perf_counter()
+        results = [idx.bm25_search(q, limit, mode) for q in queries]
+        res[f"{mode}_secs"] = time.perf_counter() - start
+        if exhaustive is None:
+            exhaustive = results
+        else:
+            res[f"{mode}_mismatches"] = sum(1 for a, b in zip(exhaustive, results) if a != b)
+    return res
+
+def compare_index_load(scale: int) -> dict:
+    movies = load_movies()
+    docs = enlarged_corpus_tokens(movies, scale)
+    index, doc_lengths = build_posting_layout(docs)
+    max_id = max(m["id"] for m in movies)
+    docmap = {}
+    for copy in range(scale):
+        for m in movies:
+            # a JSON round trip gives every copy its own strings, as a real catalog would have
+            doc = json.loads(json.dumps(m))
+            doc["id"] = copy * max_id + m["id"]
+            docmap[doc["id"]] = doc
+    lengths = np.zeros(max(doc_lengths) + 1, dtype=np.uint32)
+    for doc_id, length in doc_lengths.items():
+        lengths[doc_id] = length
+    avg_doc_length = sum(doc_lengths.values()) / len(doc_lengths)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pickle_paths = [os.path.join(tmp, name) for name in ["index.pkl", "docmap.pkl", "doc_lengths.pkl"]]
+        for path, obj in zip(pickle_paths, [index, docmap, (lengths, avg_doc_length)]):
+            with open(path, "wb") as f:
+                pickle.dump(obj, f)
+        segment_path = os.path.join(tmp, "index.seg")
+        write_segment(segment_path, index, docmap, lengths, avg_doc_length)
+
+        start = time.perf_counter()
+        for path in pickle_paths:
+            with open(path, "rb") as f:
+                pickle.load(f)
+        pickle_secs = time.perf_counter() - start
+
+        start = time.perf_counter()
+        segment = IndexSegment(segment_path)
+        segment_secs = time.perf_counter() - start
+
+        term = max(index, key=lambda t: len(index[t]))
+        start = time.perf_counter()
+        doc_ids = segment.terms[term].doc_ids
+        segment.docs[doc_ids[0]]
+        first_lookup_secs = time.perf_counter() - start
+        del doc_ids, segment
+
+        return {
+            "documents": len(docmap),
+            "pickle_bytes": sum(os.path.getsize(p) for p in pickle_paths),
+            "segment_bytes": os.path.getsize(segment_path),
+            "pickle_secs": pickle_secs,
+            "segment_secs": segment_secs,
+            "first_lookup_secs": first_lookup_secs,
+        }
+
+def read_whole_catalog(path: str) -> int:
+    with open(path, "r") as f:
+        movies = json.load(f)["movies"]
+    return sum(len(m["description"]) for m in movies)
+
+def read_streamed_catalog(path: str) -> int:
+    chars = 0
+    for batch in batched(iter_documents(path), search_utils.INGEST_BATCH_SIZE):
+        chars += sum(len(m["description"]) for m in batch)
+    return chars
+
+def compare_ingest(scale: int) -> dict:
+    movies = load_movies()
+    max_id = max(m["id"] for m in movies)
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "movies.json")
+        jsonl_path = os.path.join(tmp, "movies.jsonl")
+        with open(json_path, "w") as f, open(jsonl_path, "w") as fl:
+            f.write('{"movies": [')
+            for copy in range(scale):
+                for i, m in enumerate(movies):
+                    doc = dict(m, id=copy * max_id + m["id"])
+                    f.write(("" if copy == 0 and i == 0 else ", ") + json.dumps(doc))
+                    fl.write(json.dumps(doc) + "\n")
+            f.write("]}")
+
+        res = {"documents": len(movies) * scale, "file_bytes": os.path.getsize(json_path)}
+        for name, run, path in [
+            ("json_load", read_whole_catalog, json_path),
+            ("stream_json", read_streamed_catalog, json_path),
+            ("stream_jsonl", read_streamed_catalog, jsonl_path),
+        ]:
+            start = time.perf_counter()
+            run(path)
+            res[f"{name}_secs"] = time.perf_counter() - start
+            res[f"{name}_peak_bytes"] = traced_peak(run, path)
+        return res
+
+def legacy_preprocess_text(text: str) -> list[str]:
+    # the pipeline before stop words were loaded once and stems were cached
+    text = text.lower().translate(str.maketrans("", "", string.punctuation))
+    with open(config.STOP_WORDS_FILE_PATH, "r") as file:
+        stop_words = set(file.read().splitlines())
+    return [stemmer.stem(t) for t in text.split() if t not in stop_words]
+
+def compare_preprocessing() -> dict:
+    texts = [f"{m['title']} {m['description']}" for m in load_movies()]
+    res = {"documents": len(texts)}
+
+    start = time.perf_counter()
+    legacy = [legacy_preprocess_text(t) for t in texts]
+    res["legacy_secs"] = time.perf_counter() - start
+    res["tokens"] = sum(len(t) for t in legacy)
+
+    stem.cache_clear()
+    start = time.perf_counter()
+    cold = preprocess_texts(texts)
+    res["cold_secs"] = time.perf_counter() - start
+    start = time.perf_counter()
+    preprocess_texts(texts)
+    res["warm_secs"] = time.perf_counter() - start
+    res["mismatches"] = sum(1 for a, b in zip(legacy, cold) if a != b)
+    info = stem.cache_info()
+    res["stem_hit_ratio"] = info.hits / max(1, info.hits + info.misses)
+
+    start = time.perf_counter()
+    InvertedIndex().index_documents(iter_documents(config.DATA_FILE_PATH))
+    res["build_secs"] = time.perf_counter() - start
+    return res
+
+def sample_positional_queries(movies: list[dict], count: int, seed: int = 0) -> list[str]:
+    # alternates 2-3 word phrases and NEAR/k pairs, both taken from real descriptions; the
+    # distance is sometimes shorter than the gap, so not every pair matches its own source
+    rng = random.Random(seed)
+    queries = []
+    while len(queries) < count:
+        words = rng.choice(movies)["description"].split()
+        if len(words) < 4:
+            continue
+        if len(queries) % 2 == 0:
+            n = rng.randint(2, 3)
+            start = rng.randrange(len(words) - n + 1)
+            phrase = " ".join(words[start:start + n])
+            # a phrase of only stop words constrains nothing
+            if preprocess_text(phrase):
+                queries.append(f'"{phrase}"')
+        else:
+            distance = rng.randint(1, 5)
+            i = rng.randrange(len(words) - 1)
+            j = rng.randrange(i + 1, min(len(words), i + distance + 3))
+            if preprocess_text(words[i]) and preprocess_text(words[j]):
+                queries.append(f"{words[i]} NEAR/{distance} {words[j]}")
+    return queries
+
+def scan_positional_matches(texts: dict[int, str], query: str) -> set[int]:
+    # The matches of one phrase or NEAR query, by checking every document's token positions
+    phrases, nears = parse_query(query)
+    matches = set()
+    for doc_id, text in texts.items():
+        occurrences: dict[str, set[int]] = {}
+        for t, p in zip(*preprocess_positions(text)):
+            occurrences.setdefault(t, set()).add(p)
+        ok = True
+        for phrase in phrases:
+            tokens, positions = preprocess_positions(phrase)
+            if tokens and not any(all(start + p - positions[0] in occurrences.get(t, ()) for t, p in zip(tokens, positions)) for start in occurrences.get(tokens[0], ())):
+                ok = False
+        for a, b, distance in nears:
+            a_tokens, b_tokens = preprocess_text(a), preprocess_text(b)
+            if a_tokens and b_tokens and not any(abs(pa - pb) <= distance for pa in occurrences.get(a_tokens[0], ()) for pb in occurrences.get(b_tokens[0], ())):
+                ok = False
+        if ok:
+            matches.add(doc_id)
+    return matches
+
+def compare_positional_search(num_queries: int) -> dict:
+    idx = InvertedIndex()
+    idx.load()
+    idx.cache = ResultCache(maxsize=0) # time the searches themselves
+    movies = list(idx.docmap.values())
+    texts = {m["id"]: f"{m['title']} {m['description']}" for m in movies}
+    queries = sample_positional_queries(movies, num_queries)
+    res = {"queries": len(queries)}
+
+    start = time.perf_counter()
+    expected = [scan_positional_matches(texts, q) for q in queries]
+    res["scan_secs"] = time.perf_counter() - start
+    res["matches"] = sum(len(e) for e in expected)
+
+    for mode in ["exhaustive", "wand", "bmw"]:
+        start = time.perf_counter()
+        results = [idx.bm25_search(q, len(texts), mode) for q in queries]
+        res[f"{mode}_secs"] = time.perf_counter() - start
+        res[f"{mode}_mismatches"] = sum(1 for r, e in zip(results, expected) if {doc_id for doc_id, _ in r} != e)
+    return res
+
+def compare_result_cache(num_queries: int, distinct: int, limit: int) -> dict:
+    # A skewed workload: a few popular queries make up most of the traffic
+    idx = InvertedIndex()
+    idx.load()
+    pool = sample_queries(list(idx.docmap.values()), distinct)
+    rng = random.Random(0)
+    weights = [1 / rank for rank in range(1, len(pool) + 1)]
+    queries = rng.choices(pool, weights, k=num_queries)
+    res = {"queries": num_queries, "distinct": len(set(queries))}
+
+    idx.cache = ResultCache(maxsize=0)
+    start = time.perf_counter()
+    uncached = [idx.bm25_search(q, limit) for q in queries]
+    res["uncached_secs"] = time.perf_counter() - start
+
+    idx.cache = ResultCache(maxsize=max(1, distinct // 4))
+    start = time.perf_counter()
+    cached = [idx.bm25_search(q, limit) for q in queries]
+    res["cached_secs"] = time.perf_counter() - start
+    res["mismatches"] = sum(1 for a, b in zip(uncached, cached) if a != b)
+    res["stats"] = idx.cache.stats()
+    return res
+
+def misspell(word: str, rng: random.Random) -> str:
+    # one random deletion, insertion, substitution or transposition
+    i = rng.randrange(len(word))
+    letter = rng.choice(string.ascii_lowercase)
+    match rng.randrange(4):
+        case 0:
+            return word[:i] + word[i + 1:]
+        case 1:
+            return word[:i] + letter + word[i:]
+        case 2:
+            return word[:i] + letter + word[i + 1:]
+        case _:
+            if i == len(word) - 1:
+                i -= 1
+            return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+def compare_spelling(num_words: int) -> dict:
+    idx = InvertedIndex()
+    idx.load()
+    res = {}
+    start = time.perf_counter()
+    corrector = SpellingCorrector.build(idx.document_frequencies(), idx.generation)
+    res["build_secs"] = time.perf_counter() - start
+    res["vocabulary"] = len(corrector.words)
+    res["deletes"] = len(corrector.delete_hashes)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "spelling.npz")
+        corrector.save(path)
+        res["file_bytes"] = os.path.getsize(path)
+        start = time.perf_counter()
+        corrector = SpellingCorrector.load(path)
+        res["load_secs"] = time.perf_counter() - start
+
+    rng = random.Random(0)
+    vocabulary = [str(w) for w in corrector.words if len(w) > 3]
+    pairs = []
+    while len(pairs) < num_words:
+        word = rng.choice(vocabulary)
+        typo = misspell(word, rng)
+        if typo not in corrector.word_ids:
+            pairs.append((typo, word))
+    start = time.perf_counter()
+    corrected = [corrector.correct_word(typo) for typo, _ in pairs]
+    res["correct_secs"] = time.perf_counter() - start
+    res["words"] = len(pairs)
+    res["accuracy"] = sum(1 for c, (_, word) in zip(corrected, pairs) if c == word) / len(pairs)
+    return res
+
+def sample_known_item_queries(movies: list[dict], count: int, seed: int = 0) -> list[tuple[str, int]]:
+    # (query, movie ID) pairs of a title word and two description words, like someone
+    # half-remembering a film
+    rng = random.Random(seed)
+    queries = []
+    while len(queries) < count:
+        m = rng.choice(movies)
+        title_words = [w for w in m["title"].split() if preprocess_text(w)]
+        description_words = [w for w in m["description"].split() if preprocess_text(w)]
+        if not title_words or len(description_words) < 2:
+            continue
+        words = [rng.choice(title_words)] + rng.sample(description_words, 2)
+        queries.append((" ".join(words), m["id"]))
+    return queries
+
+def compare_bm25f(num_queries: int, limit: int) -> dict:
+    idx = InvertedIndex()
+    idx.load()
+    idx.cache = ResultCache(maxsize=0) # time the searches themselves
+    queries = sample_known_item_queries(list(idx.docmap.values()), num_queries)
+    res = {"queries": len(queries)}
+    for name, search in [("bm25", idx.bm25_search), ("bm25f", idx.bm25f_search)]:
+        start = time.perf_counter()
+        results = [search(q, limit) for q, _ in queries]
+        res[f"{name}_secs"] = time.perf_counter() - start
+        ranks = []
+        for r, (_, target) in zip(results, queries):
+            ids = [doc_id for doc_id, _ in r]
+            ranks.append(ids.index(target) + 1 if target in ids else None)
+        res[f"{name}_recall_at_1"] = sum(1 for rank in ranks if rank == 1) / len(ranks)
+        res[f"{name}_recall"] = sum(1 for rank in ranks if rank) / len(ranks)
+        res[f"{name}_mrr"] = sum(1 / rank for rank in ranks if rank) / len(ranks)
+    return res
+
+def post_filtered_search(idx: InvertedIndex, query: str, limit: int, mode: str, allowed: set[int]) -> list[tuple[int, float]]:
+    # what callers had to do before: over-fetch, filter, and fetch deeper until enough pass
+    depth = limit
+    while True:
+        results = idx.bm25_search(query, depth, mode)
+        kept = [r for r in results if r[0] in allowed]
+        if len(kept) >= limit or len(results) < depth:
+            return kept[:limit]
+        depth *= 4
+
+def compare_filters(num_queries: int, limit: int) -> dict:
+    idx = InvertedIndex()
+    idx.load()
+    idx.cache = ResultCache(maxsize=0) # time the searches themselves
+    queries = sample_queries(list(idx.docmap.values()), num_queries)
+    doc_ids = sorted(idx.docmap)
+    rng = random.Random(0)
+    res = {"queries": len(queries), "documents": len(doc_ids), "selectivities": []}
+    for fraction in (0.01, 0.1, 0.5):
+        allowed_ids = rng.sample(doc_ids, max(1, int(len(doc_ids) * fraction)))
+        doc_filter = DocFilter(allowed_ids)
+        allowed = set(allowed_ids)
+        row = {"fraction": fraction, "bitmap_bytes": idx.filter_bitmap(doc_filter).nbytes, "set_bytes": traced_size(set, allowed_ids)}
+        for mode in ("exhaustive", "wand"):
+            start = time.perf_counter()
+            expected = [post_filtered_search(idx, q, limit, mode, allowed) for q in queries]
+            row[f"{mode}_post_secs"] = time.perf_counter() - start
+            start = time.perf_counter()
+            got = [idx.bm25_search(q, limit, mode, doc_filter) for q in queries]
+            row[f"{mode}_pre_secs"] = time.perf_counter() - start
+            row[f"{mode}_mismatches"] = sum(1 for a, b in zip(expected, got) if a != b)
+        res["selectivities"].append(row)
+
+    # a predicate filter scans every document once per index generation, then comes from the cache
+    predicate = DocFilter(predicates=[f"id<{doc_ids[len(doc_ids) // 10]}"])
+    idx.filter_cache.clear()
+    start = time.perf_counter()
+    idx.filter_bitmap(predicate)
+    res["predicate_cold_secs"] = time.perf_counter() - start
+    start = time.perf_counter()
+    idx.filter_bitmap(predicate)
+    res["predicate_cached_secs"] = time.perf_counter() - start
+    return res
@@ -0,0 +1,292 @@
+from lib import config, search_utils
+from lib.vectors import cosine_scores, normalize_rows, open_unit_embeddings, pool_scores, save_unit_embeddings, top_k_rows
+from lib.ivf_index import IVFIndex
+from lib.quantization import STORAGE_MODES, exact_scores
+from lib.query_cache import QueryEmbeddingCache
+from lib.models import check_agreement, cross_encoder, embedding_agreement, sentence_transformer
+from benchmarks.common import clustered_embeddings, load_movies, sample_queries
+import numpy as np
+import multiprocessing
+import tempfile
+import random
+import time
+import json
+import os
+
+
+def loop_cosine_search(embeddings: np.ndarray, query: np.ndarray, limit: int) -> list[tuple[float, int]]:
+    # the per-row loop semantic search used before, with cosine_similarity inlined
+    similarity = []
+    for i in range(len(embeddings)):
+        v = embeddings[i]
+        norm1, norm2 = np.linalg.norm(query), np.linalg.norm(v)
+        similarity.append((0.0 if norm1 == 0 or norm2 == 0 else np.dot(query, v) / (norm1 * norm2), i))
+    return sorted(similarity, key=lambda sim: sim[0], reverse=True)[:limit]
+
+def compare_vector_search(rows: int, dim: int, num_queries: int, loop_queries: int, limit: int) -> dict:
+    # random embeddings stand in for the model's, which makes no difference to the arithmetic
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((rows, dim), dtype=np.float32)
+    queries = rng.standard_normal((num_queries, dim), dtype=np.float32)
+    res = {"rows": rows, "dim": dim, "queries": num_queries, "loop_queries": min(loop_queries, num_queries)}
+
+    start = time.perf_counter()
+    unit = normalize_rows(embeddings)
+    res["normalize_secs"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = []
+    for q in queries:
+        scores = cosine_scores(unit, q)
+        top = top_k_rows(scores, limit)
+        results.append([(float(scores[i]), int(i)) for i in top])
+    res["matmul_secs"] = (time.perf_counter() - start) / num_queries
+
+    start = time.perf_counter()
+    expected = [loop_cosine_search(embeddings, q, limit) for q in queries[:res["loop_queries"]]]
+    res["loop_secs"] = (time.perf_counter() - start) / max(1, res["loop_queries"])
+    res["mismatches"] = sum(1 for a, b in zip(expected, results) if [i for _, i in a] != [i for _, i in b])
+    res["max_score_diff"] = max((abs(float(x) - y) for a, b in zip(expected, results) for (x, _), (y, _) in zip(a, b)), default=0.0)
+    return res
+
+def measure_recall(unit_embeddings: np.ndarray, ivf: IVFIndex, queries: np.ndarray, k: int, nprobes: list[int]) -> list[dict]:
+    # recall@k of the rows found by probing against the exact top k, per nprobe setting
+    exact = []
+    start = time.perf_counter()
+    for q in queries:
+        exact.append(set(top_k_rows(cosine_scores(unit_embeddings, q), k).tolist()))
+    exact_secs = (time.perf_counter() - start) / max(1, len(queries))
+
+    res = []
+    for nprobe in nprobes:
+        found = 0
+        start = time.perf_counter()
+        for q, expected in zip(queries, exact):
+            rows = ivf.probe(q, nprobe)
+            top = rows[top_k_rows(cosine_scores(unit_embeddings, q, rows), k)]
+            found += len(expected & set(top.tolist()))
+        secs = (time.perf_counter() - start) / max(1, len(queries))
+        res.append({"nprobe": nprobe, "recall": found / max(1, k * len(queries)), "secs": secs, "exact_secs": exact_secs})
+    return res
+
+def compare_ivf(rows: int, dim: int, num_queries: int, k: int, nprobes: list[int]) -> dict:
+    rng = np.random.default_rng(0)
+    data = clustered_embeddings(rows + num_queries, dim, rng)
+    unit, queries = data[:rows], data[rows:]
+    start = time.perf_counter()
+    ivf = IVFIndex.build(unit, (rows, dim, 0, 0))
+    build_secs = time.perf_counter() - start
+    return {"rows": rows, "dim": dim, "lists": ivf.num_lists, "build_secs": build_secs, "points": measure_recall(unit, ivf, queries, k, nprobes)}
+
+def compare_quantization(rows: int, dim: int, num_queries: int, limit: int, rescore_factor: int) -> dict:
+    rng = np.random.default_rng(0)
+    data = clustered_embeddings(rows + num_queries, dim, rng)
+    unit, queries = data[:rows], data[rows:]
+    expected = [set(top_k_rows(cosine_scores(unit, q), limit).tolist()) for q in queries]
+    res = {"rows": rows, "dim": dim, "queries": num_queries, "modes": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        # rescoring reads the float32 rows back from a memory-mapped file, as searches do
+        path = os.path.join(tmp, "embeddings.npy")
+        np.save(path, unit)
+        raw = np.load(path, mmap_mode="r")
+        stores = [("float32", None, unit)]
+        for mode, store_cls in STORAGE_MODES.items():
+            start = time.perf_counter()
+            store = store_cls.encode(unit)
+            stores.append((mode, time.perf_counter() - start, store))
+        for mode, encode_secs, store in stores:
+            row = {"mode": mode, "encode_secs": encode_secs, "bytes": store.nbytes}
+            for rescore in ([False, True] if mode != "float32" else [False]):
+                found = 0
+                start = time.perf_counter()
+                for q, exp in zip(queries, expected):
+                    scores = cosine_scores(store, q)
+                    if rescore:
+                        shortlist = top_k_rows(scores, limit * rescore_factor)
+                        top = shortlist[top_k_rows(exact_scores(raw, q, shortlist), limit)]
+                    else:
+                        top = top_k_rows(scores, limit)
+                    found += len(exp & set(top.tolist()))
+                name = "rescored" if rescore else "approx"
+                row[f"{name}_secs"] = (time.perf_counter() - start) / num_queries
+                row[f"{name}_recall"] = found / (limit * num_queries)
+            res["modes"].append(row)
+        del raw
+    return res
+
+def process_memory() -> dict:
+    # Resident set size, and proportional set size, which splits each shared page evenly
+    # between the processes mapping it, so PSS sums to the memory the workers really use
+    res = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("Rss", "Pss"):
+                res[name.lower()] = int(value.split()[0]) * 1024
+    return res
+
+def embeddings_worker(path: str, mapped: bool, query: np.ndarray, barrier, results) -> None:
+    start = time.perf_counter()
+    embeddings = open_unit_embeddings(path) if mapped else np.load(path)
+    load_secs = time.perf_counter() - start
+    start = time.perf_counter()
+    top_k_rows(cosine_scores(embeddings, query), 10)
+    query_secs = time.perf_counter() - start
+    # memory is measured once every worker holds the embeddings, and nobody exits before
+    barrier.wait()
+    memory = process_memory()
+    barrier.wait()
+    results.put({"load_secs": load_secs, "query_secs": query_secs, **memory})
+
+def compare_shared_embeddings(rows: int, dim: int, workers: int) -> dict:
+    rng = np.random.default_rng(0)
+    query = normalize_rows(rng.standard_normal((1, dim), dtype=np.float32))[0]
+    res = {"rows": rows, "dim": dim, "workers": workers, "file_bytes": rows * dim * 4}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "embeddings.npy")
+        save_unit_embeddings(path, clustered_embeddings(rows, dim, rng))
+        for name, mapped in [("read", False), ("mmap", True)]:
+            ctx = multiprocessing.get_context("fork")
+            barrier, results = ctx.Barrier(workers), ctx.Queue()
+            procs = [ctx.Process(target=embeddings_worker, args=(path, mapped, query, barrier, results)) for _ in range(workers)]
+            for p in procs:
+                p.start()
+            stats = [results.get() for _ in procs]
+            for p in procs:
+                p.join()
+            res[name] = {
+                "load_secs": max(s["load_secs"] for s in stats),
+                "query_secs": max(s["query_secs"] for s in stats),
+                "rss": sum(s["rss"] for s in stats),
+                "pss": sum(s["pss"] for s in stats),
+            }
+    return res
+
+def compare_query_cache(num_queries: int, distinct: int, runs: int, encode_ms: float, dtype: str) -> dict:
+    # The skewed query stream of compare_result_cache, replayed by several runs that each
+    # start with an empty in-process LRU, as separate CLI invocations do. The model is
+    # stood in for by a fixed delay, since the point is what the cache saves.
+    pool = sample_queries(load_movies(), distinct)
+    rng = random.Random(0)
+    weights = [1 / rank for rank in range(1, len(pool) + 1)]
+    queries = rng.choices(pool, weights, k=num_queries)
+
+    def encode(query: str) -> np.ndarray:
+        time.sleep(encode_ms / 1000)
+        return np.random.default_rng(len(query)).standard_normal(384).astype(np.float32)
+
+    res = {"queries": num_queries, "distinct": len(set(queries)), "uncached_secs": num_queries * encode_ms / 1000, "runs": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "query_embeddings.sqlite")
+        for _ in range(runs):
+            cache = QueryEmbeddingCache(path, maxsize=max(1, distinct // 4), dtype=dtype)
+            start = time.perf_counter()
+            for q in queries:
+                cache.get_or_encode("benchmark", q, lambda: encode(q))
+            res["runs"].append({"secs": time.perf_counter() - start, **cache.stats()})
+            cache.close()
+        res["file_bytes"] = os.path.getsize(path)
+    return res
+
+def compare_chunk_pooling(movies: int, repeats: int, top_n: int) -> dict:
+    # Chunk metadata for movies with 1 to 8 chunks each, kept as a JSON list of dicts and
+    # as columnar arrays, and one query's chunk scores pooled into movie scores each way
+    rng = np.random.default_rng(0)
+    counts = rng.integers(1, 9, movies)
+    movie_idx = np.repeat(np.arange(movies), counts)
+    chunk_idx = np.arange(len(movie_idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+    scores = rng.random(len(movie_idx), dtype=np.float32)
+    res = {"movies": movies, "chunks": len(movie_idx)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "chunk_metadata.json")
+        with open(json_path, "w") as f:
+            json.dump({"chunks": [{"movie_idx": m, "chunk_idx": c, "total_chunks": int(counts[m])} for m, c in zip(movie_idx.tolist(), chunk_idx.tolist())]}, f, indent=2)
+        npy_path = os.path.join(tmp, "chunk_metadata.npy")
+        np.save(npy_path, np.stack([movie_idx, chunk_idx]))
+        start = time.perf_counter()
+        with open(json_path) as f:
+            chunk_metadata = json.load(f)["chunks"]
+        res["json_load_secs"] = time.perf_counter() - start
+        start = time.perf_counter()
+        mapped_movies = np.load(npy_path, mmap_mode="r")[0]
+        res["npy_load_secs"] = time.perf_counter() - start
+
+        def dict_loop(top: int):
+            per_movie = {}
+            for meta, score in zip(chunk_metadata, scores.tolist()):
+                per_movie.setdefault(meta["movie_idx"], []).append(score)
+            return {m: sum(sorted(s, reverse=True)[:top]) / min(len(s), top) for m, s in per_movie.items()}
+
+        def reduceat(top: int):
+            # segment reduction over the movie-sorted chunks
+            starts = np.cumsum(counts) - counts
+            if top <= 1:
+                return np.maximum.reduceat(scores, starts)
+            ordered = scores[np.lexsort((-scores, movie_idx))]
+            rank = np.arange(len(ordered)) - np.repeat(starts, counts)
+            return np.add.reduceat(np.where(rank < top, ordered, 0), starts) / np.minimum(counts, top)
+
+        res["secs"] = {}
+        for mode, top in [("max", 1), ("mean_top_n", top_n)]:
+            pooled = {}
+            for name, run in [
+                ("dict loop", lambda: dict_loop(top)),
+                ("reduceat", lambda: reduceat(top)),
+                ("ufunc.at", lambda: pool_scores(mapped_movies, scores, movies, mode, top)[1]),
+            ]:
+                start = time.perf_counter()
+                for _ in range(1 if name == "dict loop" else repeats):
+                    pooled[name] = run()
+                res["secs"][f"{mode} {name}"] = (time.perf_counter() - start) / (1 if name == "dict loop" else repeats)
+            loop = np.array([pooled["dict loop"][m] for m in range(movies)], dtype=np.float32)
+            res[f"{mode}_max_diff"] = float(max(np.abs(loop - pooled["reduceat"]).max(), np.abs(loop - pooled["ufunc.at"]).max()))
+        del mapped_movies
+    return res
+
+def compare_encoder_backends(backends: list[str], num_queries: int, num_docs: int, rerank_docs: int, min_cosine: float) -> dict:
+    # Query latency, document throughput and cross-encoder latency of every backend, with
+    # how closely each one's embeddings, rankings and rerank scores follow the float
+    # torch model. A backend below min_cosine is reported as failing the check.
+    movies = load_movies()
+    queries = sample_queries(movies, num_queries)
+    docs = [f"{m['title']}: {m['description']}" for m in movies[:num_docs]]
+    pairs = [[q, d] for q in queries for d in docs[:rerank_docs]]
+    res = {"queries": len(queries), "docs": len(docs), "rerank_docs": rerank_docs, "backends": {}}
+    reference = None
+    for backend in ["torch", *[b for b in backends if b != "torch"]]:
+        row = {}
+        start = time.perf_counter()
+        model = sentence_transformer(config.ENCODER_MODEL_NAME, backend)
+        reranker = cross_encoder(config.CROSS_ENCODER_MODEL_NAME, backend)
+        row["load_secs"] = time.perf_counter() - start
+        model.encode(queries[:2])
+        reranker.predict(pairs[:2])
+
+        start = time.perf_counter()
+        query_embs = np.stack([model.encode([q])[0] for q in queries])
+        row["query_secs"] = (time.perf_counter() - start) / len(queries)
+        start = time.perf_counter()
+        doc_embs = model.encode(docs, batch_size=search_utils.EMBED_BATCH_SIZE)
+        row["docs_per_sec"] = len(docs) / (time.perf_counter() - start)
+        start = time.perf_counter()
+        rerank_scores = np.array([reranker.predict(pairs[i:i + rerank_docs]) for i in range(0, len(pairs), rerank_docs)], dtype=np.float32)
+        row["rerank_secs"] = (time.perf_counter() - start) / len(queries)
+
+        top = [top_k_rows(scores, 10) for scores in normalize_rows(query_embs) @ normalize_rows(doc_embs).T]
+        reranked = [top_k_rows(scores, 5) for scores in rerank_scores]
+        if reference is None:
+            reference = {"query_embs": query_embs, "doc_embs": doc_embs, "top": top, "rerank_scores": rerank_scores, "reranked": reranked}
+        else:
+            row["query_agreement"] = embedding_agreement(reference["query_embs"], query_embs)
+            row["doc_agreement"] = embedding_agreement(reference["doc_embs"], doc_embs)
+            row["top10_overlap"] = float(np.mean([len(set(a.tolist()) & set(b.tolist())) / 10 for a, b in zip(reference["top"], top)]))
+            row["rerank_max_diff"] = float(np.abs(reference["rerank_scores"] - rerank_scores).max())
+            row["rerank_top5_overlap"] = float(np.mean([len(set(a.tolist()) & set(b.tolist())) / 5 for a, b in zip(reference["reranked"], reranked)]))
+            try:
+                check_agreement(np.concatenate([reference["query_embs"], reference["doc_embs"]]), np.concatenate([query_embs, doc_embs]), min_cosine)
+                row["passes"] = True
+            except ValueError:
+                row["passes"] = False
+        res["backends"][backend] = row
+    return res
@@ -1,6 +1,5 @@
 import argparse
 import mimetypes
-from google.genai import types
 from lib import search_utils
 
 def main() -> None:
@@ -10,6 +9,7 @@ def main() -> None:
     parser.add_argument("--query", type=str, required=True, help="Text query to rewrite")
 
     args = parser.parse_args()
+    from google.genai import types # deferred, it takes most of a second to import
 
     mime, _ = mimetypes.guess_type(args.image)
     mime = mime or "image/jpeg"
@@ -1,4 +1,5 @@
 from lib import config, hybrid_search
+from lib.documents import load_documents
 import argparse
 import json
 
@@ -18,8 +19,7 @@ def main():
     with open(config.GOLDEN_DATASET_FILE_PATH) as file:
             golden_data = json.load(file)
     
-    with open(config.DATA_FILE_PATH) as file:
-         document = json.load(file)["movies"]
+    document = load_documents()
 
     hs = hybrid_search.HybridSearch(document)
     res = []
@@ -45,5 +45,8 @@ def main():
         print(f"- Query: {tc['query']}\n  - Precision@{args.limit}: {precision:.4f}\n  - Recall@{args.limit}: {recall:.4f}\n  - F1 Score: {f1:.4f}\n  - Retrieved: {retrieved_docs}\n  - Relevant: {relevant_docs}")
         print("\n")
 
+    stats = hs.semantic_search.query_cache.stats()
+    print(f"Query embeddings: {stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, {stats['misses']} encoded (hit ratio {stats['hit_ratio']:.1%})")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
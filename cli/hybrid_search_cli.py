@@ -1,6 +1,7 @@
 import argparse
-import json
 from lib import hybrid_search, search_utils, config, enhance_search, reranking, evaluation
+from lib.documents import load_documents
+from lib.filters import parse_filter
 
 
 def main() -> None:
@@ -14,14 +15,20 @@ def main() -> None:
     weighted_search_parser.add_argument("query", type=str, help="Query")
     weighted_search_parser.add_argument("--alpha", type=float, nargs='?', default=search_utils.ALPHA_VAL, help="Alpha parameter to determine seach type weightage")
     weighted_search_parser.add_argument("--limit", type=int, nargs='?', default=search_utils.SEARCH_LIMIT, help="Search limit")
+    weighted_search_parser.add_argument("--leg-timeout", type=float, default=search_utils.HYBRID_LEG_TIMEOUT, help="Seconds the keyword or semantic leg may take before results are fused from the other leg alone")
+    weighted_search_parser.add_argument("--ids", type=int, nargs="+", help="Only return these movie IDs")
+    weighted_search_parser.add_argument("--where", type=str, action="append", help="Only return movies matching field<op>value, op one of = != < <= > >= ~ (contains); repeatable, all must hold")
 
     rrf_search_parser = subparsers.add_parser("rrf-search", help = "Perform Reciprocal Rank Fusion search")
     rrf_search_parser.add_argument("query", type=str, help="Query")
     rrf_search_parser.add_argument("-k", type=int, nargs='?', default=search_utils.DEFAULT_RRF_K, help="Controls the gap between ranks")
     rrf_search_parser.add_argument("--limit", type=int, nargs='?', default=search_utils.SEARCH_LIMIT, help="Search limit")
-    rrf_search_parser.add_argument("--enhance", type=str, choices=["spell", "rewrite", "expand"], help="Query enhancement method")
+    rrf_search_parser.add_argument("--enhance", type=str, choices=["spell", "local_spell", "rewrite", "expand"], help="Query enhancement method; local_spell fixes typos against the index vocabulary without an LLM call")
     rrf_search_parser.add_argument("--rerank-method", type=str, choices=["individual", "batch", "cross_encoder"], help="Rerank the results")
     rrf_search_parser.add_argument("--evaluate", action="store_true", help="evaluate search with LLM")
+    rrf_search_parser.add_argument("--leg-timeout", type=float, default=search_utils.HYBRID_LEG_TIMEOUT, help="Seconds the keyword or semantic leg may take before results are fused from the other leg alone")
+    rrf_search_parser.add_argument("--ids", type=int, nargs="+", help="Only return these movie IDs")
+    rrf_search_parser.add_argument("--where", type=str, action="append", help="Only return movies matching field<op>value, op one of = != < <= > >= ~ (contains); repeatable, all must hold")
 
     args = parser.parse_args()
 
@@ -31,21 +38,36 @@ def main() -> None:
             for s in norm_scores:
                 print(f"* {s:.4f}")
         case "weighted-search":
+            try:
+                doc_filter = parse_filter(args.ids, args.where)
+            except ValueError as e:
+                print("Error:", e)
+                return
             # Load movies json
-            with open(config.DATA_FILE_PATH, "r") as f:
-                documents = json.load(f)["movies"]
-            hs = hybrid_search.HybridSearch(documents)
-            data: dict = hs.weighted_search(args.query, args.alpha, args.limit)
+            documents = load_documents()
+            hs = hybrid_search.HybridSearch(documents, leg_timeout=args.leg_timeout)
+            try:
+                data: dict = hs.weighted_search(args.query, args.alpha, args.limit, doc_filter)
+            except (ValueError, TimeoutError) as e:
+                print("Error:", e)
+                return
+            if data.dropped_legs:
+                print(f"Timed out, fused without: {', '.join(data.dropped_legs)}")
             for i, k in enumerate(data, start=1):
                 print(f"{i}. {data[k]['doc']['title']}\nHybrid Score: {data[k]['hybrid_score']}\nBM25: {data[k]['keyword_score']}, Semantic: {data[k]['semantic_score']}\n{data[k]['doc']['description']}")
         case "rrf-search":
+            try:
+                doc_filter = parse_filter(args.ids, args.where)
+            except ValueError as e:
+                print("Error:", e)
+                return
+
             # LOGS
             print(f"Original query: {args.query}")
 
             # Load movies json
-            with open(config.DATA_FILE_PATH, "r") as f:
-                documents = json.load(f)["movies"]
-            hs = hybrid_search.HybridSearch(documents)
+            documents = load_documents()
+            hs = hybrid_search.HybridSearch(documents, leg_timeout=args.leg_timeout)
 
             if args.enhance:
                 method = args.enhance
@@ -59,7 +81,13 @@ def main() -> None:
             else:
                 extra_limit = args.limit
             
-            final_results = hs.rrf_search(args.query, args.k, extra_limit) #RRF DATA
+            try:
+                final_results = hs.rrf_search(args.query, args.k, extra_limit, doc_filter) #RRF DATA
+            except (ValueError, TimeoutError) as e:
+                print("Error:", e)
+                return
+            if final_results.dropped_legs:
+                print(f"Timed out, fused without: {', '.join(final_results.dropped_legs)}")
 
             # LOG RRF results
             print(f"RRF search returned {len(final_results)} results")
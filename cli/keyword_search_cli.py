@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import math
 import argparse
-from lib import search_utils
+from lib import search_utils, config
+from lib.documents import load_documents
+from lib.filters import parse_filter
 from lib.keyword_search import read_movies_data, InvertedIndex, preprocess_text
 
 def main() -> None:
@@ -12,6 +14,18 @@ def main() -> None:
     search_parser.add_argument("query", type=str, help="Search query")
 
     build_parser = subparsers.add_parser("build", help="Build inverted index and save it to disk")
+    build_parser.add_argument("--workers", type=int, default=1, help="Number of processes to tokenize and index with")
+    build_parser.add_argument("--no-positions", action="store_true", help="Skip storing term positions; makes the index smaller but disables phrase and NEAR queries")
+
+    migrate_parser = subparsers.add_parser("migrate", help="Convert pickle index caches to the memory-mapped segment format")
+
+    update_parser = subparsers.add_parser("update", help="Add or replace documents in the index without a full rebuild")
+    update_parser.add_argument("path", type=str, help="JSON file with a list of movies or an object with a 'movies' list, or a JSON Lines file of movies")
+
+    delete_parser = subparsers.add_parser("delete", help="Remove documents from the index")
+    delete_parser.add_argument("doc_ids", type=int, nargs="+", help="Document IDs")
+
+    merge_parser = subparsers.add_parser("merge", help="Compact all index segments into one and drop deleted documents")
 
 
     tf_parser = subparsers.add_parser("tf", help="Returns the term frequency of a token")
@@ -38,7 +52,13 @@ def main() -> None:
     bm25_tf_parser.add_argument("b", type=float, nargs='?', default=search_utils.BM25_B, help="Tunable BM25 b parameter")
 
     bm25search_parser = subparsers.add_parser("bm25search", help="Search movies using full BM25 scoring")
-    bm25search_parser.add_argument("query", type=str, help="Search query")
+    bm25search_parser.add_argument("query", type=str, help='Search query; "quoted phrases" and word NEAR/k word restrict the results')
+    bm25search_parser.add_argument("--limit", type=int, nargs='?', default=search_utils.SEARCH_LIMIT, help="Search limit")
+    bm25search_parser.add_argument("--mode", type=str, choices=["exhaustive", "wand", "bmw", "bm25f"], default="exhaustive", help="Score every matching document, prune with WAND / Block-Max WAND, or score title and description as separate fields")
+    bm25search_parser.add_argument("--title-weight", type=float, default=search_utils.BM25F_TITLE_WEIGHT, help="BM25F weight of title matches")
+    bm25search_parser.add_argument("--description-weight", type=float, default=search_utils.BM25F_DESCRIPTION_WEIGHT, help="BM25F weight of description matches")
+    bm25search_parser.add_argument("--ids", type=int, nargs="+", help="Only return these movie IDs")
+    bm25search_parser.add_argument("--where", type=str, action="append", help="Only return movies matching field<op>value, op one of = != < <= > >= ~ (contains); repeatable, all must hold")
 
     args = parser.parse_args()
 
@@ -58,8 +78,39 @@ def main() -> None:
                 print(f"{m['id']}. {m['title']}")
 
         case "build":
-            idx.build()
+            idx = InvertedIndex(positions=not args.no_positions)
+            idx.build(args.workers)
+            idx.save()
+        case "migrate":
+            try:
+                idx.load_pickles()
+            except FileNotFoundError as e:
+                print("Error:", e)
+                return
             idx.save()
+            print(f"Migrated {len(idx.docmap)} documents and {len(idx.index)} terms to {config.INDEX_DIR_PATH}")
+        case "update":
+            movies = load_documents(args.path)
+            try:
+                idx.add_documents(movies)
+            except FileNotFoundError as e:
+                print("Error:", e)
+                return
+            print(f"Indexed {len(movies)} documents, {len(idx.docmap)} documents in the index")
+        case "delete":
+            try:
+                idx.delete_documents(args.doc_ids)
+            except FileNotFoundError as e:
+                print("Error:", e)
+                return
+            print(f"{len(idx.docmap)} documents in the index")
+        case "merge":
+            try:
+                merged = idx.merge()
+            except FileNotFoundError as e:
+                print("Error:", e)
+                return
+            print("Merged index segments" if merged else "Nothing to merge")
         case "tf":
             try:
                 idx.load()
@@ -111,11 +162,19 @@ def main() -> None:
             except FileNotFoundError as e:
                 print("Error:", e)
                 return
-            search_res = idx.bm25_search(args.query, 5)
+            try:
+                doc_filter = parse_filter(args.ids, args.where)
+                if args.mode == "bm25f":
+                    search_res = idx.bm25f_search(args.query, args.limit, args.title_weight, args.description_weight, doc_filter)
+                else:
+                    search_res = idx.bm25_search(args.query, args.limit, args.mode, doc_filter)
+            except ValueError as e:
+                print("Error:", e)
+                return
             for i, score_tup in enumerate(search_res, start=1):
                 title = idx.docmap[score_tup[0]]["title"]
                 score = score_tup[1]
-                print(f"{i}. ({score_tup[0]}) {i, title} enumerate(- Scor, start=1)e: {score:.2f}")
+                print(f"{i}. ({score_tup[0]}) {title} - Score: {score:.2f}")
 
         case _:
             parser.print_help()
@@ -5,12 +5,22 @@ PROJECT_ROOT = BASE_DIR.parent.parent
 DATA_FILE_PATH = PROJECT_ROOT/"data"/"movies.json"
 STOP_WORDS_FILE_PATH = PROJECT_ROOT/"data"/"stop_words.txt"
 CACHE_FILE_PATH = PROJECT_ROOT/"cache"
+INDEX_DIR_PATH = CACHE_FILE_PATH/"index"
+INDEX_MANIFEST_FILE_PATH = INDEX_DIR_PATH/"manifest.json"
+SPELLING_CACHE_FILE_PATH = INDEX_DIR_PATH/"spelling.npz"
 INDEX_CACHE_FILE_PATH = CACHE_FILE_PATH/"index.pkl"
 DOCMAP_CACHE_FILE_PATH = CACHE_FILE_PATH/"docmap.pkl"
 TERM_FREQ_CACHE_FILE_PATH = CACHE_FILE_PATH/"term_frequencies.pkl"
 DOC_LEN_CACHE_FILE_PATH = CACHE_FILE_PATH/"doc_lengths.pkl"
 MOVIE_EMBEDDINGS_CACHE_FILE_PATH = CACHE_FILE_PATH/"movie_embeddings.npy"
+MOVIE_HASHES_CACHE_FILE_PATH = CACHE_FILE_PATH/"movie_embeddings.hashes.npy"
 CHUNK_EMBEDDINGS_CACHE_FILE_PATH = CACHE_FILE_PATH/"chunk_embeddings.npy"
-CHUNK_METADATA_CACHE_FILE_PATH = CACHE_FILE_PATH/"chunk_metadata.json"
+CHUNK_HASHES_CACHE_FILE_PATH = CACHE_FILE_PATH/"chunk_embeddings.hashes.npy"
+CHUNK_DOCUMENT_HASHES_CACHE_FILE_PATH = CACHE_FILE_PATH/"chunk_documents.hashes.npy"
+CHUNK_METADATA_CACHE_FILE_PATH = CACHE_FILE_PATH/"chunk_metadata.npy"
+CHUNK_IVF_CACHE_FILE_PATH = CACHE_FILE_PATH/"chunk_ivf.npz"
+QUERY_EMBEDDINGS_CACHE_FILE_PATH = CACHE_FILE_PATH/"query_embeddings.sqlite"
+ONNX_MODELS_DIR_PATH = CACHE_FILE_PATH/"onnx"
+ENCODER_MODEL_NAME = "all-MiniLM-L6-v2"
 CROSS_ENCODER_MODEL_NAME = "cross-encoder/ms-marco-TinyBERT-L2-v2"
 GOLDEN_DATASET_FILE_PATH = PROJECT_ROOT/"data"/"golden_dataset.json"
\ No newline at end of file
@@ -0,0 +1,132 @@
+from collections.abc import Iterable, Iterator, Mapping
+from itertools import islice
+from pathlib import Path
+from lib import config
+import tempfile
+import json
+import os
+import re
+
+READ_CHUNK_SIZE = 1 << 16
+WHITESPACE = re.compile(r"\s*")
+SEPARATORS = re.compile(r"[\s,]*")
+
+
+def iter_documents(path: str | Path = config.DATA_FILE_PATH) -> Iterator[dict]:
+    # .jsonl holds one movie per line; anything else is {"movies": [...]} or a bare array
+    with open(path, "r") as f:
+        if str(path).endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from iter_json_array(f)
+
+def iter_json_array(f) -> Iterator[dict]:
+    stream = JsonStream(f)
+    if stream.peek() == "{":
+        # keys before "movies" are skipped, buffering only one value at a time
+        stream.pos += 1
+        while True:
+            if stream.peek() != '"':
+                raise ValueError(f'Expected a "movies" array in {f.name}')
+            key = stream.value()
+            stream.expect(":")
+            if key == "movies":
+                break
+            stream.value()
+            if stream.peek() == ",":
+                stream.pos += 1
+    stream.expect("[")
+    while True:
+        c = stream.peek(SEPARATORS)
+        if c == "]":
+            return
+        if not c:
+            raise ValueError(f"Movie array in {f.name} is not closed")
+        yield stream.value()
+
+
+class JsonStream:
+    """Decodes JSON values from a file one at a time, reading READ_CHUNK_SIZE characters at once."""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def read(self) -> bool:
+        # appends a chunk to what is left of the buffer; False at end of file
+        chunk = self.f.read(READ_CHUNK_SIZE)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return not self.eof
+
+    def peek(self, skip: re.Pattern = WHITESPACE) -> str:
+        # the next character after skip, "" at end of file
+        while True:
+            self.pos = skip.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self.read():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at the start of the movie array in {self.f.name}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self.read()
+                continue
+            # a number running to the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.eof:
+                self.read()
+                continue
+            self.pos = end
+            return value
+
+
+class SpooledDocuments(Mapping):
+    """Document ID -> movie dict, kept JSON-encoded in a temporary file with only offsets in memory."""
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.offsets: dict[int, tuple[int, int]] = {}
+        self.end = 0
+
+    def add(self, doc: dict) -> None:
+        data = json.dumps(doc).encode("utf-8")
+        os.pwrite(self.file.fileno(), data, self.end)
+        self.offsets[doc["id"]] = (self.end, len(data))
+        self.end += len(data)
+
+    def __getitem__(self, doc_id: int) -> dict:
+        start, length = self.offsets[doc_id]
+        return json.loads(os.pread(self.file.fileno(), length, start))
+
+    def __contains__(self, doc_id: object) -> bool:
+        return doc_id in self.offsets
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+
+def load_documents(path: str | Path = config.DATA_FILE_PATH) -> list[dict]:
+    return list(iter_documents(path))
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    it = iter(items)
+    while batch := list(islice(it, size)):
+        yield batch
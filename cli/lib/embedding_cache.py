@@ -0,0 +1,72 @@
+from collections.abc import Callable
+from lib.vectors import is_normalized
+import numpy as np
+import hashlib
+import os
+
+
+class EmbeddingCache:
+    """Embeddings of a previous build, looked up by the 64-bit content hash of their text."""
+
+    def __init__(self, hashes: np.ndarray, embeddings: np.ndarray | None):
+        self.order = np.argsort(hashes, kind="stable")
+        self.sorted_hashes = np.asarray(hashes)[self.order]
+        self.embeddings = embeddings # memory-mapped
+        self.reused = 0
+        self.encoded = 0
+
+    @classmethod
+    def load(cls, embeddings_path, hashes_path) -> "EmbeddingCache":
+        # empty when the files are missing, were written before hashes existed, or disagree
+        if os.path.exists(embeddings_path) and os.path.exists(hashes_path):
+            embeddings = np.load(embeddings_path, mmap_mode="r")
+            hashes = np.load(hashes_path)
+            if len(hashes) == len(embeddings) and is_normalized(embeddings):
+                return cls(hashes, embeddings)
+        return cls(np.zeros(0, dtype=np.uint64), None)
+
+    def lookup(self, hashes: np.ndarray) -> np.ndarray:
+        # row of each hash in the previous build, -1 where it had none
+        if len(self.sorted_hashes) == 0:
+            return np.full(len(hashes), -1, dtype=np.int64)
+        i = np.minimum(np.searchsorted(self.sorted_hashes, hashes), len(self.sorted_hashes) - 1)
+        return np.where(self.sorted_hashes[i] == hashes, self.order[i], -1)
+
+    def embed(self, texts: list[str], hashes: np.ndarray, encode: Callable[[list[str], np.ndarray], np.ndarray], dim: int) -> np.ndarray:
+        # reused rows are read in file order; the missing texts are encoded in one call
+        rows = self.lookup(hashes)
+        res = np.empty((len(texts), dim), dtype=np.float32)
+        reuse = np.flatnonzero(rows >= 0)
+        if len(reuse):
+            order = np.argsort(rows[reuse], kind="stable")
+            res[reuse[order]] = self.embeddings[rows[reuse][order]]
+        missing = np.flatnonzero(rows < 0)
+        if len(missing):
+            res[missing] = encode([texts[i] for i in missing.tolist()], hashes[missing])
+        self.reused += len(reuse)
+        self.encoded += len(missing)
+        return res
+
+
+def content_hashes(texts: list[str], *salt) -> np.ndarray:
+    # salt is everything else the embedding depends on, such as the model and chunking parameters
+    prefix = "\0".join(str(s) for s in salt).encode() + b"\0\0"
+    digests = b"".join(hashlib.blake2b(prefix + t.encode(), digest_size=8).digest() for t in texts)
+    return np.frombuffer(digests, dtype=np.uint64).copy()
+
+def save_hashes(path, hashes: np.ndarray) -> None:
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, np.asarray(hashes, dtype=np.uint64))
+    os.replace(tmp_path, path)
+
+def clear_hashes(path) -> None:
+    # called before the embeddings the hashes describe are rewritten
+    if os.path.exists(path):
+        os.remove(path)
+
+def hashes_match(path, hashes: np.ndarray) -> bool:
+    # whether the hashes stored at path are exactly these, in this order
+    if not os.path.exists(path):
+        return False
+    stored = np.load(path, mmap_mode="r")
+    return stored.shape == hashes.shape and bool(np.array_equal(stored, hashes))
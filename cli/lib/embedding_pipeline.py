@@ -0,0 +1,127 @@
+from pathlib import Path
+from lib import search_utils
+from lib.embedding_cache import EmbeddingCache
+import numpy as np
+import resource
+import time
+import os
+
+HEADER_BYTES = 128 # fixed .npy header size for checkpoint files, so rows can be appended in place
+
+
+class EmbeddingPipeline:
+    """Encodes texts longest first, in batches of similar length, checkpointing every checkpoint_rows."""
+
+    def __init__(self, model, embeddings_path: str | Path, batch_size: int = search_utils.EMBED_BATCH_SIZE, workers: int = search_utils.EMBED_WORKERS, checkpoint_rows: int = search_utils.EMBED_CHECKPOINT_ROWS):
+        self.model = model
+        self.vectors_path, self.hashes_path = checkpoint_paths(embeddings_path)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.checkpoint_rows = checkpoint_rows
+        self.pool = None
+        os.makedirs(self.vectors_path.parent, exist_ok=True)
+        self.checkpoint = load_checkpoint(self.vectors_path, self.hashes_path, model.get_sentence_embedding_dimension())
+        self.encoded = 0
+        self.resumed = 0 # texts found in the checkpoint of an interrupted build
+        self.encode_secs = 0.0
+
+    def __enter__(self) -> "EmbeddingPipeline":
+        if self.workers > 1:
+            self.pool = self.model.start_multi_process_pool(["cpu"] * self.workers)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+    def encode(self, texts: list[str], hashes: np.ndarray) -> np.ndarray:
+        res = self.checkpoint.embed(texts, hashes, self.__encode_missing, self.model.get_sentence_embedding_dimension())
+        self.resumed = self.checkpoint.reused
+        return res
+
+    def finish(self) -> None:
+        # the build is saved, so its checkpoint is no longer needed
+        for path in (self.vectors_path, self.hashes_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def stats(self) -> dict:
+        return {
+            "encoded": self.encoded,
+            "resumed": self.resumed,
+            "encode_secs": self.encode_secs,
+            "texts_per_sec": self.encoded / self.encode_secs if self.encode_secs else 0.0,
+            "peak_rss": peak_rss(),
+        }
+
+    def __encode_missing(self, texts: list[str], hashes: np.ndarray) -> np.ndarray:
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        res = np.empty((len(texts), self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(texts), self.checkpoint_rows):
+            part = order[start:start + self.checkpoint_rows]
+            batch = [texts[i] for i in part.tolist()]
+            began = time.perf_counter()
+            if self.pool is not None:
+                vectors = self.model.encode_multi_process(batch, self.pool, batch_size=self.batch_size)
+            else:
+                vectors = self.model.encode(batch, batch_size=self.batch_size, show_progress_bar=False)
+            self.encode_secs += time.perf_counter() - began
+            res[part] = vectors
+            self.encoded += len(batch)
+            # vectors before hashes, so a checkpoint cut short never pairs a hash with a missing row
+            append_rows(self.vectors_path, res[part])
+            append_rows(self.hashes_path, hashes[part])
+        return res
+
+
+def checkpoint_paths(embeddings_path: str | Path) -> tuple[Path, Path]:
+    # chunk_embeddings.npy -> chunk_embeddings.partial.npy and chunk_embeddings.partial.hashes.npy
+    path = Path(embeddings_path)
+    return path.with_suffix(".partial.npy"), path.with_suffix(".partial.hashes.npy")
+
+def load_checkpoint(vectors_path: Path, hashes_path: Path, dim: int) -> EmbeddingCache:
+    # only rows with both a vector and a hash are kept
+    if os.path.exists(vectors_path) and os.path.exists(hashes_path):
+        shape = np.load(vectors_path, mmap_mode="r").shape
+        if len(shape) == 2 and shape[1] == dim:
+            rows = min(shape[0], len(np.load(hashes_path, mmap_mode="r")))
+            truncate_rows(vectors_path, rows)
+            truncate_rows(hashes_path, rows)
+            return EmbeddingCache(np.load(hashes_path), np.load(vectors_path, mmap_mode="r"))
+    for path in (vectors_path, hashes_path):
+        if os.path.exists(path):
+            os.remove(path)
+    return EmbeddingCache(np.zeros(0, dtype=np.uint64), None)
+
+def append_rows(path: Path, rows: np.ndarray) -> None:
+    # the header is rewritten last, so a crash in between leaves bytes it does not count
+    rows = np.ascontiguousarray(rows)
+    count = len(np.load(path, mmap_mode="r")) if os.path.exists(path) else 0
+    with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+        f.seek(HEADER_BYTES + count * rows[:1].nbytes)
+        f.write(rows.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+        write_header(f, rows.dtype, (count + len(rows), *rows.shape[1:]))
+
+def truncate_rows(path: Path, rows: int) -> None:
+    arr = np.load(path, mmap_mode="r")
+    dtype, shape, row_bytes = arr.dtype, arr.shape, arr[:1].nbytes
+    del arr
+    with open(path, "r+b") as f:
+        write_header(f, dtype, (rows, *shape[1:]))
+        f.truncate(HEADER_BYTES + rows * row_bytes)
+
+def write_header(f, dtype: np.dtype, shape: tuple[int, ...]) -> None:
+    # a version 1.0 .npy header padded with spaces to HEADER_BYTES
+    header = repr({"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": shape})
+    f.seek(0)
+    f.write(b"\x93NUMPY\x01\x00" + (HEADER_BYTES - 10).to_bytes(2, "little") + header.encode("latin1").ljust(HEADER_BYTES - 11) + b"\n")
+
+def peak_rss() -> dict:
+    # ru_maxrss is in KiB on Linux
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,
+    }
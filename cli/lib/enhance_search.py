@@ -1,4 +1,4 @@
-from lib import search_utils
+from lib import search_utils, spelling
 
 def get_response(prompt: str) -> str:
     response = search_utils.client.models.generate_content(
@@ -70,6 +70,8 @@ def enhance_query(query: str, method: str) -> str:
     match method:
         case "spell":
             return spell(query)
+        case "local_spell":
+            return spelling.correct_query(query)
         case "rewrite":
             return rewrite(query)
         case "expand":
@@ -0,0 +1,200 @@
+from collections.abc import Hashable, Iterable
+from lib.result_cache import ResultCache
+import numpy as np
+import operator
+import re
+
+CONTAINER_BITS = 16
+LOW_MASK = (1 << CONTAINER_BITS) - 1
+ARRAY_CONTAINER_MAX = 4096 # past this many IDs the 8 KiB bitset is smaller than a uint16 array
+PREDICATE = re.compile(r"\s*(\w+)\s*(<=|>=|!=|=|<|>|~)\s*(.*?)\s*")
+OPERATORS = {
+    "=": operator.eq,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "~": lambda field_value, value: value in field_value,
+}
+
+
+class Bitmap:
+    """Set of document IDs in containers by high 16 bits, each a sorted uint16 array or an 8 KiB bitset."""
+
+    def __init__(self, containers: dict[int, np.ndarray]):
+        self.containers = containers # high bits -> sorted uint16 low bits, or a uint64 bitset
+        self._array: np.ndarray | None = None
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[int] | np.ndarray) -> "Bitmap":
+        ids = np.unique(np.asarray(ids if isinstance(ids, np.ndarray) else list(ids), dtype=np.int64))
+        if len(ids) and ids[0] < 0:
+            raise ValueError("Document IDs must not be negative")
+        containers = {}
+        if len(ids):
+            starts = np.flatnonzero(np.diff(ids >> CONTAINER_BITS)) + 1
+            for chunk in np.split(ids, starts):
+                containers[int(chunk[0]) >> CONTAINER_BITS] = make_container((chunk & LOW_MASK).astype(np.uint16))
+        return cls(containers)
+
+    def __len__(self) -> int:
+        return sum(container_size(c) for c in self.containers.values())
+
+    def __contains__(self, doc_id: int) -> bool:
+        c = self.containers.get(doc_id >> CONTAINER_BITS)
+        return c is not None and bool(container_contains(c, np.array([doc_id & LOW_MASK], dtype=np.uint16))[0])
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        # boolean mask of which of the given IDs are in the set
+        ids = np.asarray(ids, dtype=np.int64)
+        mask = np.zeros(len(ids), dtype=bool)
+        highs = ids >> CONTAINER_BITS
+        for high in np.unique(highs).tolist():
+            c = self.containers.get(high)
+            if c is None:
+                continue
+            sel = np.flatnonzero(highs == high)
+            mask[sel] = container_contains(c, (ids[sel] & LOW_MASK).astype(np.uint16))
+        return mask
+
+    def to_array(self) -> np.ndarray:
+        # sorted IDs, computed once since the set never changes
+        if self._array is None:
+            parts = [(high << CONTAINER_BITS) + container_lows(self.containers[high]).astype(np.int64) for high in sorted(self.containers)]
+            self._array = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+        return self._array
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        containers = {}
+        for high in self.containers.keys() & other.containers.keys():
+            a, b = self.containers[high], other.containers[high]
+            if is_bitset(a) and is_bitset(b):
+                c = compact(a & b)
+            else:
+                if is_bitset(a):
+                    a, b = b, a
+                c = make_container(a[container_contains(b, a)])
+            if container_size(c):
+                containers[high] = c
+        return Bitmap(containers)
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        containers = dict(self.containers)
+        for high, b in other.containers.items():
+            a = containers.get(high)
+            if a is None:
+                containers[high] = b
+            elif is_bitset(a) or is_bitset(b):
+                containers[high] = compact(to_bitset(a) | to_bitset(b))
+            else:
+                containers[high] = make_container(np.union1d(a, b))
+        return Bitmap(containers)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(c.nbytes for c in self.containers.values())
+
+
+class DocFilter:
+    """Movie ID allowlist and/or field<op>value predicates; hashable so it can key cached results."""
+
+    def __init__(self, ids: Iterable[int] | None = None, predicates: Iterable[str] = ()):
+        self.ids = Bitmap.from_ids(ids) if ids is not None else None
+        self.predicates = tuple(parse_predicate(p) for p in predicates)
+        if self.ids is None and not self.predicates:
+            raise ValueError("A filter needs document IDs or at least one predicate")
+        self.key = (tuple(self.ids.to_array().tolist()) if self.ids is not None else None, self.predicates)
+        self._hash = hash(self.key)
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, DocFilter) and self.key == other.key
+
+    def bitmap(self, documents: Iterable[dict], cache: ResultCache | None = None, generation: Hashable = None) -> Bitmap:
+        # with a cache, each predicate's bitmap is kept too
+        if cache is None or generation is None:
+            return self.__bitmap(documents, None, None)
+        return cache.get_or_compute(("filter", self), generation, lambda: self.__bitmap(documents, cache, generation))
+
+    def __bitmap(self, documents: Iterable[dict], cache: ResultCache | None, generation: Hashable) -> Bitmap:
+        result = self.ids
+        for predicate in self.predicates:
+            if cache is None:
+                matched = predicate_bitmap(documents, predicate)
+            else:
+                matched = cache.get_or_compute(("predicate", predicate), generation, lambda: predicate_bitmap(documents, predicate))
+            result = matched if result is None else result & matched
+        return result
+
+
+def parse_filter(ids: list[int] | None, predicates: list[str] | None) -> DocFilter | None:
+    # the filter given by CLI arguments, None when there is nothing to filter on
+    if ids is None and not predicates:
+        return None
+    return DocFilter(ids, predicates or ())
+
+def parse_predicate(expression: str) -> tuple[str, str, str]:
+    m = PREDICATE.fullmatch(expression)
+    if m is None:
+        raise ValueError(f"Invalid filter '{expression}', expected field<op>value with op one of = != < <= > >= ~")
+    return m.group(1), m.group(2), m.group(3)
+
+def predicate_bitmap(documents: Iterable[dict], predicate: tuple[str, str, str]) -> Bitmap:
+    return Bitmap.from_ids([d["id"] for d in documents if matches(d, predicate)])
+
+def matches(doc: dict, predicate: tuple[str, str, str]) -> bool:
+    field, op, value = predicate
+    if op == "!=":
+        return not matches(doc, (field, "=", value))
+    if field not in doc:
+        return False
+    field_value = doc[field]
+    items = field_value if isinstance(field_value, list) else [field_value]
+    return any(compare(item, op, value, field) for item in items)
+
+def compare(item, op: str, value: str, field: str) -> bool:
+    if isinstance(item, (int, float)) and not isinstance(item, bool) and op != "~":
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError(f"Filter on numeric field '{field}' needs a number, got '{value}'") from None
+        return OPERATORS[op](item, number)
+    return OPERATORS[op](str(item).lower(), value.lower())
+
+def is_bitset(c: np.ndarray) -> bool:
+    return c.dtype == np.uint64
+
+def make_container(lows: np.ndarray) -> np.ndarray:
+    # lows must be sorted and unique
+    if len(lows) <= ARRAY_CONTAINER_MAX:
+        return lows
+    return to_bitset(lows)
+
+def to_bitset(c: np.ndarray) -> np.ndarray:
+    if is_bitset(c):
+        return c
+    bits = np.zeros(1 << CONTAINER_BITS, dtype=bool)
+    bits[c] = True
+    return np.packbits(bits, bitorder="little").view(np.uint64)
+
+def compact(bitset: np.ndarray) -> np.ndarray:
+    # back to an array container once few enough bits are set
+    if container_size(bitset) <= ARRAY_CONTAINER_MAX:
+        return container_lows(bitset)
+    return bitset
+
+def container_size(c: np.ndarray) -> int:
+    return int(np.bitwise_count(c).sum()) if is_bitset(c) else len(c)
+
+def container_lows(c: np.ndarray) -> np.ndarray:
+    if is_bitset(c):
+        return np.flatnonzero(np.unpackbits(c.view(np.uint8), bitorder="little")).astype(np.uint16)
+    return c
+
+def container_contains(c: np.ndarray, lows: np.ndarray) -> np.ndarray:
+    if is_bitset(c):
+        return ((c[lows >> 6] >> (lows & 63).astype(np.uint64)) & np.uint64(1)).astype(bool)
+    i = np.searchsorted(c, lows)
+    return (i < len(c)) & (c[np.minimum(i, len(c) - 1)] == lows)
@@ -1,27 +1,168 @@
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
-from lib import config
+import threading
+import time
+from lib import config, search_utils
 from .keyword_search import InvertedIndex
 from .semantic_search import ChunkedSemanticSearch
+from .result_cache import ResultCache, normalize_query
+from .filters import DocFilter
+
+_legs: dict[str, "SearchLeg"] = {}
+_legs_guard = threading.Lock()
+
+
+class SearchLeg:
+    """One retrieval leg of hybrid search, skipped while max_abandoned of its runs are stuck."""
+
+    def __init__(self, name: str, workers: int = search_utils.HYBRID_LEG_WORKERS, max_abandoned: int = search_utils.HYBRID_LEG_MAX_ABANDONED):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"hybrid-{name}")
+        self.max_abandoned = max(1, min(max_abandoned, workers))
+        self.abandoned = 0
+        self.changed = threading.Condition()
+
+    def stalled(self) -> bool:
+        return self.abandoned >= self.max_abandoned
+
+    def submit(self, fn, *args, **kwargs) -> "LegRun | None":
+        # None when the leg is skipped
+        with self.changed:
+            if self.stalled():
+                return None
+        run = LegRun(self)
+        run.future = self.executor.submit(run.call, fn, args, kwargs)
+        return run
+
+
+class LegRun:
+    def __init__(self, leg: SearchLeg):
+        self.leg = leg
+        self.future = None
+        self.started_at = None
+        self.done = False
+        self.abandoned = False
+
+    def call(self, fn, args, kwargs):
+        with self.leg.changed:
+            self.started_at = time.monotonic()
+            self.leg.changed.notify_all()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self.leg.changed:
+                self.done = True
+                if self.abandoned:
+                    self.leg.abandoned -= 1
+                    self.leg.changed.notify_all()
+
+    def result(self, timeout: float | None):
+        # the timeout counts from when a thread picks the run up, not from when it was queued
+        if timeout is None:
+            return self.future.result()
+        with self.leg.changed:
+            self.leg.changed.wait_for(lambda: self.started_at is not None or self.leg.stalled())
+            if self.started_at is None and self.future.cancel():
+                raise TimeoutError(f"The {self.leg.name} leg is stalled")
+            self.leg.changed.wait_for(lambda: self.started_at is not None)
+        try:
+            return self.future.result(max(0.0, self.started_at + timeout - time.monotonic()))
+        except TimeoutError:
+            with self.leg.changed:
+                if not self.done:
+                    self.abandoned = True
+                    self.leg.abandoned += 1
+                    self.leg.changed.notify_all()
+                    raise
+            return self.future.result()
+
+
+class FusedResults(dict):
+    """Fused results by document ID, with the retrieval legs left out for missing their timeout."""
+
+    def __init__(self, results=(), dropped_legs: tuple[str, ...] = ()):
+        super().__init__(results)
+        self.dropped_legs = tuple(dropped_legs)
 
 
 class HybridSearch:
-    def __init__(self, documents):
+    def __init__(self, documents, bm25_mode="exhaustive", leg_timeout: float | None = search_utils.HYBRID_LEG_TIMEOUT):
         self.documents = documents
+        self.bm25_mode = bm25_mode
+        self.leg_timeout = leg_timeout # seconds, None to always wait for both legs
         self.semantic_search = ChunkedSemanticSearch()
         self.semantic_search.load_or_create_chunk_embeddings(documents)
 
-        self.idx = InvertedIndex()
-        if not os.path.exists(config.INDEX_CACHE_FILE_PATH):
-            self.idx.build()
-            self.idx.save()
+        idx = InvertedIndex()
+        if not os.path.exists(config.INDEX_MANIFEST_FILE_PATH):
+            idx.build()
+            idx.save()
+        idx.load()
+        self.idx = idx # resident between queries, replaced whole when the index on disk changes
+        self.idx_guard = threading.Lock()
+        self.cache = ResultCache()
+
+    def _keyword_index(self) -> InvertedIndex:
+        # swapped in with one assignment, so queries already running keep the index they started with
+        idx = self.idx
+        if idx.is_current():
+            return idx
+        with self.idx_guard:
+            if not self.idx.is_current():
+                fresh = InvertedIndex()
+                fresh.load()
+                self.idx = fresh
+            return self.idx
 
-    def _bm25_search(self, query, limit) -> list[tuple[int, int]]:
-        self.idx.load()
-        return self.idx.bm25_search(query, limit)
+    def _bm25_search(self, query, limit, mode=None, doc_filter: DocFilter | None = None, idx: InvertedIndex | None = None) -> list[tuple[int, float]]:
+        return (idx or self._keyword_index()).bm25_search(query, limit, mode or self.bm25_mode, doc_filter)
 
-    def weighted_search(self, query, alpha, limit=5):
-        bm25_score: list[tuple[int, int]] = self._bm25_search(query, limit * 500)
-        sem_chunks: list[dict] = self.semantic_search.search_chunks(query, limit * 500)
+    def _generation(self) -> tuple[int, int]:
+        # fused results depend on both the keyword index and the chunk embeddings
+        return self._keyword_index().generation, self.semantic_search.chunk_generation
+
+    def _cache_key(self, method: str, query: str, *params) -> tuple:
+        return (method, normalize_query(query, self.semantic_search.lowercases_text()), self.bm25_mode, *params)
+
+    def _retrieve(self, query, limit, doc_filter: DocFilter | None) -> tuple[list[tuple[int, float]], list[dict], tuple[str, ...], Mapping[int, dict]]:
+        # NumPy and torch release the GIL for most of their work, so the legs overlap
+        idx = self._keyword_index()
+        legs = {
+            "keyword": search_leg("keyword").submit(self._bm25_search, query, limit, doc_filter=doc_filter, idx=idx),
+            "semantic": search_leg("semantic").submit(self.semantic_search.search_chunks, query, limit, doc_filter),
+        }
+        results = {}
+        for name, run in legs.items():
+            if run is None:
+                continue
+            try:
+                results[name] = run.result(self.leg_timeout)
+            except TimeoutError:
+                pass
+        if not results:
+            raise TimeoutError(f"Neither search leg answered within {self.leg_timeout}s")
+        dropped = tuple(name for name in legs if name not in results)
+        return results.get("keyword", []), results.get("semantic", []), dropped, idx.docmap
+
+    def _document(self, docmap: Mapping[int, dict], doc_id: int) -> dict:
+        # the keyword index may have been updated since the catalog was loaded at startup
+        try:
+            return docmap[doc_id]
+        except KeyError:
+            return self.semantic_search.document_map[doc_id]
+
+    def weighted_search(self, query, alpha, limit=5, doc_filter: DocFilter | None = None):
+        key = self._cache_key("weighted", query, alpha, limit, doc_filter)
+        results = self.cache.get_or_compute(key, self._generation(), lambda: self._weighted_search(query, alpha, limit, doc_filter), keep=is_complete)
+        return copy_results(results)
+
+    async def weighted_search_async(self, query, alpha, limit=5, doc_filter: DocFilter | None = None):
+        return await asyncio.to_thread(self.weighted_search, query, alpha, limit, doc_filter)
+
+    def _weighted_search(self, query, alpha, limit, doc_filter=None):
+        bm25_score, sem_chunks, dropped, docmap = self._retrieve(query, limit * 500, doc_filter)
 
         bm25_score_list = []
         for bm in bm25_score:
@@ -38,7 +179,7 @@ class HybridSearch:
         for i in range(len(bm25_score)):
             doc_id = bm25_score[i][0]
             norm_bm25_score = normalized_bm25_scores[i]
-            combined_norm_scores[doc_id] = {"keyword_score": norm_bm25_score, "hybrid_score": 0.0, "doc": self.semantic_search.document_map[doc_id]}
+            combined_norm_scores[doc_id] = {"keyword_score": norm_bm25_score, "hybrid_score": 0.0, "doc": self._document(docmap, doc_id)}
         for i in range(len(sem_chunks)):
             doc_id = sem_chunks[i]["id"]
             norm_sem_score = normalized_sem_scores[i]
@@ -48,23 +189,31 @@ class HybridSearch:
                 combined_norm_scores[doc_id]["semantic_score"] = norm_sem_score
                 combined_norm_scores[doc_id]["hybrid_score"] = hybrid_score_val
             else:
-                hybrid_score_val = hybrid_score(bm25_score, norm_sem_score, alpha)
-                combined_norm_scores[doc_id] = {"keyword_score": 0.0, "hybrid_score": hybrid_score_val, "semantic_score": norm_sem_score, "doc": self.semantic_search.document_map[doc_id]}
+                hybrid_score_val = hybrid_score(0.0, norm_sem_score, alpha)
+                combined_norm_scores[doc_id] = {"keyword_score": 0.0, "hybrid_score": hybrid_score_val, "semantic_score": norm_sem_score, "doc": self._document(docmap, doc_id)}
         
-        sorted_dict_list = dict(
-            sorted(combined_norm_scores.items(), key=lambda x: x[1]["hybrid_score"], reverse=True)[:limit]
+        sorted_dict_list = FusedResults(
+            sorted(combined_norm_scores.items(), key=lambda x: x[1]["hybrid_score"], reverse=True)[:limit],
+            dropped,
         )
 
         return sorted_dict_list
 
-    def rrf_search(self, query, k, limit=10) -> dict:
-        bm25_scores = self._bm25_search(query, limit*500)
-        semantic_res = self.semantic_search.search_chunks(query, limit*500)
+    def rrf_search(self, query, k, limit=10, doc_filter: DocFilter | None = None) -> dict:
+        key = self._cache_key("rrf", query, k, limit, doc_filter)
+        results = self.cache.get_or_compute(key, self._generation(), lambda: self._rrf_search(query, k, limit, doc_filter), keep=is_complete)
+        return copy_results(results)
+
+    async def rrf_search_async(self, query, k, limit=10, doc_filter: DocFilter | None = None) -> dict:
+        return await asyncio.to_thread(self.rrf_search, query, k, limit, doc_filter)
+
+    def _rrf_search(self, query, k, limit, doc_filter=None) -> dict:
+        bm25_scores, semantic_res, dropped, docmap = self._retrieve(query, limit*500, doc_filter)
         res = {}
         for rank, bms in enumerate(bm25_scores, start=1):
             doc_id = bms[0]
             res[doc_id] = {
-                "doc": self.semantic_search.document_map[doc_id],
+                "doc": self._document(docmap, doc_id),
                 "bm25_rank": rank,
                 "semantic_rank": None,
                 "bm25_rrf_score": rrf_score(rank, k),
@@ -79,17 +228,31 @@ class HybridSearch:
                 res[doc_id]["total_rrf_score"] = rrf_score(rank, k) + res[doc_id]["bm25_rrf_score"]
                 continue
             res[doc_id] = {
-                "doc": self.semantic_search.document_map[doc_id],
+                "doc": self._document(docmap, doc_id),
                 "bm25_rank": None,
                 "semantic_rank": rank,
                 "bm25_rrf_score": 0.0,
                 "sem_rrf_score": rrf_score(rank, k),
                 "total_rrf_score": rrf_score(rank, k) + 0.0,
             }
-        final_results = dict(sorted(res.items(), key=lambda d: d[1]["total_rrf_score"], reverse=True)[:limit])
+        final_results = FusedResults(sorted(res.items(), key=lambda d: d[1]["total_rrf_score"], reverse=True)[:limit], dropped)
         return final_results
         
     
+def search_leg(name: str) -> SearchLeg:
+    with _legs_guard:
+        if name not in _legs:
+            _legs[name] = SearchLeg(name)
+        return _legs[name]
+
+def is_complete(results: FusedResults) -> bool:
+    # results fused without a leg are not cached, so the next query tries both again
+    return not results.dropped_legs
+
+def copy_results(results: FusedResults) -> FusedResults:
+    # callers such as reranking add keys to the entries
+    return FusedResults({doc_id: dict(entry) for doc_id, entry in results.items()}, results.dropped_legs)
+
 def normalize(scores: list[float]) -> list[float]:
     res = []
     if len(scores) == 0:
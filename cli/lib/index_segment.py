@@ -0,0 +1,281 @@
+from collections.abc import Iterator, Mapping
+from lib import search_utils
+from lib.postings import PostingList
+import numpy as np
+import operator
+import struct
+import mmap
+import json
+import os
+
+# Segment layout: aligned binary sections, then a JSON footer describing them, then a
+# fixed trailer of (footer length, magic). Opening a segment reads only the trailer and
+# the footer; postings, doc lengths and documents are read from the mapping on demand.
+MAGIC = b"RSESEG01"
+TRAILER = struct.Struct("<Q8s")
+ALIGNMENT = 8
+
+TERM_INFO_DTYPE = np.dtype([
+    ("postings_start", "<u8"), # first posting of the term in doc_ids/tfs
+    ("df", "<u4"),
+    ("block_start", "<u4"), # first block of the term in block_max
+    ("idf", "<f8"),
+    ("max_score", "<f8"),
+])
+
+SECTION_DTYPES = {
+    "term_offsets": np.dtype("<u8"), # term i is term_bytes[term_offsets[i]:term_offsets[i + 1]]
+    "term_bytes": np.dtype("u1"), # UTF-8 terms in sorted order
+    "term_info": TERM_INFO_DTYPE,
+    "doc_ids": np.dtype("<u4"),
+    "tfs": np.dtype("<u4"),
+    "block_max": np.dtype("<f8"),
+    "term_positions": np.dtype("<u8"), # term i's positions are positions[term_positions[i]:term_positions[i + 1]]
+    "positions": np.dtype("<u4"), # token positions of each posting's occurrences, only in segments built with positions
+    "stored_ids": np.dtype("<u4"), # IDs of the documents in the segment, sorted
+    "doc_lengths": np.dtype("<u4"), # of each stored document (indexed by document ID in segments without stored_ids)
+    "title_lengths": np.dtype("<u4"), # tokens of each document that are in its title, only in segments with title postings
+    "doc_offsets": np.dtype("<u8"), # stored document i is doc_bytes[doc_offsets[i]:doc_offsets[i + 1]]
+    "doc_bytes": np.dtype("u1"), # JSON-encoded documents
+}
+
+
+def write_segment(path, index: dict[str, PostingList], docmap: dict[int, dict], doc_lengths: np.ndarray, avg_doc_length: float, title_lengths: np.ndarray | None = None) -> None:
+    terms = sorted(index)
+    encoded_terms = [t.encode("utf-8") for t in terms]
+
+    term_offsets = np.zeros(len(terms) + 1, dtype="<u8")
+    np.cumsum([len(t) for t in encoded_terms], out=term_offsets[1:])
+
+    has_positions = bool(terms) and all(index[t].positions is not None for t in terms)
+    term_positions = np.zeros(len(terms) + 1, dtype="<u8")
+    if has_positions:
+        np.cumsum([len(index[t].positions) for t in terms], out=term_positions[1:])
+
+    term_info = np.zeros(len(terms), dtype=TERM_INFO_DTYPE)
+    postings_start = block_start = 0
+    for i, t in enumerate(terms):
+        postings = index[t]
+        term_info[i] = (postings_start, len(postings), block_start, postings.idf, postings.max_score)
+        postings_start += len(postings)
+        block_start += len(postings.block_max)
+
+    sections: dict[str, list[int]] = {} # name -> [byte offset, item count]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        def write_section(name: str, chunks) -> None:
+            f.write(b"\0" * (-f.tell() % ALIGNMENT))
+            offset = f.tell()
+            for chunk in chunks:
+                f.write(chunk)
+            sections[name] = [offset, (f.tell() - offset) // SECTION_DTYPES[name].itemsize]
+
+        write_section("term_offsets", [term_offsets.tobytes()])
+        write_section("term_bytes", encoded_terms)
+        write_section("term_info", [term_info.tobytes()])
+        write_section("doc_ids", (index[t].doc_ids.tobytes() for t in terms))
+        write_section("tfs", (index[t].tfs.tobytes() for t in terms))
+        write_section("block_max", (index[t].block_max.tobytes() for t in terms))
+        if has_positions:
+            write_section("term_positions", [term_positions.tobytes()])
+            write_section("positions", (index[t].positions.tobytes() for t in terms))
+        # per-document columns only cover the stored IDs, so one large ID costs nothing
+        stored_ids = np.array(sorted(docmap), dtype="<u4")
+        write_section("stored_ids", [stored_ids.tobytes()])
+        write_section("doc_lengths", [doc_lengths[stored_ids].astype("<u4").tobytes()])
+        if title_lengths is not None:
+            write_section("title_lengths", [title_lengths[stored_ids].astype("<u4").tobytes()])
+        # documents are encoded one at a time, with their offsets written after them
+        doc_offsets = np.zeros(len(stored_ids) + 1, dtype="<u8")
+        write_section("doc_bytes", encoded_documents(docmap, stored_ids, doc_offsets))
+        write_section("doc_offsets", [doc_offsets.tobytes()])
+
+        footer = json.dumps({
+            "doc_count": len(docmap),
+            "total_doc_length": int(doc_lengths.sum()),
+            "total_title_length": int(title_lengths.sum()) if title_lengths is not None else None,
+            "avg_doc_length": avg_doc_length,
+            "block_size": search_utils.BM25_BLOCK_SIZE,
+            "sections": sections,
+        }).encode("utf-8")
+        f.write(footer)
+        f.write(TRAILER.pack(len(footer), MAGIC))
+    os.replace(tmp_path, path)
+
+
+def encoded_documents(docmap: Mapping[int, dict], doc_ids: np.ndarray, offsets: np.ndarray) -> Iterator[bytes]:
+    for i, doc_id in enumerate(doc_ids.tolist()):
+        encoded = json.dumps(docmap[doc_id]).encode("utf-8")
+        offsets[i + 1] = offsets[i] + len(encoded)
+        yield encoded
+
+
+class IndexSegment:
+    """Read-only, memory-mapped view of a segment file written by `write_segment`."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mm) < TRAILER.size:
+            raise ValueError(f"Not an index segment: {path}")
+        footer_len, magic = TRAILER.unpack(self.mm[-TRAILER.size:])
+        if magic != MAGIC:
+            raise ValueError(f"Not an index segment: {path}")
+        footer_end = len(self.mm) - TRAILER.size
+        self.footer = json.loads(self.mm[footer_end - footer_len:footer_end])
+        if self.footer["block_size"] != search_utils.BM25_BLOCK_SIZE:
+            raise ValueError(f"Segment {path} was built with block size {self.footer['block_size']}, rebuild the index")
+
+        self.doc_count: int = self.footer["doc_count"]
+        self.total_doc_length: int = self.footer["total_doc_length"]
+        self.avg_doc_length: float = self.footer["avg_doc_length"]
+        self.has_positions: bool = "positions" in self.footer["sections"]
+        has_titles = "title_lengths" in self.footer["sections"]
+        if "stored_ids" in self.footer["sections"]:
+            # lengths are expanded to arrays indexed by document ID, as scoring reads them
+            self.stored_ids = self.array("stored_ids")
+            self.doc_offsets = self.array("doc_offsets")
+            self.doc_lengths = by_doc_id(self.stored_ids, self.array("doc_lengths"))
+            self.title_lengths = by_doc_id(self.stored_ids, self.array("title_lengths")) if has_titles else None
+        else:
+            # older segments index every column by document ID, with empty gaps
+            offsets = self.array("doc_offsets")
+            self.stored_ids = np.flatnonzero(np.diff(offsets) > 0).astype("<u4")
+            self.doc_offsets = np.append(offsets[self.stored_ids], offsets[-1])
+            self.doc_lengths = self.array("doc_lengths")
+            self.title_lengths = self.array("title_lengths") if has_titles else None
+        self.total_title_length: int | None = self.footer.get("total_title_length")
+        self.terms = TermDictionary(self)
+        self.docs = DocStore(self)
+
+    def array(self, name: str) -> np.ndarray:
+        offset, count = self.footer["sections"][name]
+        return np.frombuffer(self.mm, dtype=SECTION_DTYPES[name], count=count, offset=offset)
+
+    def view(self, name: str, start: int, count: int, fmt: str) -> memoryview:
+        # memoryview slices index to plain Python ints/floats, which the cursor code relies on
+        offset = self.footer["sections"][name][0]
+        itemsize = SECTION_DTYPES[name].itemsize
+        begin = offset + start * itemsize
+        return memoryview(self.mm)[begin:begin + count * itemsize].cast(fmt)
+
+    def bytes(self, name: str, start: int, end: int) -> bytes:
+        offset = self.footer["sections"][name][0]
+        return self.mm[offset + start:offset + end]
+
+
+class TermDictionary(Mapping):
+    """Sorted term -> PostingList lookup by binary search over the mapped term table."""
+
+    def __init__(self, segment: IndexSegment):
+        self.segment = segment
+        self.offsets = segment.array("term_offsets")
+        self.info = segment.array("term_info")
+        self.positions = segment.array("term_positions") if segment.has_positions else None
+        self.postings: dict[str, PostingList] = {}
+
+    def __len__(self) -> int:
+        return len(self.info)
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self.term(i).decode("utf-8")
+
+    def term(self, i: int) -> bytes:
+        return self.segment.bytes("term_bytes", int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def find(self, term: str) -> int:
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.term(lo) == key:
+            return lo
+        return -1
+
+    def __getitem__(self, term: str) -> PostingList:
+        if term in self.postings:
+            return self.postings[term]
+        i = self.find(term)
+        if i < 0:
+            raise KeyError(term)
+        self.postings[term] = self.postings_at(i)
+        return self.postings[term]
+
+    def items(self) -> Iterator[tuple[str, PostingList]]:
+        # walks the term table in order instead of binary-searching every term
+        for i in range(len(self)):
+            yield self.term(i).decode("utf-8"), self.postings_at(i)
+
+    def document_frequencies(self, deleted: np.ndarray | None = None) -> dict[str, int]:
+        # from the term table, less the postings of the deleted documents
+        dfs = self.info["df"].astype(np.int64)
+        if deleted is not None and len(deleted):
+            term_of_posting = np.repeat(np.arange(len(self)), self.info["df"])
+            dfs -= np.bincount(term_of_posting[np.isin(self.segment.array("doc_ids"), deleted)], minlength=len(self))
+        return {term: df for term, df in zip(self, dfs.tolist()) if df}
+
+    def postings_at(self, i: int) -> PostingList:
+        start, df, block_start, idf, max_score = self.info[i].tolist()
+        blocks = -(-df // search_utils.BM25_BLOCK_SIZE)
+        postings = PostingList(
+            self.segment.view("doc_ids", start, df, "I"),
+            self.segment.view("tfs", start, df, "I"),
+        )
+        postings.idf = idf
+        postings.max_score = max_score
+        postings.block_max = self.segment.view("block_max", block_start, blocks, "d")
+        if self.positions is not None:
+            start, end = int(self.positions[i]), int(self.positions[i + 1])
+            postings.positions = self.segment.view("positions", start, end - start, "I")
+        return postings
+
+
+class DocStore(Mapping):
+    """Document ID -> movie dict, decoded from the mapped segment on each lookup."""
+
+    def __init__(self, segment: IndexSegment):
+        self.segment = segment
+        self.ids = segment.stored_ids
+        self.offsets = segment.doc_offsets
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids.tolist())
+
+    def position(self, doc_id: object) -> int:
+        # index of the document among the stored IDs, -1 for anything that is not one
+        try:
+            doc_id = operator.index(doc_id)
+        except TypeError:
+            return -1
+        if doc_id < 0:
+            return -1
+        i = int(np.searchsorted(self.ids, doc_id))
+        return i if i < len(self.ids) and self.ids[i] == doc_id else -1
+
+    def __contains__(self, doc_id: object) -> bool:
+        return self.position(doc_id) >= 0
+
+    def present(self) -> np.ndarray:
+        # boolean mask over document IDs, as long as doc_lengths: True where the segment stores that document
+        mask = np.zeros(len(self.segment.doc_lengths), dtype=bool)
+        mask[self.ids] = True
+        return mask
+
+    def __getitem__(self, doc_id: int) -> dict:
+        i = self.position(doc_id)
+        if i < 0:
+            raise KeyError(doc_id)
+        return json.loads(self.segment.bytes("doc_bytes", int(self.offsets[i]), int(self.offsets[i + 1])))
+
+def by_doc_id(doc_ids: np.ndarray, values: np.ndarray) -> np.ndarray:
+    res = np.zeros(int(doc_ids[-1]) + 1 if len(doc_ids) else 0, dtype=values.dtype)
+    res[doc_ids] = values
+    return res
@@ -0,0 +1,316 @@
+from collections.abc import Iterable, Iterator, Mapping
+from lib import search_utils
+from lib.documents import SpooledDocuments
+from lib.index_segment import IndexSegment, write_segment
+from lib.postings import TITLE_PREFIX, PostingList, bm25_idf, bm25_scores, concat_postings, finalize_postings, length_array, set_score_bounds, without_docs
+import numpy as np
+import threading
+import json
+import os
+
+# one lock per index directory; merges only hold it to pick their inputs and swap in their output
+_locks: dict[str, threading.Lock] = {}
+_merge_locks: dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+class IndexStore:
+    """Immutable segment and tombstone files behind a manifest.json replaced by rename; one writing process."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        with _locks_guard:
+            self.lock = _locks.setdefault(self.path, threading.Lock())
+            self.merge_lock = _merge_locks.setdefault(self.path, threading.Lock())
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def manifest_stamp(self) -> tuple[int, int, int]:
+        # manifest.json is replaced by rename, so its inode, mtime and size tell a change
+        st = os.stat(self.file("manifest.json"))
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def read_manifest(self) -> dict:
+        with open(self.file("manifest.json"), "r") as f:
+            return json.load(f)
+
+    def open_snapshot(self) -> "IndexSnapshot":
+        # a merge may delete files between reading the manifest and opening them
+        for attempt in range(3):
+            manifest = self.read_manifest()
+            try:
+                parts = [(IndexSegment(self.file(e["name"])), self.__read_deletes(e)) for e in manifest["segments"]]
+                return IndexSnapshot(manifest["generation"], parts)
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+
+    def replace_all(self, index: Mapping[str, PostingList], docmap: Mapping[int, dict], doc_lengths: np.ndarray, avg_doc_length: float, title_lengths: np.ndarray | None = None) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        with self.lock:
+            manifest = self.__read_or_create_manifest()
+            name = self.__new_segment_name(manifest)
+            write_segment(self.file(name), index, docmap, doc_lengths, avg_doc_length, title_lengths)
+            manifest["segments"] = [{"name": name, "doc_count": len(docmap), "deletes": None, "deleted": 0}]
+            self.__commit(manifest)
+
+    def write_update(self, index: Mapping[str, PostingList], docmap: Mapping[int, dict], doc_lengths: np.ndarray, avg_doc_length: float, removed_ids: Iterable[int], title_lengths: np.ndarray | None = None) -> None:
+        removed = np.unique(np.fromiter(removed_ids, dtype=np.int64)).astype(np.uint32)
+        with self.lock:
+            manifest = self.read_manifest()
+            for entry in manifest["segments"]:
+                present = IndexSegment(self.file(entry["name"])).docs.present()
+                in_segment = removed[removed < len(present)]
+                in_segment = in_segment[present[in_segment]]
+                deleted = self.__read_deletes(entry)
+                merged = np.union1d(deleted, in_segment).astype(np.uint32)
+                if len(merged) != len(deleted):
+                    self.__set_deletes(manifest, entry, merged)
+            if docmap:
+                name = self.__new_segment_name(manifest)
+                write_segment(self.file(name), index, docmap, doc_lengths, avg_doc_length, title_lengths)
+                manifest["segments"].append({"name": name, "doc_count": len(docmap), "deletes": None, "deleted": 0})
+            self.__commit(manifest)
+
+    def merge(self, max_segments: int) -> bool:
+        if not self.merge_lock.acquire(blocking=False):
+            return False
+        staged = None
+        try:
+            with self.lock:
+                manifest = self.read_manifest()
+                picked = select_merge(manifest["segments"], max_segments)
+                if not picked:
+                    return False
+                # opened under the lock so a concurrent commit cannot remove the files first
+                parts = [(IndexSegment(self.file(e["name"])), self.__read_deletes(e)) for e in picked]
+
+            # committed only once the merged segment is written, so a failed merge leaves every cache alone
+            index, docmap, doc_lengths, title_lengths = merge_segments(parts)
+            if docmap:
+                lengths, avg_doc_length = finalize_postings(index, doc_lengths)
+                title_array = length_array(title_lengths, len(lengths)) if title_lengths is not None else None
+                staged = self.file(f"{picked[0]['name']}.merging")
+                write_segment(staged, index, docmap, lengths, avg_doc_length, title_array)
+
+            with self.lock:
+                manifest = self.read_manifest()
+                picked_names = [e["name"] for e in picked]
+                current = {e["name"]: e for e in manifest["segments"]}
+                if any(n not in current for n in picked_names):
+                    # the index was rebuilt underneath the merge
+                    return False
+                # documents deleted from the inputs while the merge ran stay deleted
+                late = [np.setdiff1d(self.__read_deletes(current[n]), deleted) for n, (_, deleted) in zip(picked_names, parts)]
+                late = np.unique(np.concatenate(late)).astype(np.uint32)
+                position = min(i for i, e in enumerate(manifest["segments"]) if e["name"] in picked_names)
+                segments = [e for e in manifest["segments"] if e["name"] not in picked_names]
+                if staged is not None:
+                    name = self.__new_segment_name(manifest)
+                    os.replace(staged, self.file(name))
+                    staged = None
+                    entry = {"name": name, "doc_count": len(docmap), "deletes": None, "deleted": 0}
+                    segments.insert(position, entry)
+                    if len(late):
+                        self.__set_deletes(manifest, entry, late)
+                manifest["segments"] = segments
+                self.__commit(manifest)
+            return True
+        finally:
+            if staged is not None and os.path.exists(staged):
+                os.remove(staged)
+            self.merge_lock.release()
+
+    def merge_in_background(self) -> threading.Thread | None:
+        # tiered: the smallest segments are folded together, so large old ones are not rewritten every time
+        if len(self.read_manifest()["segments"]) <= search_utils.INDEX_MAX_SEGMENTS:
+            return None
+        thread = threading.Thread(target=self.merge, args=(search_utils.INDEX_MAX_SEGMENTS // 2,))
+        thread.start()
+        return thread
+
+    def __read_or_create_manifest(self) -> dict:
+        try:
+            return self.read_manifest()
+        except FileNotFoundError:
+            return {"generation": 0, "next_segment": 1, "segments": []}
+
+    def __new_segment_name(self, manifest: dict) -> str:
+        name = f"seg_{manifest['next_segment']:06d}.seg"
+        manifest["next_segment"] += 1
+        return name
+
+    def __read_deletes(self, entry: dict) -> np.ndarray:
+        if entry["deletes"] is None:
+            return np.zeros(0, dtype=np.uint32)
+        return np.load(self.file(entry["deletes"]))
+
+    def __set_deletes(self, manifest: dict, entry: dict, deleted: np.ndarray) -> None:
+        # never overwritten, since open snapshots may still read the old file
+        name = f"{entry['name'].removesuffix('.seg')}_{manifest['generation'] + 1:06d}.del.npy"
+        with open(self.file(name), "wb") as f:
+            np.save(f, deleted)
+        entry["deletes"] = name
+        entry["deleted"] = len(deleted)
+
+    def __commit(self, manifest: dict) -> None:
+        manifest["generation"] += 1
+        tmp_path = self.file("manifest.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.file("manifest.json"))
+
+        # open snapshots keep their mapped segments alive after the files are unlinked
+        live = {e["name"] for e in manifest["segments"]} | {e["deletes"] for e in manifest["segments"]}
+        for name in os.listdir(self.path):
+            if name.endswith((".seg", ".del.npy")) and name not in live:
+                os.remove(self.file(name))
+
+
+def select_merge(segments: list[dict], max_segments: int) -> list[dict]:
+    if len(segments) > max_segments:
+        by_size = sorted(segments, key=lambda e: e["doc_count"] - e["deleted"])
+        return by_size[:len(segments) - max_segments + 1]
+    if max_segments == 1 and len(segments) == 1 and segments[0]["deleted"]:
+        return segments
+    return []
+
+def merge_segments(parts: list[tuple[IndexSegment, np.ndarray]]) -> tuple[dict[str, PostingList], Mapping[int, dict], dict[int, int], dict[int, int] | None]:
+    columns: dict[str, list[tuple[np.ndarray, np.ndarray, np.ndarray | None]]] = {}
+    docmap = SpooledDocuments()
+    doc_lengths: dict[int, int] = {}
+    title_lengths: dict[int, int] | None = {} if all(segment.title_lengths is not None for segment, _ in parts) else None
+    for segment, deleted in parts:
+        for term, postings in segment.terms.items():
+            live = without_docs(postings, deleted)
+            if len(live[0]):
+                columns.setdefault(term, []).append(live)
+        present = segment.docs.present()
+        present[deleted] = False
+        for doc_id in np.flatnonzero(present):
+            docmap.add(segment.docs[int(doc_id)])
+            doc_lengths[int(doc_id)] = int(segment.doc_lengths[doc_id])
+            if title_lengths is not None:
+                title_lengths[int(doc_id)] = int(segment.title_lengths[doc_id])
+
+    index = {term: concat_postings(term_columns) for term, term_columns in columns.items()}
+    if title_lengths is None:
+        # title postings are useless without the lengths to normalize them
+        index = {term: postings for term, postings in index.items() if not term.startswith(TITLE_PREFIX)}
+    return index, docmap, doc_lengths, title_lengths
+
+
+class IndexSnapshot:
+    """Point-in-time view of the live documents across an index's segments."""
+
+    def __init__(self, generation: int, parts: list[tuple[IndexSegment, np.ndarray]]):
+        self.generation = generation
+        self.parts = parts # (segment, sorted tombstoned doc IDs), oldest segment first
+        self.doc_count = sum(segment.doc_count - len(deleted) for segment, deleted in parts)
+        total_doc_length = sum(segment.total_doc_length - int(segment.doc_lengths[deleted].sum()) for segment, deleted in parts)
+        self.avg_doc_length = total_doc_length / self.doc_count if self.doc_count else 0.0
+        self.has_positions = all(segment.has_positions or len(segment.terms) == 0 for segment, _ in parts)
+        self.has_fields = all(segment.title_lengths is not None for segment, _ in parts)
+        self.avg_title_length = 0.0
+        if self.has_fields and self.doc_count:
+            total_title_length = sum(segment.total_title_length - int(segment.title_lengths[deleted].sum()) for segment, deleted in parts)
+            self.avg_title_length = total_title_length / self.doc_count
+
+        if len(parts) == 1 and len(parts[0][1]) == 0:
+            # the segment's own statistics are the global ones
+            segment = parts[0][0]
+            self.terms: Mapping[str, PostingList] = segment.terms
+            self.docs: Mapping[int, dict] = segment.docs
+            self.doc_lengths: np.ndarray = segment.doc_lengths
+            self.title_lengths: np.ndarray | None = segment.title_lengths
+            return
+
+        self.doc_lengths = np.zeros(max((len(s.doc_lengths) for s, _ in parts), default=0), dtype=np.uint32)
+        for segment, deleted in parts:
+            live = segment.docs.present()
+            live[deleted] = False
+            self.doc_lengths[:len(live)][live] = segment.doc_lengths[live]
+        self.title_lengths = None
+        if self.has_fields:
+            self.title_lengths = np.zeros(len(self.doc_lengths), dtype=np.uint32)
+            for segment, deleted in parts:
+                live = segment.docs.present()
+                live[deleted] = False
+                self.title_lengths[:len(live)][live] = segment.title_lengths[live]
+        self.terms = SnapshotTerms(self)
+        self.docs = SnapshotDocs(self)
+
+
+class SnapshotTerms(Mapping):
+    """Term -> PostingList merged over a snapshot's segments, scored with snapshot-wide statistics."""
+
+    def __init__(self, snapshot: IndexSnapshot):
+        self.snapshot = snapshot
+        self.postings: dict[str, PostingList] = {}
+
+    def __getitem__(self, term: str) -> PostingList:
+        if term in self.postings:
+            return self.postings[term]
+        columns = []
+        for segment, deleted in self.snapshot.parts:
+            postings = segment.terms.get(term)
+            if postings is not None:
+                columns.append(without_docs(postings, deleted))
+        if sum(len(c[0]) for c in columns) == 0:
+            raise KeyError(term)
+
+        postings = concat_postings(columns)
+        postings.idf = bm25_idf(self.snapshot.doc_count, len(postings))
+        set_score_bounds(postings, bm25_scores(postings, self.snapshot.doc_lengths, self.snapshot.avg_doc_length))
+        self.postings[term] = postings
+        return postings
+
+    def __iter__(self) -> Iterator[str]:
+        # from the term tables, without loading any postings
+        seen = set()
+        for segment, deleted in self.snapshot.parts:
+            for term in segment.terms.document_frequencies(deleted):
+                if term not in seen:
+                    seen.add(term)
+                    yield term
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def document_frequencies(self) -> dict[str, int]:
+        dfs: dict[str, int] = {}
+        for segment, deleted in self.snapshot.parts:
+            for term, df in segment.terms.document_frequencies(deleted).items():
+                dfs[term] = dfs.get(term, 0) + df
+        return dfs
+
+
+class SnapshotDocs(Mapping):
+    """Document ID -> movie dict over a snapshot's segments, skipping tombstoned documents."""
+
+    def __init__(self, snapshot: IndexSnapshot):
+        self.snapshot = snapshot
+
+    def __getitem__(self, doc_id: int) -> dict:
+        for segment, deleted in self.snapshot.parts:
+            if doc_id in segment.docs and not is_deleted(deleted, doc_id):
+                return segment.docs[doc_id]
+        raise KeyError(doc_id)
+
+    def __contains__(self, doc_id: object) -> bool:
+        return any(doc_id in segment.docs and not is_deleted(deleted, doc_id) for segment, deleted in self.snapshot.parts)
+
+    def __iter__(self) -> Iterator[int]:
+        for segment, deleted in self.snapshot.parts:
+            for doc_id in segment.docs:
+                if not is_deleted(deleted, doc_id):
+                    yield doc_id
+
+    def __len__(self) -> int:
+        return self.snapshot.doc_count
+
+
+def is_deleted(deleted: np.ndarray, doc_id: int) -> bool:
+    i = np.searchsorted(deleted, doc_id)
+    return bool(i < len(deleted) and deleted[i] == doc_id)
@@ -0,0 +1,89 @@
+from lib import search_utils
+from lib.vectors import cosine_scores, normalize_rows, top_k_rows
+import numpy as np
+import math
+import os
+
+
+class IVFIndex:
+    """Inverted-file index: spherical k-means lists, of which a query scores only the nprobe closest."""
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, rows: np.ndarray, source: tuple[int, ...]):
+        self.centroids = centroids # (lists, dim), unit length
+        self.offsets = offsets # list i holds rows[offsets[i]:offsets[i + 1]]
+        self.rows = rows # embedding rows grouped by list
+        self.source = source # (rows, dim, file size, file mtime_ns) of the embeddings it was built from
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, source: tuple[int, ...], num_lists: int | None = None, iterations: int = search_utils.IVF_TRAIN_ITERATIONS, seed: int = 0) -> "IVFIndex":
+        # a row's nearest centroid does not depend on its length, so the rows need not be normalized
+        n = len(embeddings)
+        num_lists = min(num_lists or round(math.sqrt(n)), n)
+        rng = np.random.default_rng(seed)
+
+        # a sample is as good as all rows once every list gets a few dozen points
+        sample_size = min(n, num_lists * search_utils.IVF_TRAIN_SAMPLE_PER_LIST)
+        sample = normalize_rows(np.asarray(embeddings[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float32))
+        centroids = sample[rng.choice(len(sample), num_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = nearest_centroids(sample, centroids)
+            order = np.argsort(assignment, kind="stable")
+            lists, starts = np.unique(assignment[order], return_index=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            # a list that lost all its points restarts from a random sample point
+            centroids = sample[rng.choice(len(sample), num_lists, replace=False)].copy()
+            centroids[lists] = sums
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.where(norms == 0, 1, norms)
+
+        assignment = nearest_centroids(embeddings, centroids)
+        rows = np.argsort(assignment, kind="stable")
+        offsets = np.zeros(num_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=num_lists), out=offsets[1:])
+        return cls(centroids, offsets, rows.astype(np.int64), source)
+
+    def save(self, path) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, offsets=self.offsets, rows=self.rows, source=np.array(self.source, dtype=np.int64))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["offsets"], data["rows"], tuple(data["source"].tolist()))
+
+    @property
+    def num_lists(self) -> int:
+        return len(self.centroids)
+
+    def probe(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        # rows in the nprobe lists whose centroids are closest to the query
+        nprobe = min(nprobe, self.num_lists)
+        scores = self.centroids @ query.astype(self.centroids.dtype)
+        lists = np.argpartition(-scores, nprobe - 1)[:nprobe] if nprobe < self.num_lists else np.arange(self.num_lists)
+        return np.concatenate([self.rows[self.offsets[i]:self.offsets[i + 1]] for i in lists.tolist()])
+
+    def expected_probe_rows(self, nprobe: int) -> int:
+        return len(self.rows) * min(nprobe, self.num_lists) // self.num_lists
+
+
+def embeddings_source(path, embeddings: np.ndarray) -> tuple[int, ...]:
+    # identifies the embeddings file an index was built from, so a rebuilt file invalidates it
+    st = os.stat(path)
+    return (embeddings.shape[0], embeddings.shape[1], st.st_size, st.st_mtime_ns)
+
+def load_or_build_ivf(path, embeddings: np.ndarray, source: tuple[int, ...]) -> IVFIndex:
+    if os.path.exists(path):
+        ivf = IVFIndex.load(path)
+        if ivf.source == source:
+            return ivf
+    ivf = IVFIndex.build(embeddings, source)
+    ivf.save(path)
+    return ivf
+
+def nearest_centroids(embeddings: np.ndarray, centroids: np.ndarray, batch_size: int = 1 << 15) -> np.ndarray:
+    # index of the most similar centroid for every row, in batches to bound the score matrix
+    res = np.empty(len(embeddings), dtype=np.int64)
+    for start in range(0, len(embeddings), batch_size):
+        res[start:start + batch_size] = np.argmax(np.asarray(embeddings[start:start + batch_size], dtype=np.float32) @ centroids.T, axis=1)
+    return res
@@ -1,71 +1,137 @@
 from nltk.stem import PorterStemmer
-from collections import Counter
+from collections import Counter, deque
+from collections.abc import Iterable, Iterator
+from functools import cache, lru_cache, partial
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
 from lib import config, search_utils
+from lib.postings import TITLE_PREFIX, PostingList, PostingCursor, bm25_idf, bm25_scores, bm25f_scores, finalize_postings, length_array, near_docs, phrase_docs
+from lib.index_store import IndexStore
+from lib.documents import SpooledDocuments, iter_documents, batched
+from lib.result_cache import ResultCache, normalize_query
+from lib.filters import Bitmap, DocFilter
+import numpy as np
 import pickle
+import heapq
 import string
+import re
 import math
 import json
 import os
 
 class InvertedIndex:
 
-    def __init__(self, doc_lengths = {}):
-        self.index: dict[str, set[int]] = {} # maps a token (a word) to a set of document IDs
+    def __init__(self, positions: bool = search_utils.INDEX_POSITIONS):
+        self.index: dict[str, PostingList] = {} # maps a token (a word) to its posting list
         self.docmap: dict[int, dict] = {} # maps a document ID to the actual document object
-        self.term_frequencies: dict[int, Counter] = {} # maps a document ID to a Counter object
-        self.doc_lengths: dict[int, int] = doc_lengths # keeps a count of tokens of a document
-    
-    def __add_document(self, doc_id: int, text: str) -> None:
-        tokens = preprocess_text(text)
-        tokens_len = len(tokens)
-
-        self.doc_lengths[doc_id] = tokens_len
-
-        for t in tokens:
-
-            # update term freq
-            if doc_id not in self.term_frequencies:
-                self.term_frequencies[doc_id] = Counter()
-            self.term_frequencies[doc_id][t] += 1
-
-            if t in self.index:
-                self.index[t].add(doc_id)
-            else:
-                self.index[t] = set([doc_id])
+        self.doc_lengths: np.ndarray = np.zeros(0, dtype=np.uint32) # token count of a document, indexed by document ID
+        self.avg_doc_length: float = 0.0
+        self.title_lengths: np.ndarray | None = np.zeros(0, dtype=np.uint32) # title token count of a document, None if the index has no title postings
+        self.avg_title_length: float = 0.0
+        self.has_positions = positions # whether postings keep token positions, needed for phrase and NEAR queries
+        self.generation: int | None = None # generation of the loaded snapshot, None for an index built in memory
+        self.stamp: tuple[int, int, int] | None = None # manifest.json as of the loaded snapshot, see IndexStore.manifest_stamp
+        self.store = IndexStore(config.INDEX_DIR_PATH)
+        self.cache = ResultCache()
+        self.filter_cache = ResultCache(maxsize=search_utils.FILTER_CACHE_SIZE)
     
     def get_documents(self, term: str) -> list[int]:
         token = preprocess_text(term)[0]
-        return sorted(self.index.get(token, []))
+        if token not in self.index:
+            return []
+        return list(self.index[token].doc_ids)
     
-    def build(self) -> None:
-        with open(config.DATA_FILE_PATH, "r") as file:
-            data = json.load(file)
-        movies = data["movies"]
-
-        for m in movies:
-            input_text = f"{m['title']} {m['description']}"
-            self.__add_document(m["id"], input_text)
-            self.docmap[m["id"]] = m
-    
-    def save(self) -> None:
-        os.makedirs(config.CACHE_FILE_PATH, exist_ok=True)
-        # Write index
-        with open(config.INDEX_CACHE_FILE_PATH, "wb") as f:
-            pickle.dump(self.index, f)
-        
-        # Write docmap
-        with open(config.DOCMAP_CACHE_FILE_PATH, "wb") as f:
-            pickle.dump(self.docmap, f)
+    def build(self, workers: int = 1) -> None:
+        self.index_documents(iter_documents(config.DATA_FILE_PATH), workers)
+
+    def index_documents(self, documents: Iterable[dict], workers: int = 1) -> None:
+        # documents are spooled to a temporary file, so only a few batches of raw text are alive at once
+        if not isinstance(self.docmap, SpooledDocuments):
+            spool = SpooledDocuments()
+            for doc in self.docmap.values():
+                spool.add(doc)
+            self.docmap = spool
+        shards = (self.__shard_texts(batch) for batch in batched(documents, search_utils.INGEST_BATCH_SIZE))
+        build_shard = partial(index_shard, positions=self.has_positions)
+        if workers > 1:
+            partials = parallel_map(build_shard, shards, workers)
+        else:
+            partials = map(build_shard, shards)
 
-        # write term freq.
-        with open(config.TERM_FREQ_CACHE_FILE_PATH, "wb") as f:
-            pickle.dump(self.term_frequencies, f)
+        doc_lengths: dict[int, int] = {}
+        title_lengths: dict[int, int] = {}
+        for shard_index, shard_lengths, shard_title_lengths in partials:
+            for t, postings in shard_index.items():
+                if t not in self.index:
+                    self.index[t] = postings
+                else:
+                    self.index[t].doc_ids.extend(postings.doc_ids)
+                    self.index[t].tfs.extend(postings.tfs)
+                    if postings.positions is not None:
+                        self.index[t].positions.extend(postings.positions)
+            doc_lengths.update(shard_lengths)
+            title_lengths.update(shard_title_lengths)
+        self.doc_lengths, self.avg_doc_length = finalize_postings(self.index, doc_lengths)
+        self.title_lengths = length_array(title_lengths, len(self.doc_lengths))
+        self.avg_title_length = sum(title_lengths.values()) / len(title_lengths) if title_lengths else 0.0
+        self.generation = None
+        self.stamp = None
 
-        # writer doc_len
-        with open(config.DOC_LEN_CACHE_FILE_PATH, "wb") as f:
-            pickle.dump(self.doc_lengths, f)
+    def __shard_texts(self, documents: list[dict]) -> list[tuple[int, str, str]]:
+        texts: list[tuple[int, str, str]] = []
+        for m in documents:
+            texts.append((m["id"], m["title"], m["description"]))
+            self.docmap.add(m)
+        return texts
+    
+    def save(self) -> None:
+        self.store.replace_all(self.index, self.docmap, self.doc_lengths, self.avg_doc_length, self.title_lengths)
     
     def load(self) -> None:
+        try:
+            # stamped before opening, so a change landing in between is picked up next time
+            stamp = self.store.manifest_stamp()
+            snapshot = self.store.open_snapshot()
+        except FileNotFoundError as e:
+            raise FileNotFoundError(f"Cache file not found: {e.filename}") from e
+        self.index = snapshot.terms
+        self.docmap = snapshot.docs
+        self.doc_lengths = snapshot.doc_lengths
+        self.avg_doc_length = snapshot.avg_doc_length
+        self.title_lengths = snapshot.title_lengths
+        self.avg_title_length = snapshot.avg_title_length
+        self.has_positions = snapshot.has_positions
+        self.generation = snapshot.generation
+        self.stamp = stamp
+
+    def is_current(self) -> bool:
+        # a stat, cheap enough to run per query
+        try:
+            return self.stamp is not None and self.store.manifest_stamp() == self.stamp
+        except FileNotFoundError:
+            return False
+
+    def add_documents(self, documents: list[dict]) -> None:
+        # an ID that is already indexed is tombstoned in its old segment, so this also updates
+        self.load()
+        delta = InvertedIndex(self.has_positions)
+        delta.index_documents(documents)
+        self.store.write_update(delta.index, delta.docmap, delta.doc_lengths, delta.avg_doc_length, delta.docmap.keys(), delta.title_lengths)
+        self.load()
+        self.store.merge_in_background()
+
+    def delete_documents(self, doc_ids: list[int]) -> None:
+        self.store.write_update({}, {}, np.zeros(0, dtype=np.uint32), 0.0, doc_ids)
+        self.load()
+        self.store.merge_in_background()
+
+    def merge(self) -> bool:
+        merged = self.store.merge(max_segments=1)
+        self.load()
+        return merged
+
+    def load_pickles(self) -> None:
+        # reads the pickle caches written before the segment format, for migration
         try:
             # load index
             with open(config.INDEX_CACHE_FILE_PATH, "rb") as f:
@@ -74,103 +140,370 @@ class InvertedIndex:
             # load docmap
             with open(config.DOCMAP_CACHE_FILE_PATH, "rb") as f:
                 self.docmap = pickle.load(f)
-
-            # load term freq.
-            with open(config.TERM_FREQ_CACHE_FILE_PATH, "rb") as f:
-                self.term_frequencies = pickle.load(f)
             
             # load doc_len
             with open(config.DOC_LEN_CACHE_FILE_PATH, "rb") as f:
-                self.doc_lengths = pickle.load(f)
+                doc_lengths = pickle.load(f)
+
+            # the oldest caches hold sets of doc IDs and a separate term_frequencies pickle
+            if any(isinstance(postings, set) for postings in self.index.values()):
+                with open(config.TERM_FREQ_CACHE_FILE_PATH, "rb") as f:
+                    term_frequencies = pickle.load(f)
+                self.index = postings_from_legacy(self.index, term_frequencies)
 
         except FileNotFoundError as e:
             raise FileNotFoundError(f"Cache file not found: {e.filename}") from e
+
+        # doc lengths were pickled either as a dict or as (array, average)
+        if not isinstance(doc_lengths, dict):
+            lengths = doc_lengths[0]
+            doc_lengths = {doc_id: int(lengths[doc_id]) for doc_id in self.docmap}
+        self.doc_lengths, self.avg_doc_length = finalize_postings(self.index, doc_lengths)
+        self.title_lengths = None
+        self.has_positions = False
+        self.generation = None
+        self.stamp = None
     
+    def document_frequencies(self) -> dict[str, int]:
+        # a loaded index reads them from the segment term tables without touching postings
+        if isinstance(self.index, dict):
+            return {t: len(postings) for t, postings in self.index.items()}
+        return self.index.document_frequencies()
+
     def get_tf(self, doc_id: int, term: str) -> int:
         token = preprocess_text(term)
         if len(token) > 1:
             raise Exception("More than one token found")
         
-        if len(token) == 0 or doc_id not in self.term_frequencies or token[0] not in self.term_frequencies[doc_id]:
+        if len(token) == 0 or token[0] not in self.index:
             return 0
         
-        return self.term_frequencies[doc_id][token[0]]
+        return self.index[token[0]].get_tf(doc_id)
 
     def get_bm25_idf(self, term: str) -> float:
         token = preprocess_text(term)
         if len(token) > 1:
             raise Exception("More than one token found")
         
-        N = len(self.docmap)
         if token[0] in self.index:
-            df = len(self.index[token[0]])
-        else:
-            df = 0.0
-        return math.log((N - df + 0.5) / (df + 0.5) + 1)
+            return self.index[token[0]].idf
+        return bm25_idf(len(self.docmap), 0.0)
     
     def get_bm25_tf(self, doc_id: int, term: str, k1=search_utils.BM25_K1, b=search_utils.BM25_B) -> float:
-        len_norm = 1 - b + b * (self.doc_lengths[doc_id] / self.__get_avg_doc_length())
+        len_norm = 1 - b + b * (int(self.doc_lengths[doc_id]) / self.avg_doc_length)
         raw_tf = self.get_tf(doc_id, term)
         saturated_tf = (raw_tf * (k1 + 1)) / (raw_tf + k1 * len_norm)
         return saturated_tf
     
-    def __get_avg_doc_length(self) -> float:
-        if len(self.doc_lengths) == 0:
-            return 0.0
-        total_lengths = 0
-        for k in self.doc_lengths:
-            total_lengths += self.doc_lengths[k]
-        return total_lengths / len(self.doc_lengths)
-    
     def bm25(self, doc_id: int, term: str) -> float:
         return self.get_bm25_tf(doc_id, term) * self.get_bm25_idf(term)
+
+    def bm25_scores(self, postings: PostingList, k1=search_utils.BM25_K1, b=search_utils.BM25_B) -> np.ndarray:
+        return bm25_scores(postings, self.doc_lengths, self.avg_doc_length, k1, b)
     
-    def bm25_search(self, query: str, limit: int) -> list[tuple[int, int]]:
-        tokens = preprocess_text(query)
-        scores: dict[int, float] = {} # document_id -> total bm25 scores
+    def bm25_search(self, query: str, limit: int, mode: str = "exhaustive", doc_filter: DocFilter | None = None) -> list[tuple[int, float]]:
+        # quoted phrases and NEAR/k pairs only restrict which documents match; their words score as usual
+        if mode == "bm25f":
+            return self.bm25f_search(query, limit, doc_filter=doc_filter)
+        if mode not in ("exhaustive", "wand", "bmw"):
+            raise ValueError(f"Unknown BM25 search mode: {mode}")
+        if self.generation is None:
+            return self.__bm25_search(query, limit, mode, doc_filter)
+        key = ("bm25", normalize_query(query), limit, mode, doc_filter)
+        return list(self.cache.get_or_compute(key, self.generation, lambda: self.__bm25_search(query, limit, mode, doc_filter)))
+
+    def __bm25_search(self, query: str, limit: int, mode: str, doc_filter: DocFilter | None) -> list[tuple[int, float]]:
+        allowed = self.__allowed_docs(query, doc_filter)
+        tokens = preprocess_text(NEAR_OPERATOR.sub(" ", query))
+        match mode:
+            case "exhaustive":
+                return self.__exhaustive_search(tokens, limit, allowed)
+            case "wand":
+                return self.__pruned_search(tokens, limit, use_block_max=False, allowed=allowed)
+            case "bmw":
+                return self.__pruned_search(tokens, limit, use_block_max=True, allowed=allowed)
+
+    def bm25f_search(self, query: str, limit: int, title_weight: float = search_utils.BM25F_TITLE_WEIGHT, description_weight: float = search_utils.BM25F_DESCRIPTION_WEIGHT, doc_filter: DocFilter | None = None) -> list[tuple[int, float]]:
+        if self.title_lengths is None:
+            raise ValueError("The index was built without title postings, rebuild it to use BM25F")
+        if self.generation is None:
+            return self.__bm25f_search(query, limit, title_weight, description_weight, doc_filter)
+        key = ("bm25f", normalize_query(query), limit, title_weight, description_weight, doc_filter)
+        return list(self.cache.get_or_compute(key, self.generation, lambda: self.__bm25f_search(query, limit, title_weight, description_weight, doc_filter)))
+
+    def __bm25f_search(self, query: str, limit: int, title_weight: float, description_weight: float, doc_filter: DocFilter | None) -> list[tuple[int, float]]:
+        allowed = self.__allowed_docs(query, doc_filter)
+        doc_ids: list[np.ndarray] = []
+        scores: list[np.ndarray] = []
+        for t in preprocess_text(NEAR_OPERATOR.sub(" ", query)):
+            if t not in self.index:
+                continue
+            postings = self.index[t]
+            doc_ids.append(np.frombuffer(postings.doc_ids, dtype=np.uint32))
+            scores.append(bm25f_scores(
+                postings, self.index.get(TITLE_PREFIX + t), self.doc_lengths, self.title_lengths,
+                self.avg_doc_length, self.avg_title_length, title_weight, description_weight,
+            ))
+        return sum_top_k(doc_ids, scores, limit, allowed)
+
+    def filter_bitmap(self, doc_filter: DocFilter) -> Bitmap:
+        return doc_filter.bitmap(self.docmap.values(), self.filter_cache, self.generation)
+
+    def __allowed_docs(self, query: str, doc_filter: DocFilter | None) -> Bitmap | None:
+        phrases, nears = parse_query(query)
+        matches = self.__positional_matches(phrases, nears) if phrases or nears else None
+        allowed = Bitmap.from_ids(matches) if matches is not None else None
+        if doc_filter is not None:
+            filtered = self.filter_bitmap(doc_filter)
+            allowed = filtered if allowed is None else allowed & filtered
+        return allowed
+
+    def __positional_matches(self, phrases: list[str], nears: list[tuple[str, str, int]]) -> np.ndarray | None:
+        if not self.has_positions:
+            raise ValueError("The index was built without term positions, rebuild it to use phrase and NEAR queries")
+        allowed = None
+        for phrase in phrases:
+            tokens, positions = preprocess_positions(phrase)
+            if not tokens:
+                continue
+            if any(t not in self.index for t in tokens):
+                return np.zeros(0, dtype=np.uint32)
+            docs = phrase_docs([(self.index[t], p - positions[0]) for t, p in zip(tokens, positions)])
+            allowed = docs if allowed is None else np.intersect1d(allowed, docs, assume_unique=True)
+        for a, b, distance in nears:
+            a_tokens, b_tokens = preprocess_text(a), preprocess_text(b)
+            if not a_tokens or not b_tokens:
+                continue
+            if a_tokens[0] not in self.index or b_tokens[0] not in self.index:
+                return np.zeros(0, dtype=np.uint32)
+            docs = near_docs(self.index[a_tokens[0]], self.index[b_tokens[0]], distance)
+            allowed = docs if allowed is None else np.intersect1d(allowed, docs, assume_unique=True)
+        return allowed
+
+    def __exhaustive_search(self, tokens: list[str], limit: int, allowed: Bitmap | None = None) -> list[tuple[int, float]]:
+        doc_ids: list[np.ndarray] = []
+        scores: list[np.ndarray] = []
         
         for t in tokens:
             if t not in self.index:
                 continue
-            for doc_id in self.index[t]:
-                scores[doc_id] = scores.get(doc_id, 0.0) + self.bm25(doc_id, t)
+            postings = self.index[t]
+            doc_ids.append(np.frombuffer(postings.doc_ids, dtype=np.uint32))
+            scores.append(self.bm25_scores(postings))
+        return sum_top_k(doc_ids, scores, limit, allowed)
+
+    def __posting_score(self, postings: PostingList, pos: int, k1=search_utils.BM25_K1, b=search_utils.BM25_B) -> float:
+        # scalar twin of bm25_scores, so pruned and exhaustive searches produce identical floats
+        len_norm = 1 - b + b * (int(self.doc_lengths[postings.doc_ids[pos]]) / self.avg_doc_length)
+        raw_tf = postings.tfs[pos]
+        saturated_tf = (raw_tf * (k1 + 1)) / (raw_tf + k1 * len_norm)
+        return saturated_tf * postings.idf
+
+    def __pruned_search(self, tokens: list[str], limit: int, use_block_max: bool, allowed: Bitmap | None = None) -> list[tuple[int, float]]:
+        # WAND, plus the per-block bounds with use_block_max (Block-Max WAND)
+        if limit <= 0:
+            return []
+        cursors = [PostingCursor(self.index[t]) for t in tokens if t in self.index]
+        allowed_ids = allowed.to_array() if allowed is not None else None
+        heap: list[tuple[float, int]] = [] # (score, -doc_id), weakest result on top
+        threshold = -math.inf
+        # upper bounds are sums of rounded floats, so give them some slack before pruning
+        slack = 1e-9
+
+        while True:
+            ordered = sorted(cursors, key=lambda c: c.doc_id)
+            upper_bound = 0.0
+            pivot = -1
+            for i, c in enumerate(ordered):
+                if c.doc_id == math.inf:
+                    break
+                upper_bound += c.postings.max_score
+                if upper_bound + slack > threshold:
+                    pivot = i
+                    break
+            if pivot < 0:
+                break
+            pivot_doc = ordered[pivot].doc_id
+            while pivot + 1 < len(ordered) and ordered[pivot + 1].doc_id == pivot_doc:
+                pivot += 1
+
+            if allowed_ids is not None:
+                i = int(np.searchsorted(allowed_ids, pivot_doc))
+                if i == len(allowed_ids):
+                    break
+                next_allowed = int(allowed_ids[i])
+                if next_allowed != pivot_doc:
+                    for c in ordered[:pivot + 1]:
+                        c.advance(next_allowed)
+                    continue
+
+            if use_block_max:
+                bounds = [c.block_bound(pivot_doc) for c in ordered[:pivot + 1]]
+                if sum(bound for bound, _ in bounds) + slack <= threshold:
+                    # nothing before the end of the shortest block can make the top k
+                    next_doc = min(last for _, last in bounds) + 1
+                    if pivot + 1 < len(ordered):
+                        next_doc = min(next_doc, ordered[pivot + 1].doc_id)
+                    for c in ordered[:pivot + 1]:
+                        c.advance(next_doc)
+                    continue
+
+            if ordered[0].doc_id != pivot_doc:
+                for c in ordered[:pivot]:
+                    c.advance(pivot_doc)
+                continue
 
-        sorted_scores = sorted(scores.items(), key = lambda item: item[1], reverse=True)
-        return sorted_scores[:limit]
+            # sum in query order to match the exhaustive accumulation exactly
+            score = 0.0
+            for c in cursors:
+                if c.doc_id == pivot_doc:
+                    score += self.__posting_score(c.postings, c.pos)
+                    c.pos += 1
+            # documents arrive in ID order, so a tie never displaces an earlier (lower) ID
+            if len(heap) < limit:
+                heapq.heappush(heap, (score, -pivot_doc))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -pivot_doc))
+            if len(heap) == limit:
+                threshold = heap[0][0]
 
+        return [(-neg_doc_id, score) for score, neg_doc_id in sorted(heap, reverse=True)]
+
+
+
+def index_shard(texts: list[tuple[int, str, str]], positions: bool = False) -> tuple[dict[str, PostingList], dict[int, int], dict[int, int]]:
+    # runs in pool workers, so it only takes and returns picklable data
+    index: dict[str, PostingList] = {}
+    doc_lengths: dict[int, int] = {}
+    title_lengths: dict[int, int] = {}
+    combined = (f"{title} {description}" for _, title, description in texts)
+    for (doc_id, title, _), (tokens, token_positions) in zip(texts, preprocess_texts_positions(combined)):
+        # the title's words come first, so its tokens are the ones positioned before its word count
+        title_words = len(title.lower().translate(PUNCTUATION_TABLE).split())
+        doc_lengths[doc_id] = len(tokens)
+        title_lengths[doc_id] = bisect_left(token_positions, title_words)
+        occurrences: dict[str, list[int]] = {}
+        for t, p in zip(tokens, token_positions):
+            if t in occurrences:
+                occurrences[t].append(p)
+            else:
+                occurrences[t] = [p]
+        for t, term_positions in occurrences.items():
+            if t not in index:
+                index[t] = PostingList()
+            index[t].append(doc_id, len(term_positions), term_positions if positions else None)
+            in_title = bisect_left(term_positions, title_words)
+            if in_title:
+                title_term = TITLE_PREFIX + t
+                if title_term not in index:
+                    index[title_term] = PostingList()
+                index[title_term].append(doc_id, in_title, term_positions[:in_title] if positions else None)
+    return index, doc_lengths, title_lengths
+
+def parallel_map(fn, items: Iterable, workers: int) -> Iterator:
+    # ProcessPoolExecutor.map submits the whole input up front; this keeps two tasks per worker in flight
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def sum_top_k(doc_ids: list[np.ndarray], scores: list[np.ndarray], limit: int, allowed: Bitmap | None = None) -> list[tuple[int, float]]:
+    if allowed is not None:
+        keep = [allowed.contains(ids) for ids in doc_ids]
+        doc_ids = [ids[k] for ids, k in zip(doc_ids, keep)]
+        scores = [s[k] for s, k in zip(scores, keep)]
+    if not doc_ids:
+        return []
+    # bincount sums in input order, so the floats match a per-posting accumulation exactly
+    candidates, inverse = np.unique(np.concatenate(doc_ids), return_inverse=True)
+    totals = np.bincount(inverse, weights=np.concatenate(scores), minlength=len(candidates))
+    return top_k(candidates, totals, limit)
+
+def top_k(doc_ids: np.ndarray, scores: np.ndarray, limit: int) -> list[tuple[int, float]]:
+    # doc_ids must be ascending: equal scores are ranked by lower document ID
+    if limit <= 0 or len(scores) == 0:
+        return []
+    if limit < len(scores):
+        kth = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+        keep = scores >= kth
+        doc_ids, scores = doc_ids[keep], scores[keep]
+    order = np.lexsort((doc_ids, -scores))[:limit]
+    return [(int(doc_ids[i]), float(scores[i])) for i in order]
+
+def postings_from_legacy(index: dict[str, set[int]], term_frequencies: dict[int, Counter]) -> dict[str, PostingList]:
+    res = {}
+    for term, doc_ids in index.items():
+        postings = PostingList()
+        for doc_id in sorted(doc_ids):
+            postings.append(doc_id, term_frequencies[doc_id][term])
+        res[term] = postings
+    return res
 
 
 stemmer = PorterStemmer()
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+PHRASE = re.compile(r'"([^"]*)"')
+NEAR_OPERATOR = re.compile(r"\bNEAR(?:/\d+)?\b")
+NEAR_PAIR = re.compile(r"(\S+)\s+NEAR(?:/(\d+))?\s+(?=(\S+))")
+
+@cache
+def load_stop_words() -> frozenset[str]:
+    with open(config.STOP_WORDS_FILE_PATH, "r") as file:
+        return frozenset(file.read().splitlines())
+
+@lru_cache(maxsize=search_utils.STEM_CACHE_SIZE)
+def stem(token: str) -> str:
+    return stemmer.stem(token)
 
 def lower_case(text: str) -> str:
     return text.lower()
     
 def remove_punctuation(text: str) -> str:
-    table = str.maketrans("", "", string.punctuation)
-    return text.translate(table)
+    return text.translate(PUNCTUATION_TABLE)
 
 def tokenize(text: str) -> list[str]:
     return text.split()
 
 def remove_stop_words(tokens: list[str]) -> list[str]:
-    res = []
-    with open(config.STOP_WORDS_FILE_PATH, "r") as file:
-        stop_words = file.read()
-    stop_words_set = set(stop_words.splitlines())
-    for t in tokens:
-        if t not in stop_words_set:
-            res.append(t)
-    return res
+    stop_words = load_stop_words()
+    return [t for t in tokens if t not in stop_words]
 
 def stem_tokens(tokens: list[str]) -> list[str]:
-    res = []
-    for t in tokens:
-        res.append(stemmer.stem(t))
-    return res
+    return [stem(t) for t in tokens]
 
 def preprocess_text(text: str) -> list[str]:
     return stem_tokens(remove_stop_words(tokenize(remove_punctuation(lower_case(text)))))
 
+def preprocess_positions(text: str) -> tuple[list[str], list[int]]:
+    # positions count stop words too
+    stop_words = load_stop_words()
+    tokens: list[str] = []
+    positions: list[int] = []
+    for i, t in enumerate(text.lower().translate(PUNCTUATION_TABLE).split()):
+        if t not in stop_words:
+            tokens.append(stem(t))
+            positions.append(i)
+    return tokens, positions
+
+def preprocess_texts_positions(texts: Iterable[str]) -> list[tuple[list[str], list[int]]]:
+    return [preprocess_positions(text) for text in texts]
+
+def parse_query(query: str) -> tuple[list[str], list[tuple[str, str, int]]]:
+    # "a NEAR b NEAR c" pairs a with b and b with c
+    phrases = PHRASE.findall(query)
+    unquoted = PHRASE.sub(" ", query)
+    nears = [(a, b, int(k) if k else search_utils.NEAR_DEFAULT_DISTANCE) for a, k, b in NEAR_PAIR.findall(unquoted)]
+    return phrases, nears
+
+def preprocess_texts(texts: Iterable[str]) -> list[list[str]]:
+    stop_words = load_stop_words()
+    table = PUNCTUATION_TABLE
+    return [[stem(t) for t in text.lower().translate(table).split() if t not in stop_words] for text in texts]
+
 
 def read_movies_data(query: str, limit: int, idx: InvertedIndex) -> list[dict]:
     
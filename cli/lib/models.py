@@ -0,0 +1,77 @@
+from lib import config
+import numpy as np
+import threading
+import platform
+import os
+
+# the int8 ONNX export is made once and kept under cache/onnx
+ENCODER_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+_models: dict[tuple[str, str, str], object] = {}
+_models_guard = threading.Lock()
+
+
+def sentence_transformer(model_name: str, backend: str = "torch"):
+    return load_model("SentenceTransformer", model_name, backend)
+
+def cross_encoder(model_name: str, backend: str = "torch"):
+    return load_model("CrossEncoder", model_name, backend)
+
+def load_model(kind: str, model_name: str, backend: str = "torch"):
+    # sentence_transformers (and with it torch) is imported on the first load
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend: {backend}")
+    key = (kind, model_name, backend)
+    with _models_guard:
+        if key not in _models:
+            import sentence_transformers
+            cls = getattr(sentence_transformers, kind)
+            match backend:
+                case "torch":
+                    model = cls(model_name)
+                case "torch-int8":
+                    model = quantize_torch(cls(model_name), kind)
+                case "onnx":
+                    model = cls(model_name, backend="onnx")
+                case "onnx-int8":
+                    model = load_onnx_int8(cls, model_name)
+            _models[key] = model
+        return _models[key]
+
+def quantize_torch(model, kind: str):
+    # int8 weights for every Linear layer, activations quantized on the fly per batch
+    import torch
+    module = model.model if kind == "CrossEncoder" else model
+    torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+def onnx_quantization() -> str:
+    # the onnxruntime quantization config matching this CPU
+    return "arm64" if platform.machine().lower() in ("arm64", "aarch64") else "avx2"
+
+def load_onnx_int8(cls, model_name: str):
+    from sentence_transformers import export_dynamic_quantized_onnx_model
+    path = os.path.join(config.ONNX_MODELS_DIR_PATH, model_name.replace("/", "__"))
+    file_name = f"onnx/model_qint8_{onnx_quantization()}.onnx"
+    if not os.path.exists(os.path.join(path, file_name)):
+        model = cls(model_name, backend="onnx")
+        model.save_pretrained(path)
+        export_dynamic_quantized_onnx_model(model, onnx_quantization(), path)
+    return cls(path, backend="onnx", model_kwargs={"file_name": file_name})
+
+def encoder_key(model_name: str, backend: str) -> str:
+    # the float backends agree to rounding, so only the int8 ones get their own key
+    return model_name if backend in ("torch", "onnx") else f"{model_name}@{backend}"
+
+def embedding_agreement(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    # cosine similarity between each float embedding and the same text's embedding on another backend
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = (reference * candidate).sum(axis=1)
+    return {"min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean())}
+
+def check_agreement(reference: np.ndarray, candidate: np.ndarray, min_cosine: float) -> dict:
+    res = embedding_agreement(reference, candidate)
+    if res["min_cosine"] < min_cosine:
+        raise ValueError(f"Embeddings disagree with the float model: minimum cosine {res['min_cosine']:.4f} < {min_cosine}")
+    return res
@@ -1,44 +1,62 @@
-from PIL import Image
-from sentence_transformers import SentenceTransformer
-from lib.semantic_search import cosine_similarity
+from lib.models import sentence_transformer
+from lib.vectors import cosine_scores, normalize_rows, top_k_rows
+from lib.query_cache import QueryEmbeddingCache, shared_query_cache
+from lib.result_cache import normalize_query
 from lib import config
-import json
+from lib.documents import load_documents
 
 class MultimodalSearch:
     
-    def __init__(self, documents, model_name="clip-ViT-B-32"):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, documents, model_name="clip-ViT-B-32", query_cache: QueryEmbeddingCache | None = None):
+        self.model = sentence_transformer(model_name)
+        self.model_name = model_name
+        self.query_cache = query_cache or shared_query_cache()
         self.documents = documents
         self.texts = []
         for doc in self.documents:
             self.texts.append(f"{doc['title']}: {doc['description']}")
 
-        self.text_embeddings = self.model.encode(self.texts, show_progress_bar=True)
+        self.text_embeddings = normalize_rows(self.model.encode(self.texts, show_progress_bar=True))
 
     def embed_image(self, image_path):
-        img = Image.open(image_path)
+        img = open_image(image_path)
         embedding = self.model.encode([img], show_progress_bar=True)
         return embedding[0]
     
+    def embed_text(self, text: str):
+        # case is kept since CLIP's tokenizer does not report whether it lowercases
+        if not text or not text.strip():
+            raise ValueError("text parameter is empty")
+        return self.query_cache.get_or_encode(self.model_name, normalize_query(text, False), lambda: self.model.encode([text])[0])
+
     def search_with_image(self, image_path):
-        img = Image.open(image_path)
-        image_embed = self.model.encode([img], show_progress_bar=True)
+        img = open_image(image_path)
+        image_embed = self.model.encode([img], show_progress_bar=True)[0]
+        return self.__rank(image_embed)
+
+    def search_with_text(self, query: str):
+        return self.__rank(self.embed_text(query))
+
+    def __rank(self, query_embed):
+        scores = cosine_scores(self.text_embeddings, query_embed)
 
-        doc_with_score = []
-        for i, text_embed in enumerate(self.text_embeddings):
-            cos_sim = cosine_similarity(image_embed, text_embed).item()
-            doc_with_score.append(
+        # Return the best 5 docs
+        sorted_docs = []
+        for i in top_k_rows(scores, 5).tolist():
+            sorted_docs.append(
                 {
                     "doc_id": i,
                     "title": self.documents[i]["title"],
                     "description": self.documents[i]["description"],
-                    "similarity_score": cos_sim,
+                    "similarity_score": float(scores[i]),
                 }
             )
-        # Sort the docs and return 5
+        return sorted_docs
 
-        sorted_docs = sorted(doc_with_score, key=lambda d: d["similarity_score"], reverse=True)
-        return sorted_docs[:5]
+def open_image(image_path):
+    # PIL is only imported by the image commands
+    from PIL import Image
+    return Image.open(image_path)
 
 def verify_image_embedding(image_path):
     ms = MultimodalSearch()
@@ -46,8 +64,13 @@ def verify_image_embedding(image_path):
     print(f"Embedding shape: {embedding.shape[0]} dimensions")
 
 def image_search_command(image_path):
-    with open(config.DATA_FILE_PATH, "r") as f:
-        documents = json.load(f)["movies"]
+    documents = load_documents()
     
     ms = MultimodalSearch(documents)
-    return ms.search_with_image(image_path)
\ No newline at end of file
+    return ms.search_with_image(image_path)
+
+def text_search_command(query):
+    documents = load_documents()
+
+    ms = MultimodalSearch(documents)
+    return ms.search_with_text(query)
\ No newline at end of file
@@ -0,0 +1,212 @@
+from array import array
+from bisect import bisect_left
+from lib import search_utils
+import numpy as np
+import math
+
+# title postings live next to the whole-document ones; stems never contain ":"
+TITLE_PREFIX = "title:"
+
+
+class PostingList:
+    """Ascending doc IDs containing a term, with its frequency and optionally positions in each."""
+
+    __slots__ = ("doc_ids", "tfs", "positions", "idf", "max_score", "block_max")
+
+    def __init__(self, doc_ids: array | memoryview | None = None, tfs: array | memoryview | None = None, positions: array | memoryview | None = None):
+        self.doc_ids: array | memoryview = doc_ids if doc_ids is not None else array("I")
+        self.tfs: array | memoryview = tfs if tfs is not None else array("I")
+        self.positions: array | memoryview | None = positions # None when the index has no positions
+        self.idf: float = 0.0
+        self.max_score: float = 0.0 # highest BM25 score of the term in any document
+        self.block_max: array | memoryview = array("d") # highest BM25 score within each block of BM25_BLOCK_SIZE postings
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        return iter(self.doc_ids)
+
+    def __contains__(self, doc_id: int) -> bool:
+        return self.__find(doc_id) >= 0
+
+    def __find(self, doc_id: int) -> int:
+        i = bisect_left(self.doc_ids, doc_id)
+        if i < len(self.doc_ids) and self.doc_ids[i] == doc_id:
+            return i
+        return -1
+
+    def append(self, doc_id: int, tf: int, positions: list[int] | None = None) -> None:
+        self.doc_ids.append(doc_id)
+        self.tfs.append(tf)
+        if positions is not None:
+            if self.positions is None:
+                self.positions = array("I")
+            self.positions.extend(positions)
+
+    def get_tf(self, doc_id: int) -> int:
+        i = self.__find(doc_id)
+        return self.tfs[i] if i >= 0 else 0
+
+    def is_sorted(self) -> bool:
+        doc_ids = np.frombuffer(self.doc_ids, dtype=np.uint32)
+        return bool(np.all(doc_ids[1:] > doc_ids[:-1]))
+
+    def sort(self) -> None:
+        doc_ids, tfs, positions = posting_columns(self)
+        order = np.argsort(doc_ids, kind="stable")
+        self.doc_ids = array("I", doc_ids[order].tobytes())
+        self.tfs = array("I", tfs[order].tobytes())
+        if positions is not None:
+            self.positions = array("I", positions[gather_index(tfs, order)].tobytes())
+
+
+class PostingCursor:
+    """Position in one query term's posting list while walking documents in ID order."""
+
+    def __init__(self, postings: PostingList):
+        self.postings = postings
+        self.pos = 0
+
+    @property
+    def doc_id(self) -> float:
+        if self.pos < len(self.postings.doc_ids):
+            return self.postings.doc_ids[self.pos]
+        return math.inf
+
+    def advance(self, target: int) -> None:
+        self.pos = bisect_left(self.postings.doc_ids, target, lo=self.pos)
+
+    def block_bound(self, target: int) -> tuple[float, float]:
+        # looked up without moving the cursor
+        doc_ids = self.postings.doc_ids
+        i = bisect_left(doc_ids, target, lo=self.pos)
+        if i == len(doc_ids):
+            return 0.0, math.inf
+        block = i // search_utils.BM25_BLOCK_SIZE
+        last = min((block + 1) * search_utils.BM25_BLOCK_SIZE, len(doc_ids)) - 1
+        return self.postings.block_max[block], doc_ids[last]
+
+
+def bm25_idf(N: int, df: float) -> float:
+    return math.log((N - df + 0.5) / (df + 0.5) + 1)
+
+def bm25_scores(postings: PostingList, doc_lengths: np.ndarray, avg_doc_length: float, k1=search_utils.BM25_K1, b=search_utils.BM25_B) -> np.ndarray:
+    doc_ids = np.frombuffer(postings.doc_ids, dtype=np.uint32)
+    raw_tf = np.frombuffer(postings.tfs, dtype=np.uint32).astype(np.float64)
+    len_norm = 1 - b + b * (doc_lengths[doc_ids] / avg_doc_length)
+    saturated_tf = (raw_tf * (k1 + 1)) / (raw_tf + k1 * len_norm)
+    return saturated_tf * postings.idf
+
+def bm25f_scores(postings: PostingList, title_postings: PostingList | None, doc_lengths: np.ndarray, title_lengths: np.ndarray, avg_doc_length: float, avg_title_length: float, title_weight: float, description_weight: float, k1=search_utils.BM25_K1, title_b=search_utils.BM25F_TITLE_B, description_b=search_utils.BM25F_DESCRIPTION_B) -> np.ndarray:
+    # the description is everything that is not title, so its frequencies and lengths are differences
+    doc_ids = np.frombuffer(postings.doc_ids, dtype=np.uint32)
+    tf = np.frombuffer(postings.tfs, dtype=np.uint32).astype(np.float64)
+    title_tf = np.zeros(len(doc_ids))
+    if title_postings is not None:
+        title_ids = np.frombuffer(title_postings.doc_ids, dtype=np.uint32)
+        title_tf[np.searchsorted(doc_ids, title_ids)] = np.frombuffer(title_postings.tfs, dtype=np.uint32)
+    title_len = title_lengths[doc_ids].astype(np.float64)
+    description_len = doc_lengths[doc_ids] - title_len
+    avg_description_length = avg_doc_length - avg_title_length
+
+    title_norm = 1 - title_b + title_b * (title_len / avg_title_length if avg_title_length > 0 else 0.0)
+    description_norm = 1 - description_b + description_b * (description_len / avg_description_length if avg_description_length > 0 else 0.0)
+    weighted_tf = title_weight * title_tf / title_norm + description_weight * (tf - title_tf) / description_norm
+    return (weighted_tf * (k1 + 1)) / (weighted_tf + k1) * postings.idf
+
+def length_array(lengths: dict[int, int], size: int | None = None) -> np.ndarray:
+    array_lengths = np.zeros(max(lengths, default=-1) + 1 if size is None else size, dtype=np.uint32)
+    for doc_id, length in lengths.items():
+        array_lengths[doc_id] = length
+    return array_lengths
+
+def finalize_postings(index: dict[str, PostingList], doc_lengths: dict[int, int]) -> tuple[np.ndarray, float]:
+    lengths = length_array(doc_lengths)
+    avg_doc_length = sum(doc_lengths.values()) / len(doc_lengths) if doc_lengths else 0.0
+
+    N = len(doc_lengths)
+    for postings in index.values():
+        # postings are appended in catalog order, which is not guaranteed to be ID order
+        if not postings.is_sorted():
+            postings.sort()
+        postings.idf = bm25_idf(N, len(postings))
+        set_score_bounds(postings, bm25_scores(postings, lengths, avg_doc_length))
+    return lengths, avg_doc_length
+
+def set_score_bounds(postings: PostingList, scores: np.ndarray) -> None:
+    postings.max_score = float(scores.max())
+    block_starts = np.arange(0, len(scores), search_utils.BM25_BLOCK_SIZE)
+    postings.block_max = array("d", np.maximum.reduceat(scores, block_starts))
+
+def posting_columns(postings: PostingList) -> tuple[np.ndarray, np.ndarray, np.ndarray | None]:
+    doc_ids = np.frombuffer(postings.doc_ids, dtype=np.uint32)
+    tfs = np.frombuffer(postings.tfs, dtype=np.uint32)
+    positions = np.frombuffer(postings.positions, dtype=np.uint32) if postings.positions is not None else None
+    return doc_ids, tfs, positions
+
+def gather_index(tfs: np.ndarray, postings: np.ndarray) -> np.ndarray:
+    starts = np.zeros(len(tfs) + 1, dtype=np.int64)
+    np.cumsum(tfs, out=starts[1:])
+    counts = tfs[postings].astype(np.int64)
+    out_starts = np.cumsum(counts) - counts
+    return np.repeat(starts[postings] - out_starts, counts) + np.arange(counts.sum(), dtype=np.int64)
+
+def without_docs(postings: PostingList, deleted: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray | None]:
+    doc_ids, tfs, positions = posting_columns(postings)
+    if len(deleted) == 0:
+        return doc_ids, tfs, positions
+    keep = ~np.isin(doc_ids, deleted)
+    if positions is not None:
+        positions = positions[np.repeat(keep, tfs)]
+    return doc_ids[keep], tfs[keep], positions
+
+def concat_postings(columns: list[tuple[np.ndarray, np.ndarray, np.ndarray | None]]) -> PostingList:
+    # positions are kept only if every column has them
+    doc_ids = np.concatenate([c[0] for c in columns])
+    tfs = np.concatenate([c[1] for c in columns])
+    order = np.argsort(doc_ids, kind="stable")
+    postings = PostingList(array("I", doc_ids[order].tobytes()), array("I", tfs[order].tobytes()))
+    if all(c[2] is not None for c in columns):
+        positions = np.concatenate([c[2] for c in columns])
+        postings.positions = array("I", positions[gather_index(tfs, order)].tobytes())
+    return postings
+
+def occurrences(postings: PostingList, doc_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # the documents must all be in the posting list
+    all_ids, tfs, positions = posting_columns(postings)
+    found = np.searchsorted(all_ids, doc_ids)
+    return np.repeat(doc_ids, tfs[found]), positions[gather_index(tfs, found)]
+
+def occurrence_keys(doc_ids: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    # packs (doc ID, position) so sorted keys order by document, then position
+    return (doc_ids.astype(np.int64) << 32) | positions.astype(np.int64)
+
+def phrase_docs(terms: list[tuple[PostingList, int]]) -> np.ndarray:
+    # intersects the posting lists shortest first, then the start positions each term implies
+    by_length = sorted(terms, key=lambda t: len(t[0]))
+    candidates = np.frombuffer(by_length[0][0].doc_ids, dtype=np.uint32)
+    for postings, _ in by_length[1:]:
+        candidates = np.intersect1d(candidates, np.frombuffer(postings.doc_ids, dtype=np.uint32), assume_unique=True)
+    starts = None
+    for postings, offset in by_length:
+        if len(candidates) == 0:
+            break
+        doc_ids, positions = occurrences(postings, candidates)
+        fits = positions >= offset
+        keys = occurrence_keys(doc_ids[fits], positions[fits] - offset)
+        starts = keys if starts is None else np.intersect1d(starts, keys, assume_unique=True)
+        candidates = np.unique(starts >> 32).astype(np.uint32)
+    return candidates
+
+def near_docs(a: PostingList, b: PostingList, distance: int) -> np.ndarray:
+    candidates = np.intersect1d(np.frombuffer(a.doc_ids, dtype=np.uint32), np.frombuffer(b.doc_ids, dtype=np.uint32), assume_unique=True)
+    if len(candidates) == 0:
+        return candidates
+    a_keys = occurrence_keys(*occurrences(a, candidates)) # sorted, since positions ascend within a document
+    b_doc_ids, b_positions = occurrences(b, candidates)
+    b_keys = occurrence_keys(b_doc_ids, b_positions)
+    # a window never reaches into a neighbouring document, since positions stay far below 2**32
+    lo = np.searchsorted(a_keys, b_keys - distance, side="left")
+    hi = np.searchsorted(a_keys, b_keys + distance, side="right")
+    return np.unique(b_doc_ids[hi > lo])
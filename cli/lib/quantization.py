@@ -0,0 +1,199 @@
+from pathlib import Path
+from lib import search_utils
+from lib.vectors import cosine_scores, normalize_rows, open_unit_embeddings
+import numpy as np
+import os
+
+SCORE_BATCH_ROWS = 1 << 10 # rows decoded at a time, small enough that the float32 batch stays in cache
+PQ_CENTROIDS = 256 # one uint8 code per subvector
+
+
+class Float16Embeddings:
+    """Unit embeddings stored as float16, half the memory of float32."""
+
+    mode = "float16"
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    @classmethod
+    def encode(cls, unit_embeddings: np.ndarray) -> "Float16Embeddings":
+        return cls(unit_embeddings.astype(np.float16))
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {"vectors": self.vectors}
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.vectors.shape
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes
+
+    def scores(self, unit_query: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        # numpy has no float16 BLAS, so batches are widened to float32 before the product
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        return batched_scores(len(vectors), lambda s: vectors[s].astype(np.float32) @ unit_query)
+
+
+class Int8Embeddings:
+    """Unit embeddings as int8 with one scale per dimension, a quarter of float32."""
+
+    mode = "int8"
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray):
+        self.codes = codes # (rows, dim) int8
+        self.scales = scales # (dim,) float32
+
+    @classmethod
+    def encode(cls, unit_embeddings: np.ndarray) -> "Int8Embeddings":
+        scales = (np.abs(unit_embeddings).max(axis=0) / 127).astype(np.float32)
+        scales[scales == 0] = 1
+        codes = np.empty(unit_embeddings.shape, dtype=np.int8)
+        for start in range(0, len(unit_embeddings), SCORE_BATCH_ROWS):
+            batch = unit_embeddings[start:start + SCORE_BATCH_ROWS]
+            codes[start:start + SCORE_BATCH_ROWS] = np.clip(np.rint(batch / scales), -127, 127)
+        return cls(codes, scales)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {"codes": self.codes, "scales": self.scales}
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.codes.shape
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    def scores(self, unit_query: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        codes = self.codes if rows is None else self.codes[rows]
+        scaled_query = (unit_query * self.scales).astype(np.float32)
+        return batched_scores(len(codes), lambda s: codes[s].astype(np.float32) @ scaled_query)
+
+
+class PQEmbeddings:
+    """Product-quantized unit embeddings, one byte per subvector, scored through a per-query table."""
+
+    mode = "pq"
+
+    def __init__(self, codebooks: np.ndarray, codes: np.ndarray):
+        self.codebooks = codebooks # (subspaces, 256, subvector dim) float32
+        self.codes = codes # (subspaces, rows) uint8
+
+    @classmethod
+    def encode(cls, unit_embeddings: np.ndarray, subspaces: int = search_utils.PQ_SUBSPACES, iterations: int = search_utils.PQ_TRAIN_ITERATIONS, seed: int = 0) -> "PQEmbeddings":
+        n, dim = unit_embeddings.shape
+        subspaces = max(m for m in range(1, min(subspaces, dim) + 1) if dim % m == 0)
+        sub_dim = dim // subspaces
+        rng = np.random.default_rng(seed)
+        sample = unit_embeddings[np.sort(rng.choice(n, min(n, PQ_CENTROIDS * search_utils.PQ_TRAIN_SAMPLE_PER_CENTROID), replace=False))]
+
+        codebooks = np.zeros((subspaces, PQ_CENTROIDS, sub_dim), dtype=np.float32)
+        codes = np.empty((subspaces, n), dtype=np.uint8)
+        for j in range(subspaces):
+            part = slice(j * sub_dim, (j + 1) * sub_dim)
+            codebooks[j] = train_codebook(np.ascontiguousarray(sample[:, part], dtype=np.float32), iterations, rng)
+            codes[j] = nearest_codes(unit_embeddings[:, part], codebooks[j])
+        return cls(codebooks, codes)
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        return {"codebooks": self.codebooks, "codes": self.codes}
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.codes.shape[1], self.codebooks.shape[0] * self.codebooks.shape[2]
+
+    def __len__(self) -> int:
+        return self.codes.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.codebooks.nbytes
+
+    def scores(self, unit_query: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        subspaces, _, sub_dim = self.codebooks.shape
+        query_parts = unit_query.astype(np.float32).reshape(subspaces, sub_dim)
+        table = np.einsum("jkd,jd->jk", self.codebooks, query_parts) # (subspaces, 256)
+        res = np.zeros(len(self) if rows is None else len(rows), dtype=np.float32)
+        for j in range(subspaces):
+            codes = self.codes[j] if rows is None else self.codes[j, rows]
+            res += table[j][codes]
+        return res
+
+
+STORAGE_MODES = {"float16": Float16Embeddings, "int8": Int8Embeddings, "pq": PQEmbeddings}
+
+
+def quantized_path(embeddings_path: str | Path, mode: str) -> Path:
+    # chunk_embeddings.npy -> chunk_embeddings.int8.npz, next to the float32 file
+    return Path(embeddings_path).with_suffix(f".{mode}.npz")
+
+def save_quantized(path: str | Path, store, source: tuple[int, ...]) -> None:
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, source=np.array(source, dtype=np.int64), **store.arrays())
+    os.replace(tmp_path, path)
+
+def load_quantized(path: str | Path, mode: str):
+    # returns the stored codes and the source they were built from
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files if name != "source"}
+        return STORAGE_MODES[mode](**arrays), tuple(data["source"].tolist())
+
+def load_or_quantize(embeddings_path: str | Path, mode: str, source: tuple[int, ...]):
+    # re-encoded whenever the float32 file changes
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown embedding storage: {mode}")
+    path = quantized_path(embeddings_path, mode)
+    if os.path.exists(path):
+        store, stored_source = load_quantized(path, mode)
+        if stored_source == source:
+            return store
+    unit_embeddings = open_unit_embeddings(embeddings_path)
+    store = STORAGE_MODES[mode].encode(unit_embeddings)
+    save_quantized(path, store, source)
+    return store
+
+def exact_scores(raw_embeddings: np.ndarray, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    # float32 cosine scores of a shortlist, reading its rows from the (memory-mapped) file in file order
+    order = np.argsort(rows, kind="stable")
+    vectors = np.empty((len(rows), raw_embeddings.shape[1]), dtype=np.float32)
+    vectors[order] = raw_embeddings[rows[order]]
+    return cosine_scores(normalize_rows(vectors), query)
+
+def batched_scores(n: int, score) -> np.ndarray:
+    res = np.empty(n, dtype=np.float32)
+    for start in range(0, n, SCORE_BATCH_ROWS):
+        s = slice(start, min(n, start + SCORE_BATCH_ROWS))
+        res[s] = score(s)
+    return res
+
+def train_codebook(sample: np.ndarray, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    # plain k-means for one subspace; lists that lose all their points restart from a sample point
+    k = min(PQ_CENTROIDS, len(sample))
+    codebook = np.zeros((PQ_CENTROIDS, sample.shape[1]), dtype=np.float32)
+    codebook[:k] = sample[rng.choice(len(sample), k, replace=False)]
+    for _ in range(iterations):
+        assignment = nearest_codes(sample, codebook[:k])
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.stack([np.bincount(assignment, weights=sample[:, d], minlength=k) for d in range(sample.shape[1])], axis=1)
+        empty = counts == 0
+        codebook[:k][~empty] = (sums[~empty] / counts[~empty, None]).astype(np.float32)
+        codebook[:k][empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+    return codebook
+
+def nearest_codes(vectors: np.ndarray, codebook: np.ndarray) -> np.ndarray:
+    # closest centroid by Euclidean distance, argmin |c|^2 - 2 x.c, a cache-sized batch at a time
+    norms = (codebook * codebook).sum(axis=1)
+    res = np.empty(len(vectors), dtype=np.uint8)
+    for start in range(0, len(vectors), SCORE_BATCH_ROWS):
+        batch = np.asarray(vectors[start:start + SCORE_BATCH_ROWS], dtype=np.float32)
+        res[start:start + SCORE_BATCH_ROWS] = np.argmin(norms - 2 * (batch @ codebook.T), axis=1)
+    return res
@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from collections.abc import Callable
+from lib import config, search_utils
+import numpy as np
+import threading
+import sqlite3
+import os
+
+_shared: "QueryEmbeddingCache | None" = None
+_shared_guard = threading.Lock()
+
+
+class QueryEmbeddingCache:
+    """Query embeddings in an in-process LRU in front of a SQLite store shared between processes."""
+
+    def __init__(self, path=config.QUERY_EMBEDDINGS_CACHE_FILE_PATH, maxsize: int = search_utils.QUERY_CACHE_SIZE, dtype: str = search_utils.QUERY_CACHE_DTYPE):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unknown query cache dtype: {dtype}")
+        self.path = path # None keeps the cache in memory only
+        self.maxsize = maxsize
+        self.dtype = np.dtype(dtype)
+        self.entries: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self.lowercase_models: dict[str, bool] = {}
+        self.lock = threading.Lock()
+        self.conn: sqlite3.Connection | None = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get_or_encode(self, model_name: str, text: str, encode: Callable[[], np.ndarray]) -> np.ndarray:
+        key = (model_name, text)
+        with self.lock:
+            vector = self.entries.get(key)
+            if vector is not None:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+            vector = self.__read(key)
+            if vector is not None:
+                self.disk_hits += 1
+                self.__remember(key, vector)
+                return vector
+            self.misses += 1
+
+        # the model runs outside the lock so it does not hold up hits from other threads
+        vector = as_readonly(np.asarray(encode(), dtype=np.float32))
+        with self.lock:
+            self.__write(key, vector)
+            self.__remember(key, vector)
+        return vector
+
+    def model_lowercases(self, model_name: str, probe: Callable[[], bool]) -> bool:
+        # stored with the vectors, so only the first process to ask loads the model
+        with self.lock:
+            flag = self.lowercase_models.get(model_name)
+            if flag is None and self.path is not None:
+                row = self.__connect().execute("SELECT lowercases FROM models WHERE model = ?", (model_name,)).fetchone()
+                flag = None if row is None else bool(row[0])
+        if flag is None:
+            flag = bool(probe())
+            if self.path is not None:
+                with self.lock, self.__connect() as conn:
+                    conn.execute("INSERT OR REPLACE INTO models VALUES (?, ?)", (model_name, int(flag)))
+        with self.lock:
+            self.lowercase_models[model_name] = flag
+        return flag
+
+    def clear(self) -> None:
+        # empties the in-process LRU only; the store on disk is shared with other processes
+        with self.lock:
+            self.entries.clear()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "size": len(self.entries),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_hit_ratio": self.memory_hits / lookups if lookups else 0.0,
+                "hit_ratio": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def __remember(self, key: tuple[str, str], vector: np.ndarray) -> None:
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = vector
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # WAL lets other processes keep reading while one writes
+            self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS query_embeddings (model TEXT, query TEXT, dtype TEXT, vector BLOB, PRIMARY KEY (model, query))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS models (model TEXT PRIMARY KEY, lowercases INTEGER)")
+        return self.conn
+
+    def __read(self, key: tuple[str, str]) -> np.ndarray | None:
+        if self.path is None:
+            return None
+        row = self.__connect().execute("SELECT dtype, vector FROM query_embeddings WHERE model = ? AND query = ?", key).fetchone()
+        if row is None:
+            return None
+        return as_readonly(np.frombuffer(row[1], dtype=row[0]).astype(np.float32))
+
+    def __write(self, key: tuple[str, str], vector: np.ndarray) -> None:
+        if self.path is None:
+            return
+        with self.__connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)", (*key, self.dtype.name, vector.astype(self.dtype).tobytes()))
+
+
+def shared_query_cache() -> QueryEmbeddingCache:
+    # one cache per process, so every search class shares the same LRU
+    global _shared
+    with _shared_guard:
+        if _shared is None:
+            _shared = QueryEmbeddingCache(config.QUERY_EMBEDDINGS_CACHE_FILE_PATH)
+        return _shared
+
+def as_readonly(vector: np.ndarray) -> np.ndarray:
+    # cached vectors are handed to every caller, so none of them may change one in place
+    vector.flags.writeable = False
+    return vector
@@ -1,5 +1,5 @@
-from sentence_transformers import CrossEncoder
 from lib import search_utils, config
+from lib.models import cross_encoder
 import time
 import json
 
@@ -44,7 +44,7 @@ Return ONLY the IDs in order of relevance (best match first). Return a valid JSO
     return get_response(prompt)
 
 def cross_encoder_scores(pairs: list[ list[str]] ) -> list[int]:
-    model = CrossEncoder(config.CROSS_ENCODER_MODEL_NAME)
+    model = cross_encoder(config.CROSS_ENCODER_MODEL_NAME, search_utils.RERANK_BACKEND)
     scores = model.predict(pairs)
     return scores
 
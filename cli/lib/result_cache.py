@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from lib import search_utils
+import threading
+import time
+import re
+
+NEAR_OPERATOR = re.compile(r"NEAR(?:/\d+)?")
+
+
+class ResultCache:
+    """LRU cache of search results with a time-to-live; entries from another generation are dropped."""
+
+    def __init__(self, maxsize: int = search_utils.RESULT_CACHE_SIZE, ttl: float = search_utils.RESULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl # seconds
+        self.entries: OrderedDict[Hashable, tuple[Hashable, float, object]] = OrderedDict() # key -> (generation, expiry, result)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0 # dropped to stay within maxsize
+        self.expirations = 0 # dropped after ttl
+        self.invalidations = 0 # dropped because the generation changed
+
+    def get_or_compute(self, key: Hashable, generation: Hashable, compute: Callable[[], object], keep: Callable[[object], bool] | None = None) -> object:
+        # keep, when given, decides whether a computed result may be cached at all
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry_generation, expires, result = entry
+                if entry_generation != generation:
+                    del self.entries[key]
+                    self.invalidations += 1
+                elif expires <= time.monotonic():
+                    del self.entries[key]
+                    self.expirations += 1
+                else:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+            self.misses += 1
+
+        # computed outside the lock so a slow search does not hold up cache hits
+        result = compute()
+        if self.maxsize <= 0 or (keep is not None and not keep(result)):
+            return result
+        with self.lock:
+            self.entries[key] = (generation, time.monotonic() + self.ttl, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def normalize_query(query: str, lower: bool = True) -> str:
+    # NEAR is kept as written since bm25_search only recognizes it in capitals
+    words = query.split()
+    if lower:
+        words = [w if NEAR_OPERATOR.fullmatch(w) else w.lower() for w in words]
+    return " ".join(words)
@@ -1,19 +1,72 @@
 import os
+import threading
 from dotenv import load_dotenv
-from google import genai
 
 MODEL = "gemini-2.5-flash"
 
-load_dotenv()
-api_key = os.environ.get("GEMINI_API_KEY")
-client = genai.Client(api_key=api_key)
+_client = None
+_client_guard = threading.Lock()
+
+
+def __getattr__(name: str):
+    # created on first use, so CLIs that never call Gemini do not import google.genai
+    if name == "client":
+        return gemini_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def gemini_client():
+    global _client
+    with _client_guard:
+        if _client is None:
+            from google import genai
+            load_dotenv()
+            _client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+        return _client
 
 
 BM25_K1 = 1.5
 BM25_B = 0.75
+BM25_BLOCK_SIZE = 64
+INDEX_MAX_SEGMENTS = 8
+INGEST_BATCH_SIZE = 1000
+EMBED_BATCH_SIZE = 64 # texts per model forward pass when building embeddings
+EMBED_WORKERS = 1 # CPU processes encoding in parallel; 1 encodes in this process
+EMBED_CHECKPOINT_ROWS = 4096 # encoded rows between checkpoints of an embeddings build
+STEM_CACHE_SIZE = 1 << 17
+INDEX_POSITIONS = True
+NEAR_DEFAULT_DISTANCE = 5
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 600
+FILTER_CACHE_SIZE = 64
+QUERY_CACHE_SIZE = 4096 # query embeddings kept in memory per process
+QUERY_CACHE_DTYPE = "float32" # or "float16" to halve the on-disk query cache
+IVF_MIN_ROWS = 50_000
+IVF_NPROBE = 16
+IVF_TRAIN_ITERATIONS = 10
+IVF_TRAIN_SAMPLE_PER_LIST = 64
+EMBEDDING_STORAGE = "float32"
+ENCODER_BACKEND = "torch" # "torch", "torch-int8", "onnx" or "onnx-int8", see lib.models
+RERANK_BACKEND = "torch" # the same choices for the cross-encoder
+ENCODER_AGREEMENT_MIN_COSINE = 0.99 # lowest cosine to the float model an int8 encoder may reach
+RESCORE_FACTOR = 4
+PQ_SUBSPACES = 48
+PQ_TRAIN_ITERATIONS = 10
+PQ_TRAIN_SAMPLE_PER_CENTROID = 64
+SPELL_MAX_EDIT_DISTANCE = 2
+SPELL_PREFIX_LENGTH = 7
+BM25F_TITLE_WEIGHT = 3.0
+BM25F_DESCRIPTION_WEIGHT = 1.0
+BM25F_TITLE_B = 0.75
+BM25F_DESCRIPTION_B = 0.75
 SEARCH_LIMIT = 5
 TEXT_CHUNK_SIZE = 200
 TEXT_CHUNK_OVERLAP = 0
 MAX_CHUNK_SIZE = 4
+SEMANTIC_CHUNK_OVERLAP = 1 # overlap of the description chunks embedded for chunked search
+CHUNK_POOLING = "max" # how chunk scores combine into a movie score, "max" or "mean_top_n"
+CHUNK_POOLING_TOP_N = 3 # chunks averaged by mean_top_n pooling
 ALPHA_VAL = 0.5
+HYBRID_LEG_WORKERS = 4 # threads for each of the keyword and semantic legs of hybrid searches
+HYBRID_LEG_MAX_ABANDONED = 2 # runs of a leg left going past their timeout before that leg is skipped
+HYBRID_LEG_TIMEOUT = None # seconds a leg may take before fusion goes ahead without it; None waits for both
 DEFAULT_RRF_K = 60 
\ No newline at end of file
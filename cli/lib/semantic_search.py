@@ -1,35 +1,84 @@
-from sentence_transformers import SentenceTransformer
-from lib import config
+from collections.abc import Iterable
+from lib import config, search_utils
+from lib.models import ENCODER_BACKENDS, encoder_key, sentence_transformer
+from lib.documents import batched, iter_documents
+from lib.result_cache import ResultCache, normalize_query
+from lib.filters import DocFilter
+from lib.vectors import cosine_scores, normalize_rows, open_unit_embeddings, pool_scores, save_unit_embeddings, top_k_rows
+from lib.ivf_index import IVFIndex, embeddings_source, load_or_build_ivf
+from lib.quantization import exact_scores, load_or_quantize
+from lib.query_cache import QueryEmbeddingCache, shared_query_cache
+from lib.embedding_cache import EmbeddingCache, clear_hashes, content_hashes, hashes_match, save_hashes
+from lib.embedding_pipeline import EmbeddingPipeline
 import numpy as np
-import json
 import os
 import re
+import time
 
 class SemanticSearch:
 
-    def __init__(self, model_name="all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
-        self.embeddings = None
+    def __init__(self, model_name=config.ENCODER_MODEL_NAME, storage: str = search_utils.EMBEDDING_STORAGE, rescore_factor: int = search_utils.RESCORE_FACTOR, query_cache: QueryEmbeddingCache | None = None, backend: str = search_utils.ENCODER_BACKEND):
+        if backend not in ENCODER_BACKENDS:
+            raise ValueError(f"Unknown encoder backend: {backend}")
+        self.model_name = model_name
+        self.backend = backend # see lib.models
+        self.encoder_key = encoder_key(model_name, backend) # keys cached vectors, so int8 ones never mix with float ones
+        self._model = None # loaded on first encode
+        self.query_cache = query_cache or shared_query_cache()
+        self.storage = storage # "float32", or a quantized format from lib.quantization
+        self.rescore_factor = rescore_factor # quantized scores shortlist limit * rescore_factor rows for exact rescoring, 0 to skip it
+        self.embeddings = None # L2-normalized, so cosine similarity is a dot product; memory-mapped when float32
+        self.raw_embeddings: np.ndarray | None = None # the float32 file memory-mapped for rescoring, None when not quantized
         self.documents: list[dict] = None
         self.document_map: dict[int, dict] = {}
+        self.doc_ids: np.ndarray = np.zeros(0, dtype=np.int64) # movie ID of each embedding row
+        self.generation = 0 # bumped whenever embeddings are built or loaded
+        self.build_stats: dict = {} # rows encoded, reused and resumed by the last build, its speed and peak memory
+        self.filter_cache = ResultCache(maxsize=search_utils.FILTER_CACHE_SIZE)
     
+    @property
+    def model(self):
+        # commands served from cached embeddings never load the model or import torch
+        if self._model is None:
+            self._model = sentence_transformer(self.model_name, self.backend)
+        return self._model
+
     def generate_embedding(self, text: str):
+        # query embeddings come from the cache, shared and read-only
         if not text or not text.strip():
             raise ValueError("text parameter is empty")
-        return self.model.encode([text])[0]
+        key = normalize_query(text, self.lowercases_text())
+        return self.query_cache.get_or_encode(self.encoder_key, key, lambda: self.model.encode([text])[0])
 
-    def build_embeddings(self, documents: list[dict]) -> np.ndarray:
-        self.documents = documents
-        self.document_map = {}
-        doc_str_rep = []
-        for d in documents:
-            self.document_map[d["id"]] = d
-            doc_str_rep.append(f"{d['title']}: {d['description']}")
-        self.embeddings = self.model.encode(doc_str_rep, show_progress_bar=True)
+    def build_embeddings(self, documents: Iterable[dict], batch_size: int = search_utils.EMBED_BATCH_SIZE, workers: int = search_utils.EMBED_WORKERS) -> np.ndarray:
+        # only movies whose text changed since the last build are encoded
+        start = time.perf_counter()
+        doc_ids: list[int] = []
+        batch_embeddings = []
+        batch_hashes = []
+        cache = EmbeddingCache.load(config.MOVIE_EMBEDDINGS_CACHE_FILE_PATH, config.MOVIE_HASHES_CACHE_FILE_PATH)
+        dim = self.model.get_sentence_embedding_dimension()
+        # keeps only movie IDs, so one batch of documents is alive at once
+        with EmbeddingPipeline(self.model, config.MOVIE_EMBEDDINGS_CACHE_FILE_PATH, batch_size, workers) as pipeline:
+            for batch in batched(documents, search_utils.INGEST_BATCH_SIZE):
+                doc_str_rep = []
+                for d in batch:
+                    doc_ids.append(d["id"])
+                    doc_str_rep.append(document_text(d))
+                hashes = content_hashes(doc_str_rep, self.encoder_key)
+                batch_embeddings.append(cache.embed(doc_str_rep, hashes, pipeline.encode, dim))
+                batch_hashes.append(hashes)
+        embeddings = np.concatenate(batch_embeddings) if batch_embeddings else np.zeros((0, dim), dtype=np.float32)
+        self.doc_ids = np.array(doc_ids, dtype=np.int64)
+        self.generation += 1
         os.makedirs(config.CACHE_FILE_PATH, exist_ok=True)
-        # Write movie embeddings
-        with open(config.MOVIE_EMBEDDINGS_CACHE_FILE_PATH, "wb") as f:
-            np.save(f, self.embeddings)
+        # the hashes go last, so a build cut short in between is never trusted
+        clear_hashes(config.MOVIE_HASHES_CACHE_FILE_PATH)
+        save_unit_embeddings(config.MOVIE_EMBEDDINGS_CACHE_FILE_PATH, normalize_rows(embeddings))
+        save_hashes(config.MOVIE_HASHES_CACHE_FILE_PATH, concat_hashes(batch_hashes))
+        pipeline.finish()
+        self.embeddings, self.raw_embeddings = self.load_vectors(config.MOVIE_EMBEDDINGS_CACHE_FILE_PATH)
+        self.build_stats = build_stats(len(doc_ids), cache, pipeline, start)
         return self.embeddings
     
     def load_or_create_embeddings(self, documents: list[dict]) -> np.ndarray:
@@ -37,79 +86,122 @@ class SemanticSearch:
         self.document_map = {}
         for d in documents:
             self.document_map[d["id"]] = d
-        if os.path.exists(config.MOVIE_EMBEDDINGS_CACHE_FILE_PATH):
-            with open(config.MOVIE_EMBEDDINGS_CACHE_FILE_PATH, "rb") as f:
-                self.embeddings = np.load(f)
-            if len(self.embeddings) == len(self.documents):
-                return self.embeddings
+        # the cache is used as is only when every movie's text hashes the same as when it was built
+        hashes = content_hashes([document_text(d) for d in documents], self.encoder_key)
+        if os.path.exists(config.MOVIE_EMBEDDINGS_CACHE_FILE_PATH) and hashes_match(config.MOVIE_HASHES_CACHE_FILE_PATH, hashes):
+            self.embeddings, self.raw_embeddings = self.load_vectors(config.MOVIE_EMBEDDINGS_CACHE_FILE_PATH)
+            self.doc_ids = np.array([d["id"] for d in documents], dtype=np.int64)
+            self.generation += 1
+            return self.embeddings
         return self.build_embeddings(documents)
+
+    def update_embeddings(self, path=config.DATA_FILE_PATH) -> np.ndarray:
+        # streams the catalog instead of holding it whole, for build commands
+        hashes = [content_hashes([document_text(d) for d in batch], self.encoder_key) for batch in batched(iter_documents(path), search_utils.INGEST_BATCH_SIZE)]
+        if os.path.exists(config.MOVIE_EMBEDDINGS_CACHE_FILE_PATH) and hashes_match(config.MOVIE_HASHES_CACHE_FILE_PATH, concat_hashes(hashes)):
+            self.embeddings, self.raw_embeddings = self.load_vectors(config.MOVIE_EMBEDDINGS_CACHE_FILE_PATH)
+            return self.embeddings
+        return self.build_embeddings(iter_documents(path))
+
+    def lowercases_text(self) -> bool:
+        # remembered by the query cache, so a cached query never loads the model
+        return self.query_cache.model_lowercases(self.model_name, lambda: bool(getattr(self.model.tokenizer, "do_lower_case", False)))
     
-    def search(self, query: str, limit: int) -> list[dict]:
+    def search(self, query: str, limit: int, doc_filter: DocFilter | None = None) -> list[dict]:
         if self.embeddings is None:
             raise ValueError("No embeddings loaded. Call `load_or_create_embeddings` first.")
         query_emb = self.generate_embedding(query)
-        similarity: list[tuple[float, dict]] = []
-        
-        for i in range(len(self.embeddings)):
-            co_sim = cosine_similarity(query_emb, self.embeddings[i])
-            similarity.append((co_sim, self.documents[i]))
-        
-        sorted_similarity = sorted(similarity, key=lambda sim: sim[0], reverse=True)
+        rows = self.allowed_rows(self.doc_ids, doc_filter, self.generation)
+        rows, scores = self.score_rows(self.embeddings, self.raw_embeddings, query_emb, rows, limit)
 
         final_res: list[dict] = []
-        for i in range(min(limit, len(sorted_similarity))):
+        for i in top_k_rows(scores, limit):
+            doc = self.documents[i if rows is None else rows[i]]
             final_res.append(
                 {
-                    "score": sorted_similarity[i][0],
-                    "title": sorted_similarity[i][1]["title"],
-                    "description": sorted_similarity[i][1]["description"],
+                    "score": float(scores[i]),
+                    "title": doc["title"],
+                    "description": doc["description"],
                 }
             )
         return final_res
 
+    def load_vectors(self, path) -> tuple:
+        raw = open_unit_embeddings(path)
+        if self.storage == "float32":
+            return raw, None
+        return load_or_quantize(path, self.storage, embeddings_source(path, raw)), raw
+
+    def score_rows(self, embeddings, raw_embeddings: np.ndarray | None, query_emb: np.ndarray, rows: np.ndarray | None, limit: int) -> tuple[np.ndarray | None, np.ndarray]:
+        # quantized scores only pick a shortlist, rescored exactly from the float32 file
+        scores = cosine_scores(embeddings, query_emb, rows)
+        if raw_embeddings is None or self.rescore_factor <= 0:
+            return rows, scores
+        shortlist = top_k_rows(scores, limit * self.rescore_factor)
+        shortlist_rows = shortlist if rows is None else rows[shortlist]
+        return shortlist_rows, exact_scores(raw_embeddings, query_emb, shortlist_rows)
+
+    def allowed_rows(self, row_doc_ids: np.ndarray, doc_filter: DocFilter | None, generation: int) -> np.ndarray | None:
+        if doc_filter is None:
+            return None
+        allowed = doc_filter.bitmap(self.documents, self.filter_cache, generation)
+        return np.flatnonzero(allowed.contains(row_doc_ids))
+
 
 class ChunkedSemanticSearch(SemanticSearch):
 
-    def __init__(self, model_name = "all-MiniLM-L6-v2") -> None:
-        super().__init__(model_name)
-        self.chunk_embeddings = None
-        self.chunk_metadata = None
+    def __init__(self, model_name = config.ENCODER_MODEL_NAME, storage: str = search_utils.EMBEDDING_STORAGE, rescore_factor: int = search_utils.RESCORE_FACTOR, query_cache: QueryEmbeddingCache | None = None, backend: str = search_utils.ENCODER_BACKEND) -> None:
+        super().__init__(model_name, storage, rescore_factor, query_cache, backend)
+        self.chunk_embeddings = None # L2-normalized like the movie embeddings
+        self.raw_chunk_embeddings: np.ndarray | None = None
+        self.chunk_movie_idx: np.ndarray = np.zeros(0, dtype=np.int64) # position in documents of each chunk's movie
+        self.chunk_doc_ids: np.ndarray = np.zeros(0, dtype=np.int64) # movie ID of each chunk
+        self.chunk_generation = 0 # bumped whenever chunk embeddings are built or loaded
+        self.ivf: IVFIndex | None = None # approximate index over chunk_embeddings, None to always search exactly
+        self.cache = ResultCache()
     
-    def build_chunk_embeddings(self, documents: list[dict]):
-        self.documents = documents
-        self.document_map = {}
-        chunks: list[str] = []
-        chunk_meta: list[dict] = []
-        for movie_idx, d in enumerate(documents):
-            if not d['description']:
-                continue
-            semantic_chunks = semantic_chunk(d['description'], 1, 4)
-            for chunk_idx, chunk_text in enumerate(semantic_chunks):
-                chunks.append(chunk_text)
-                chunk_meta.append(
-                    {
-                        "movie_idx": movie_idx,
-                        "chunk_idx": chunk_idx,
-                        "total_chunks": len(semantic_chunks),
-                    }
-                )
-            self.document_map[d["id"]] = d
-        self.chunk_embeddings = self.model.encode(chunks, show_progress_bar=True)
-        self.chunk_metadata = chunk_meta
+    def build_chunk_embeddings(self, documents: Iterable[dict], batch_size: int = search_utils.EMBED_BATCH_SIZE, workers: int = search_utils.EMBED_WORKERS):
+        # only chunks whose text is new since the last build are encoded
+        start = time.perf_counter()
+        doc_ids: list[int] = []
+        chunk_movies: list[int] = []
+        batch_embeddings = []
+        batch_hashes = []
+        document_hashes = []
+        cache = EmbeddingCache.load(config.CHUNK_EMBEDDINGS_CACHE_FILE_PATH, config.CHUNK_HASHES_CACHE_FILE_PATH)
+        dim = self.model.get_sentence_embedding_dimension()
+        with EmbeddingPipeline(self.model, config.CHUNK_EMBEDDINGS_CACHE_FILE_PATH, batch_size, workers) as pipeline:
+            for batch in batched(documents, search_utils.INGEST_BATCH_SIZE):
+                chunks: list[str] = []
+                for d in batch:
+                    movie_idx = len(doc_ids)
+                    doc_ids.append(d["id"])
+                    if not d['description']:
+                        continue
+                    semantic_chunks = semantic_chunk(d['description'], search_utils.SEMANTIC_CHUNK_OVERLAP, search_utils.MAX_CHUNK_SIZE)
+                    chunks.extend(semantic_chunks)
+                    chunk_movies.extend([movie_idx] * len(semantic_chunks))
+                document_hashes.append(self.chunk_document_hashes(batch))
+                if chunks:
+                    hashes = content_hashes(chunks, *self.chunk_hash_salt())
+                    batch_embeddings.append(cache.embed(chunks, hashes, pipeline.encode, dim))
+                    batch_hashes.append(hashes)
+        chunk_embeddings = np.concatenate(batch_embeddings) if batch_embeddings else np.zeros((0, dim), dtype=np.float32)
+        self.chunk_generation += 1
         os.makedirs(config.CACHE_FILE_PATH, exist_ok=True)
+        clear_hashes(config.CHUNK_DOCUMENT_HASHES_CACHE_FILE_PATH)
+        clear_hashes(config.CHUNK_HASHES_CACHE_FILE_PATH)
         # Write chunk embeddngs
-        with open(config.CHUNK_EMBEDDINGS_CACHE_FILE_PATH, "wb") as f:
-            np.save(f, self.chunk_embeddings)
-        # Write chunk metadata
-        with open(config.CHUNK_METADATA_CACHE_FILE_PATH, "w") as f:
-            json.dump(
-                {
-                    "chunks": self.chunk_metadata,
-                    "total_chunks": len(chunks)
-                },
-                f,
-                indent=2
-                )
+        save_unit_embeddings(config.CHUNK_EMBEDDINGS_CACHE_FILE_PATH, normalize_rows(chunk_embeddings))
+        self.chunk_embeddings, self.raw_chunk_embeddings = self.load_vectors(config.CHUNK_EMBEDDINGS_CACHE_FILE_PATH)
+        self.save_chunk_metadata(np.array(chunk_movies, dtype=np.int64), np.array(doc_ids, dtype=np.int64))
+        self.load_chunk_metadata()
+        self.load_or_build_ivf()
+        # Write content hashes, last so that a build cut short is rebuilt
+        save_hashes(config.CHUNK_HASHES_CACHE_FILE_PATH, concat_hashes(batch_hashes))
+        save_hashes(config.CHUNK_DOCUMENT_HASHES_CACHE_FILE_PATH, concat_hashes(document_hashes))
+        pipeline.finish()
+        self.build_stats = build_stats(len(doc_ids), cache, pipeline, start)
         return self.chunk_embeddings
     
     def load_or_create_chunk_embeddings(self, documents: list[dict]) -> np.ndarray:
@@ -117,48 +209,117 @@ class ChunkedSemanticSearch(SemanticSearch):
         self.document_map = {}
         for d in documents:
             self.document_map[d["id"]] = d
-        if os.path.exists(config.CHUNK_EMBEDDINGS_CACHE_FILE_PATH) and os.path.exists(config.CHUNK_METADATA_CACHE_FILE_PATH):
-            with open(config.CHUNK_EMBEDDINGS_CACHE_FILE_PATH, "rb") as f:
-                self.chunk_embeddings = np.load(f)
-            with open(config.CHUNK_METADATA_CACHE_FILE_PATH, "r") as f:
-                self.chunk_metadata = json.load(f)["chunks"]
+        if os.path.exists(config.CHUNK_EMBEDDINGS_CACHE_FILE_PATH) and hashes_match(config.CHUNK_DOCUMENT_HASHES_CACHE_FILE_PATH, self.chunk_document_hashes(documents)):
+            self.chunk_embeddings, self.raw_chunk_embeddings = self.load_vectors(config.CHUNK_EMBEDDINGS_CACHE_FILE_PATH)
+            if not self.load_chunk_metadata():
+                return self.build_chunk_embeddings(documents)
+            self.chunk_generation += 1
+            self.load_or_build_ivf()
             return self.chunk_embeddings
         return self.build_chunk_embeddings(documents)
 
-    def search_chunks(self, query: str, limit: int = 10) -> list[dict]:
-        query_emb = self.generate_embedding(query)
-        chunk_score = []
+    def update_chunk_embeddings(self, path=config.DATA_FILE_PATH) -> np.ndarray:
+        hashes = [self.chunk_document_hashes(batch) for batch in batched(iter_documents(path), search_utils.INGEST_BATCH_SIZE)]
+        if os.path.exists(config.CHUNK_EMBEDDINGS_CACHE_FILE_PATH) and hashes_match(config.CHUNK_DOCUMENT_HASHES_CACHE_FILE_PATH, concat_hashes(hashes)):
+            self.chunk_embeddings, self.raw_chunk_embeddings = self.load_vectors(config.CHUNK_EMBEDDINGS_CACHE_FILE_PATH)
+            if self.load_chunk_metadata():
+                return self.chunk_embeddings
+        return self.build_chunk_embeddings(iter_documents(path))
 
-        for chunk_idx, v in enumerate(self.chunk_embeddings):
-            cos_sim = cosine_similarity(v, query_emb)
-            chunk_score.append(
-                {
-                    "chunk_idx": chunk_idx,
-                    "movie_idx": self.chunk_metadata[chunk_idx]["movie_idx"],
-                    "score": cos_sim 
-                }
-            )
-        movie_idx_scores = {}
-        for i in range(len(chunk_score)):
-            if chunk_score[i]["movie_idx"] not in movie_idx_scores or chunk_score[i]["score"] > movie_idx_scores[chunk_score[i]["movie_idx"]]:
-                movie_idx_scores[chunk_score[i]["movie_idx"]] = chunk_score[i]["score"]
-                
+    def chunk_hash_salt(self) -> tuple:
+        # everything besides its text that a chunk's embedding depends on
+        return (self.encoder_key, search_utils.SEMANTIC_CHUNK_OVERLAP, search_utils.MAX_CHUNK_SIZE)
+
+    def chunk_document_hashes(self, documents: list[dict]) -> np.ndarray:
+        # the ID is hashed too because chunk_metadata.npy stores it
+        return content_hashes([f"{d['id']}\0{d['description'] or ''}" for d in documents], *self.chunk_hash_salt())
+
+    def save_chunk_metadata(self, movie_idx: np.ndarray, movie_ids: np.ndarray) -> None:
+        # No per-movie offsets: pool_scores scatters by movie position, and the scored rows
+        # are often an IVF or filter subset that offsets would not describe
+        doc_ids = movie_ids[movie_idx]
+        tmp_path = f"{config.CHUNK_METADATA_CACHE_FILE_PATH}.tmp.npy"
+        np.save(tmp_path, np.stack([movie_idx, doc_ids]))
+        os.replace(tmp_path, config.CHUNK_METADATA_CACHE_FILE_PATH)
 
-        sorted_movie_idx_scores = sorted(movie_idx_scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+    def load_chunk_metadata(self) -> bool:
+        # files from before chunk_idx was dropped have it as a middle row
+        if not os.path.exists(config.CHUNK_METADATA_CACHE_FILE_PATH):
+            return False
+        metadata = np.load(config.CHUNK_METADATA_CACHE_FILE_PATH, mmap_mode="r")
+        if metadata.ndim != 2 or metadata.shape[0] not in (2, 3) or metadata.shape[1] != len(self.chunk_embeddings):
+            return False
+        self.chunk_movie_idx, self.chunk_doc_ids = metadata[0], metadata[-1]
+        return True
 
+    def load_or_build_ivf(self, min_rows: int = search_utils.IVF_MIN_ROWS) -> None:
+        # below min_rows an exact scan is cheap enough that searches skip the index
+        if len(self.chunk_embeddings) == 0 or len(self.chunk_embeddings) < min_rows:
+            self.ivf = None
+            return
+        source = embeddings_source(config.CHUNK_EMBEDDINGS_CACHE_FILE_PATH, self.chunk_embeddings)
+        vectors = self.chunk_embeddings if self.raw_chunk_embeddings is None else self.raw_chunk_embeddings
+        self.ivf = load_or_build_ivf(config.CHUNK_IVF_CACHE_FILE_PATH, vectors, source)
+
+    def search_chunks(self, query: str, limit: int = 10, doc_filter: DocFilter | None = None, nprobe: int = search_utils.IVF_NPROBE, pooling: str = search_utils.CHUNK_POOLING, top_n: int = search_utils.CHUNK_POOLING_TOP_N) -> list[dict]:
+        # nprobe=0 searches every chunk exactly
+        nprobe = nprobe if self.ivf is not None else 0
+        key = ("chunks", normalize_query(query, self.lowercases_text()), limit, doc_filter, nprobe, pooling, top_n)
+        results = self.cache.get_or_compute(key, self.chunk_generation, lambda: self.__search_chunks(query, limit, doc_filter, nprobe, pooling, top_n))
+        # nested dicts too, so callers that fill in "metadata" never write into the cache
+        return [{**r, "metadata": dict(r["metadata"])} for r in results]
+
+    def ann_recall(self, queries: list[str], limit: int, nprobes: list[int]) -> list[dict]:
+        # recall@limit against exact search, per nprobe setting
+        if self.ivf is None:
+            raise ValueError("No IVF index loaded. Call `load_or_build_ivf` first.")
+        exact = []
+        start = time.perf_counter()
+        for q in queries:
+            exact.append({r["id"] for r in self.__search_chunks(q, limit, None, 0)})
+        exact_secs = (time.perf_counter() - start) / max(1, len(queries))
         res = []
-        for v in sorted_movie_idx_scores:
-            obj = self.documents[v[0]]
+        for nprobe in nprobes:
+            found = 0
+            start = time.perf_counter()
+            for q, expected in zip(queries, exact):
+                found += len(expected & {r["id"] for r in self.__search_chunks(q, limit, None, nprobe)})
+            secs = (time.perf_counter() - start) / max(1, len(queries))
+            res.append({"nprobe": nprobe, "recall": found / max(1, sum(len(e) for e in exact)), "secs": secs, "exact_secs": exact_secs})
+        return res
+
+    def __search_chunks(self, query: str, limit: int, doc_filter: DocFilter | None, nprobe: int, pooling: str = search_utils.CHUNK_POOLING, top_n: int = search_utils.CHUNK_POOLING_TOP_N) -> list[dict]:
+        query_emb = self.generate_embedding(query)
+        rows = self.__candidate_rows(query_emb, doc_filter, nprobe)
+        rows, chunk_scores = self.score_rows(self.chunk_embeddings, self.raw_chunk_embeddings, query_emb, rows, limit)
+        chunk_movies = np.asarray(self.chunk_movie_idx) if rows is None else self.chunk_movie_idx[rows]
+        scored_movies, movie_scores = pool_scores(chunk_movies, chunk_scores, len(self.documents), pooling, top_n)
+
+        res = []
+        for i in top_k_rows(movie_scores, limit):
+            obj = self.documents[scored_movies[i]]
             res.append(
                 {
                     "id": obj["id"],
                     "title": obj["title"],
                     "document": obj["description"][:100],
-                    "score": round(v[1], 2),
+                    "score": round(float(movie_scores[i]), 2),
                     "metadata": {}
                 }
             )
         return res
+
+    def __candidate_rows(self, query_emb: np.ndarray, doc_filter: DocFilter | None, nprobe: int) -> np.ndarray | None:
+        allowed = self.allowed_rows(self.chunk_doc_ids, doc_filter, self.chunk_generation)
+        if self.ivf is None or nprobe <= 0:
+            return allowed
+        if allowed is not None and len(allowed) <= self.ivf.expected_probe_rows(nprobe):
+            # a filter this selective leaves fewer rows than probing would score
+            return allowed
+        rows = self.ivf.probe(query_emb, nprobe)
+        if allowed is not None:
+            rows = rows[np.isin(rows, allowed, assume_unique=True)]
+        return rows
     
 
 def verify_model():
@@ -175,10 +336,8 @@ def embed_text(text: str):
 
 def verify_embeddings():
     sem = SemanticSearch()
-    with open(config.DATA_FILE_PATH, "r") as f:
-        documents = json.load(f)["movies"]
-    embeddings = sem.load_or_create_embeddings(documents)
-    print(f"Number of docs:  {len(documents)}")
+    embeddings = sem.update_embeddings()
+    print(f"Number of docs:  {embeddings.shape[0]}")
     print(f"Embeddings shape:  {embeddings.shape[0]} vectors in {embeddings.shape[1]} dimensions")
 
 def embed_query_text(query: str):
@@ -188,6 +347,22 @@ def embed_query_text(query: str):
     print(f"First 5 dimensions: {embedding[:5]}")
     print(f"Shape: {embedding.shape}")
 
+def document_text(doc: dict) -> str:
+    return f"{doc['title']}: {doc['description']}"
+
+def concat_hashes(batches: list[np.ndarray]) -> np.ndarray:
+    return np.concatenate(batches) if batches else np.zeros(0, dtype=np.uint64)
+
+def build_stats(documents: int, cache: EmbeddingCache, pipeline: EmbeddingPipeline, start: float) -> dict:
+    secs = time.perf_counter() - start
+    return {
+        "documents": documents,
+        "reused": cache.reused, # copied from the previous build
+        **pipeline.stats(),
+        "secs": secs,
+        "docs_per_sec": documents / secs if secs else 0.0,
+    }
+
 def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
     dot_product = np.dot(vec1, vec2)
     norm1 = np.linalg.norm(vec1)
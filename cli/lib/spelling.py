@@ -0,0 +1,193 @@
+from collections.abc import Mapping
+from itertools import chain
+from lib import config, search_utils
+from lib.keyword_search import InvertedIndex, PUNCTUATION_TABLE, load_stop_words, stem
+from lib.postings import TITLE_PREFIX
+import numpy as np
+import threading
+import string
+import zlib
+import os
+import re
+
+
+class SpellingCorrector:
+    """Symmetric-delete (SymSpell) spelling correction over the keyword index terms."""
+
+    def __init__(self, words: np.ndarray, dfs: np.ndarray, delete_hashes: np.ndarray, delete_words: np.ndarray, generation: int, max_edit_distance: int, prefix_length: int):
+        self.words = words # index terms, sorted
+        self.dfs = dfs # number of documents containing each word
+        self.delete_hashes = delete_hashes # sorted
+        self.delete_words = delete_words # index into words of the word each delete came from
+        self.generation = generation # index generation the vocabulary was read from
+        self.max_edit_distance = max_edit_distance
+        self.prefix_length = prefix_length
+        self.word_ids = {w: i for i, w in enumerate(words.tolist())}
+
+    @classmethod
+    def build(cls, document_frequencies: Mapping[str, int], generation: int, max_edit_distance: int = search_utils.SPELL_MAX_EDIT_DISTANCE, prefix_length: int = search_utils.SPELL_PREFIX_LENGTH) -> "SpellingCorrector":
+        dfs = {t: df for t, df in document_frequencies.items() if not t.startswith(TITLE_PREFIX)}
+        words = sorted(dfs)
+
+        hashes: list[int] = []
+        word_ids: list[int] = []
+        for i, w in enumerate(words):
+            for d in deletes(w[:prefix_length], max_edit_distance):
+                hashes.append(zlib.crc32(d.encode("utf-8")))
+                word_ids.append(i)
+        hashes_arr = np.array(hashes, dtype=np.uint32)
+        order = np.argsort(hashes_arr, kind="stable")
+        return cls(
+            np.array(words, dtype=str),
+            np.array([dfs[w] for w in words], dtype=np.uint32),
+            hashes_arr[order],
+            np.array(word_ids, dtype=np.uint32)[order],
+            generation,
+            max_edit_distance,
+            prefix_length,
+        )
+
+    def save(self, path) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            words=self.words,
+            dfs=self.dfs,
+            delete_hashes=self.delete_hashes,
+            delete_words=self.delete_words,
+            params=np.array([self.generation, self.max_edit_distance, self.prefix_length], dtype=np.int64),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path) -> "SpellingCorrector":
+        with np.load(path) as data:
+            generation, max_edit_distance, prefix_length = data["params"].tolist()
+            return cls(data["words"], data["dfs"], data["delete_hashes"], data["delete_words"], generation, max_edit_distance, prefix_length)
+
+    def correct_word(self, word: str) -> str:
+        # ties go to the more common word; words that stem to an index term are left alone
+        if word in self.word_ids or stem(word) in self.word_ids:
+            return word
+        query_deletes = [zlib.crc32(d.encode("utf-8")) for d in deletes(word[:self.prefix_length], self.max_edit_distance)]
+        query_hashes = np.array(query_deletes, dtype=np.uint32)
+        lo = np.searchsorted(self.delete_hashes, query_hashes, side="left")
+        hi = np.searchsorted(self.delete_hashes, query_hashes, side="right")
+        candidates = set(chain.from_iterable(self.delete_words[a:b].tolist() for a, b in zip(lo.tolist(), hi.tolist()) if a < b))
+
+        best, best_key = word, None
+        for i in candidates:
+            candidate = str(self.words[i])
+            if abs(len(candidate) - len(word)) > self.max_edit_distance:
+                continue
+            # once a match is found, only an equally close or closer one can replace it
+            limit = best_key[0] if best_key is not None else self.max_edit_distance
+            distance = edit_distance(word, candidate, limit)
+            if distance > limit:
+                continue
+            key = (distance, -int(self.dfs[i]), candidate)
+            if best_key is None or key < best_key:
+                best, best_key = candidate, key
+        return best
+
+    def correct(self, query: str) -> str:
+        # keeps surrounding punctuation (quotes, NEAR/k) and each word's capitalization
+        stop_words = load_stop_words()
+
+        def fix(match: re.Match) -> str:
+            token = match.group(0)
+            core = token.strip(string.punctuation)
+            word = core.lower().translate(PUNCTUATION_TABLE)
+            if len(word) <= 2 or not word.isalpha() or word in stop_words or core == "NEAR":
+                return token
+            corrected = self.correct_word(word)
+            if corrected == word:
+                return token
+            if core.isupper():
+                corrected = corrected.upper()
+            elif core[0].isupper():
+                corrected = corrected.capitalize()
+            start = token.index(core)
+            return token[:start] + corrected + token[start + len(core):]
+
+        return re.sub(r"\S+", fix, query)
+
+
+_index: InvertedIndex | None = None
+_corrector: SpellingCorrector | None = None
+_corrector_guard = threading.Lock()
+
+def load_or_build_corrector(idx: InvertedIndex) -> SpellingCorrector:
+    # rebuilt from the index's term table whenever the generation changes
+    global _corrector
+    with _corrector_guard:
+        if _corrector is not None and _corrector.generation == idx.generation:
+            return _corrector
+        path = config.SPELLING_CACHE_FILE_PATH
+        if os.path.exists(path):
+            corrector = SpellingCorrector.load(path)
+            if corrector.generation == idx.generation:
+                _corrector = corrector
+                return corrector
+        _corrector = SpellingCorrector.build(idx.document_frequencies(), idx.generation)
+        _corrector.save(path)
+        return _corrector
+
+def correct_query(query: str) -> str:
+    # the index stays loaded between calls and is reopened only when it changes on disk
+    global _index
+    idx = _index
+    if idx is None or not idx.is_current():
+        idx = InvertedIndex()
+        idx.load()
+        _index = idx
+    return load_or_build_corrector(idx).correct(query)
+
+def deletes(word: str, max_edit_distance: int) -> set[str]:
+    result = {word}
+    frontier = {word}
+    for _ in range(max_edit_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        result |= frontier
+    return result
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    # optimal string alignment distance, or max_distance + 1 once it is certain to exceed it;
+    # only the band within max_distance of the diagonal is filled in
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    a, b = a[start:end_a], b[start:end_b]
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if not a or not b:
+        return max(len(a), len(b))
+
+    too_far = max_distance + 1
+    prev_prev: list[int] = []
+    prev = [j if j <= max_distance else too_far for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        cur = [too_far] * (len(b) + 1)
+        if i <= max_distance:
+            cur[0] = i
+        lo, hi = max(1, i - max_distance), min(len(b), i + max_distance)
+        row_min = cur[0]
+        for j in range(lo, hi + 1):
+            d = prev[j - 1] if a[i - 1] == b[j - 1] else prev[j - 1] + 1
+            if prev[j] + 1 < d:
+                d = prev[j] + 1
+            if cur[j - 1] + 1 < d:
+                d = cur[j - 1] + 1
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1] and prev_prev[j - 2] + 1 < d:
+                d = prev_prev[j - 2] + 1
+            cur[j] = d if d < too_far else too_far
+            if d < row_min:
+                row_min = d
+        if row_min > max_distance:
+            return too_far
+        prev_prev, prev = prev, cur
+    return prev[-1]
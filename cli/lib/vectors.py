@@ -0,0 +1,85 @@
+import numpy as np
+import os
+
+NORM_CHECK_ROWS = 64 # rows sampled to tell whether a stored embeddings file is already normalized
+POOLING_MODES = ("max", "mean_top_n")
+
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    # all-zero rows stay zero and score 0, as cosine_similarity gives them
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms).astype(embeddings.dtype)
+
+def save_unit_embeddings(path, unit_embeddings: np.ndarray) -> None:
+    # renamed over the target, so a process still mapping the old file keeps reading it intact
+    tmp_path = f"{path}.tmp.npy"
+    np.save(tmp_path, np.ascontiguousarray(unit_embeddings, dtype=np.float32))
+    os.replace(tmp_path, path)
+
+def open_unit_embeddings(path) -> np.ndarray:
+    # a file saved before embeddings were normalized on write is normalized and rewritten once
+    embeddings = np.load(path, mmap_mode="r")
+    if not is_normalized(embeddings):
+        save_unit_embeddings(path, normalize_rows(np.asarray(embeddings)))
+        embeddings = np.load(path, mmap_mode="r")
+    return embeddings
+
+def is_normalized(embeddings: np.ndarray) -> bool:
+    # checks rows spread over the whole matrix instead of reading all of it
+    if len(embeddings) == 0:
+        return True
+    rows = np.unique(np.linspace(0, len(embeddings) - 1, NORM_CHECK_ROWS).astype(np.int64))
+    norms = np.linalg.norm(np.asarray(embeddings[rows], dtype=np.float32), axis=1)
+    return bool(np.all((norms == 0) | (np.abs(norms - 1) < 1e-3)))
+
+def cosine_scores(unit_embeddings, query: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+    # quantized embeddings (lib.quantization) score themselves
+    norm = np.linalg.norm(query)
+    if norm == 0:
+        return np.zeros(len(unit_embeddings) if rows is None else len(rows), dtype=np.float32)
+    if not isinstance(unit_embeddings, np.ndarray):
+        return unit_embeddings.scores(query / norm, rows)
+    query = (query / norm).astype(unit_embeddings.dtype)
+    if rows is None:
+        return unit_embeddings @ query
+    return unit_embeddings[rows] @ query
+
+def top_k_rows(scores: np.ndarray, limit: int) -> np.ndarray:
+    # equal scores keep the lower position first, as the stable sort this replaces did
+    if limit <= 0 or len(scores) == 0:
+        return np.zeros(0, dtype=np.intp)
+    candidates = np.arange(len(scores))
+    if limit < len(scores):
+        kth = len(scores) - limit
+        threshold = scores[np.argpartition(scores, kth)[kth]]
+        candidates = np.flatnonzero(scores >= threshold)
+    order = np.lexsort((candidates, -scores[candidates]))[:limit]
+    return candidates[order]
+
+def pool_scores(groups: np.ndarray, scores: np.ndarray, size: int, mode: str = "max", top_n: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    # Returns the groups present, ascending, with their pooled scores. ufunc.at runs several
+    # times faster than reduceat when most groups hold only a few scores.
+    if mode not in POOLING_MODES:
+        raise ValueError(f"Unknown pooling mode: {mode}")
+    counts = np.bincount(groups, minlength=size)
+    present = np.flatnonzero(counts)
+    best = np.full(size, -np.inf, dtype=scores.dtype)
+    np.maximum.at(best, groups, scores)
+    if mode == "max" or top_n <= 1:
+        return present, best[present]
+
+    # top_n rounds of taking every group's best and then dropping one score equal to it
+    remaining = scores.copy()
+    positions = np.arange(len(scores))
+    total = np.zeros(size, dtype=np.float64)
+    for i in range(top_n):
+        if i:
+            best.fill(-np.inf)
+            np.maximum.at(best, groups, remaining)
+        total[present] += np.where(np.isfinite(best[present]), best[present], 0)
+        if i < top_n - 1:
+            hit = np.flatnonzero(remaining == best[groups])
+            first = np.full(size, len(scores))
+            np.minimum.at(first, groups[hit], positions[hit])
+            remaining[first[present]] = -np.inf
+    return present, (total[present] / np.minimum(counts[present], top_n)).astype(scores.dtype)
@@ -11,6 +11,9 @@ def main():
     image_search_parser = subparsers.add_parser("image_search", help="Search image")
     image_search_parser.add_argument("path", type=str, help="Image path")
 
+    text_search_parser = subparsers.add_parser("text_search", help="Search movies with a text query in the CLIP embedding space")
+    text_search_parser.add_argument("query", type=str, help="Search query")
+
     args = parser.parse_args()
 
     match args.command:
@@ -19,6 +22,16 @@ def main():
         case "image_search":
             result = multimodal_search.image_search_command(args.path)
 
+            for i, d in enumerate(result, start=1):
+                print(f"{i}. {d['title']} (similarity: {d['similarity_score']:.3f})")
+                print(d["description"])
+        case "text_search":
+            try:
+                result = multimodal_search.text_search_command(args.query)
+            except ValueError as e:
+                print("Error:", e)
+                return
+
             for i, d in enumerate(result, start=1):
                 print(f"{i}. {d['title']} (similarity: {d['similarity_score']:.3f})")
                 print(d["description"])
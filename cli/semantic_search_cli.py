@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 from lib import semantic_search, search_utils, config
+from lib.documents import iter_documents, load_documents
+from lib.filters import parse_filter
+from lib.models import ENCODER_BACKENDS
 import argparse
-import json
+import random
 
 def main():
     parser = argparse.ArgumentParser(description="Semantic Search CLI")
@@ -20,6 +23,11 @@ def main():
     search_parser = subparsers.add_parser("search", help="Search movies using vector cosine similarity")
     search_parser.add_argument("query", type=str, help="Query")
     search_parser.add_argument("--limit", type=int, nargs='?', default=search_utils.SEARCH_LIMIT, help="Limit the search results")
+    search_parser.add_argument("--storage", type=str, choices=["float32", "float16", "int8", "pq"], default=search_utils.EMBEDDING_STORAGE, help="Embedding storage to search; compressed formats are encoded from the float32 file on first use")
+    search_parser.add_argument("--rescore-factor", type=int, default=search_utils.RESCORE_FACTOR, help="Rescore the best limit * factor rows of compressed embeddings with float32; 0 skips it")
+    search_parser.add_argument("--backend", type=str, choices=ENCODER_BACKENDS, default=search_utils.ENCODER_BACKEND, help="Encoder backend; moving to or from an int8 backend embeds the catalog again")
+    search_parser.add_argument("--ids", type=int, nargs="+", help="Only return these movie IDs")
+    search_parser.add_argument("--where", type=str, action="append", help="Only return movies matching field<op>value, op one of = != < <= > >= ~ (contains); repeatable, all must hold")
 
     chunk_parser = subparsers.add_parser("chunk", help="Splits text into chunks")
     chunk_parser.add_argument("text", type=str, help="Text")
@@ -33,10 +41,28 @@ def main():
 
     embed_chunks_parser = subparsers.add_parser("embed_chunks", help="Embeds text chunks")
 
+    build_embeddings_parser = subparsers.add_parser("build_embeddings", help="Builds the movie or chunk embeddings in checkpointed batches, resuming an interrupted build")
+    build_embeddings_parser.add_argument("--chunks", action="store_true", help="Build the chunk embeddings instead of the movie embeddings")
+    build_embeddings_parser.add_argument("--batch-size", type=int, default=search_utils.EMBED_BATCH_SIZE, help="Texts per model forward pass")
+    build_embeddings_parser.add_argument("--backend", type=str, choices=ENCODER_BACKENDS, default=search_utils.ENCODER_BACKEND, help="Encoder backend")
+    build_embeddings_parser.add_argument("--workers", type=int, default=search_utils.EMBED_WORKERS, help="CPU processes encoding in parallel")
+
     search_chunked_parser = subparsers.add_parser("search_chunked")
     search_chunked_parser.add_argument("query", type=str, help="Query")
     search_chunked_parser.add_argument("--limit", type=int, nargs='?', default=search_utils.SEARCH_LIMIT, help="Limit the search results")
-
+    search_chunked_parser.add_argument("--storage", type=str, choices=["float32", "float16", "int8", "pq"], default=search_utils.EMBEDDING_STORAGE, help="Embedding storage to search; compressed formats are encoded from the float32 file on first use")
+    search_chunked_parser.add_argument("--rescore-factor", type=int, default=search_utils.RESCORE_FACTOR, help="Rescore the best limit * factor rows of compressed embeddings with float32; 0 skips it")
+    search_chunked_parser.add_argument("--nprobe", type=int, default=search_utils.IVF_NPROBE, help="IVF lists to search once the catalog is large enough to have an index; 0 searches every chunk")
+    search_chunked_parser.add_argument("--backend", type=str, choices=ENCODER_BACKENDS, default=search_utils.ENCODER_BACKEND, help="Encoder backend; moving to or from an int8 backend embeds the catalog again")
+    search_chunked_parser.add_argument("--ids", type=int, nargs="+", help="Only return these movie IDs")
+    search_chunked_parser.add_argument("--where", type=str, action="append", help="Only return movies matching field<op>value, op one of = != < <= > >= ~ (contains); repeatable, all must hold")
+    search_chunked_parser.add_argument("--pooling", type=str, choices=["max", "mean_top_n"], default=search_utils.CHUNK_POOLING, help="Score a movie by its best chunk or by the mean of its best --top-n chunks")
+    search_chunked_parser.add_argument("--top-n", type=int, default=search_utils.CHUNK_POOLING_TOP_N, help="Chunks averaged by mean_top_n pooling")
+
+    ann_recall_parser = subparsers.add_parser("ann_recall", help="Measure recall@k of IVF chunk search against exact search")
+    ann_recall_parser.add_argument("--queries", type=int, default=100, help="Number of queries, sampled from movie descriptions")
+    ann_recall_parser.add_argument("--limit", type=int, default=10, help="k, the number of movies compared per query")
+    ann_recall_parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64], help="Lists to probe per query")
 
     args = parser.parse_args()
 
@@ -50,14 +76,22 @@ def main():
         case "embedquery":
             semantic_search.embed_query_text(args.query)
         case "search":
-            sem = semantic_search.SemanticSearch()
+            try:
+                doc_filter = parse_filter(args.ids, args.where)
+            except ValueError as e:
+                print("Error:", e)
+                return
+            sem = semantic_search.SemanticSearch(storage=args.storage, rescore_factor=args.rescore_factor, backend=args.backend)
 
             # Load movies json
-            with open(config.DATA_FILE_PATH, "r") as f:
-                documents = json.load(f)["movies"]
+            documents = load_documents()
             _ = sem.load_or_create_embeddings(documents)
 
-            matches = sem.search(args.query, args.limit)
+            try:
+                matches = sem.search(args.query, args.limit, doc_filter)
+            except ValueError as e:
+                print("Error:", e)
+                return
             for i, m in enumerate(matches, start=1):
                 print(f"{i}. {m['title']} (score: {m['score']:.4f})")
                 print(f"{m['description']}")
@@ -74,21 +108,59 @@ def main():
                 print(f"{i}. {s}")
         case "embed_chunks":
             csem = semantic_search.ChunkedSemanticSearch()
-            # Load movies json
-            with open(config.DATA_FILE_PATH, "r") as f:
-                documents = json.load(f)["movies"]
-            _ = csem.load_or_create_chunk_embeddings(documents)
+            csem.update_chunk_embeddings()
             print(f"Generated {len(csem.chunk_embeddings)} chunked embeddings")
+            if csem.build_stats:
+                print(f"Encoded {csem.build_stats['encoded']} new or changed chunks, reused {csem.build_stats['reused'] + csem.build_stats['resumed']}")
+        case "build_embeddings":
+            if args.batch_size < 1 or args.workers < 1:
+                print("Error: --batch-size and --workers must be at least 1")
+                return
+            documents = iter_documents()
+            if args.chunks:
+                csem = semantic_search.ChunkedSemanticSearch(backend=args.backend)
+                csem.build_chunk_embeddings(documents, args.batch_size, args.workers)
+                rows, stats = len(csem.chunk_embeddings), csem.build_stats
+            else:
+                sem = semantic_search.SemanticSearch(backend=args.backend)
+                sem.build_embeddings(documents, args.batch_size, args.workers)
+                rows, stats = len(sem.embeddings), sem.build_stats
+            print(f"Built {rows} embeddings for {stats['documents']} movies in {stats['secs']:.1f}s ({stats['docs_per_sec']:.1f} movies/s)")
+            print(f"Encoded {stats['encoded']} texts at {stats['texts_per_sec']:.1f}/s, reused {stats['reused']} from the previous build and {stats['resumed']} from an interrupted one")
+            print(f"Peak RSS: {stats['peak_rss']['self'] / 2**20:.1f} MB, largest child process {stats['peak_rss']['children'] / 2**20:.1f} MB")
         case "search_chunked":
-            csem = semantic_search.ChunkedSemanticSearch()
+            try:
+                doc_filter = parse_filter(args.ids, args.where)
+            except ValueError as e:
+                print("Error:", e)
+                return
+            csem = semantic_search.ChunkedSemanticSearch(storage=args.storage, rescore_factor=args.rescore_factor, backend=args.backend)
             # Load movies json
-            with open(config.DATA_FILE_PATH, "r") as f:
-                documents = json.load(f)["movies"]
+            documents = load_documents()
             csem.load_or_create_chunk_embeddings(documents)
-            matches = csem.search_chunks(args.query, args.limit)
+            try:
+                matches = csem.search_chunks(args.query, args.limit, doc_filter, args.nprobe, args.pooling, args.top_n)
+            except ValueError as e:
+                print("Error:", e)
+                return
             for i, m in enumerate(matches, start=1):
                 print(f"\n{i}. {m['title']} (score: {m['score']:.4f})")
                 print(f"   {m['document']}...")
+        case "ann_recall":
+            csem = semantic_search.ChunkedSemanticSearch()
+            documents = load_documents()
+            csem.load_or_create_chunk_embeddings(documents)
+            # measure even when the catalog is below the size searches start using the index
+            csem.load_or_build_ivf(min_rows=0)
+            if csem.ivf is None:
+                print("Error: no chunk embeddings to index")
+                return
+            rng = random.Random(0)
+            described = [d for d in documents if d["description"]]
+            queries = [semantic_search.semantic_chunk(d["description"], 0, 1)[0] for d in rng.sample(described, min(args.queries, len(described)))]
+            print(f"{len(csem.chunk_embeddings)} chunks in {csem.ivf.num_lists} lists, {len(queries)} queries")
+            for p in csem.ann_recall(queries, args.limit, args.nprobe):
+                print(f"nprobe {p['nprobe']}: recall@{args.limit} {p['recall']:.3f}, {p['secs'] * 1000:.2f} ms per query (exact {p['exact_secs'] * 1000:.2f} ms)")
         case _:
             parser.print_help()
 
@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+from lib import config
+from lib import hybrid_search, keyword_search
+
+WORDS = ["robot", "space", "love", "war", "ship", "paris", "ghost", "house", "dragon", "island", "detective", "storm"]
+
+
+@pytest.fixture(autouse=True, scope="session")
+def stop_words(tmp_path_factory):
+    # data/ is not in the repository, so the tests bring their own stop words
+    path = tmp_path_factory.mktemp("data") / "stop_words.txt"
+    path.write_text("a\nan\nthe\nand\nof\n")
+    config.STOP_WORDS_FILE_PATH = path
+    keyword_search.load_stop_words.cache_clear()
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "INDEX_DIR_PATH", tmp_path / "index")
+    monkeypatch.setattr(config, "INDEX_MANIFEST_FILE_PATH", tmp_path / "index" / "manifest.json")
+    return tmp_path / "index"
+
+
+@pytest.fixture
+def search_legs(monkeypatch):
+    # fresh leg pools per test, shut down after it so no threads outlive it
+    legs = {}
+    monkeypatch.setattr(hybrid_search, "_legs", legs)
+    yield legs
+    for leg in legs.values():
+        leg.executor.shutdown(wait=True)
+
+
+@pytest.fixture(scope="session")
+def make_documents():
+    return documents
+
+
+def documents(count: int, seed: int = 0) -> list[dict]:
+    # Random titles and descriptions over a small vocabulary, with every tenth document a
+    # copy of the one before it so that equal scores are common
+    rng = random.Random(seed)
+    documents = []
+    for doc_id in range(1, count + 1):
+        if doc_id % 10 == 0:
+            title, description = documents[-1]["title"], documents[-1]["description"]
+        else:
+            title = " ".join(rng.choices(WORDS, k=rng.randint(1, 3)))
+            description = " ".join(rng.choices(WORDS + ["the", "of"], k=rng.randint(5, 40)))
+        documents.append({"id": doc_id, "title": title, "description": description})
+    return documents
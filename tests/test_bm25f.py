@@ -0,0 +1,35 @@
+import pytest
+
+from lib.keyword_search import InvertedIndex
+
+
+@pytest.fixture(scope="module")
+def field_index(make_documents):
+    idx = InvertedIndex()
+    idx.index_documents(make_documents(300) + [
+        {"id": 1001, "title": "Zeppelin", "description": "war storm house island ghost"},
+        {"id": 1002, "title": "Island", "description": "war storm house zeppelin zeppelin"},
+    ])
+    return idx
+
+
+def scores(results):
+    return dict(results)
+
+
+def test_title_match_outranks_description_match(field_index):
+    bm25 = scores(field_index.bm25_search("zeppelin", 10))
+    assert bm25[1002] > bm25[1001]
+    bm25f = field_index.bm25f_search("zeppelin", 10)
+    assert [doc_id for doc_id, _ in bm25f] == [1001, 1002]
+
+
+def test_title_weight_raises_title_matches(field_index):
+    low = scores(field_index.bm25f_search("zeppelin", 10, title_weight=1.0))
+    high = scores(field_index.bm25f_search("zeppelin", 10, title_weight=5.0))
+    assert high[1001] > low[1001]
+    assert high[1001] - high[1002] > low[1001] - low[1002]
+
+
+def test_bm25f_mode_matches_bm25f_search(field_index):
+    assert field_index.bm25_search("zeppelin storm", 10, "bm25f") == field_index.bm25f_search("zeppelin storm", 10)
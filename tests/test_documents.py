@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from lib import documents
+from lib.documents import SpooledDocuments, iter_documents
+
+MOVIES = [{"id": i, "title": f"Movie {i}", "description": "x" * (i * 7), "year": 1990 + i} for i in range(1, 30)]
+
+
+@pytest.fixture(autouse=True)
+def small_reads(monkeypatch):
+    # documents and numbers straddle many read boundaries
+    monkeypatch.setattr(documents, "READ_CHUNK_SIZE", 7)
+
+
+@pytest.mark.parametrize("layout", [
+    {"movies": MOVIES},
+    {"version": 12345, "source": {"name": "catalog", "tags": ["a", "b"]}, "movies": MOVIES, "count": 29},
+    MOVIES,
+])
+def test_reads_json_catalogs(tmp_path, layout):
+    path = tmp_path / "movies.json"
+    path.write_text(json.dumps(layout, indent=2))
+    assert list(iter_documents(path)) == MOVIES
+
+
+def test_reads_json_lines(tmp_path):
+    path = tmp_path / "movies.jsonl"
+    path.write_text("\n".join(json.dumps(m) for m in MOVIES) + "\n\n")
+    assert list(iter_documents(path)) == MOVIES
+
+
+@pytest.mark.parametrize("text", ['{"films": []}', '{}', '"movies"', '{"movies": {"id": 1}}', '[{"id": 1}'])
+def test_rejects_files_without_a_movie_array(tmp_path, text):
+    path = tmp_path / "movies.json"
+    path.write_text(text)
+    with pytest.raises(ValueError):
+        list(iter_documents(path))
+
+
+def test_spooled_documents():
+    spool = SpooledDocuments()
+    for m in MOVIES:
+        spool.add(m)
+    assert len(spool) == len(MOVIES)
+    assert spool[5] == MOVIES[4]
+    assert 99 not in spool and spool.get(99) is None
+    assert dict(spool) == {m["id"]: m for m in MOVIES}
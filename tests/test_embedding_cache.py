@@ -0,0 +1,64 @@
+import numpy as np
+
+from lib.embedding_cache import EmbeddingCache, content_hashes, hashes_match, save_hashes
+
+DIM = 4
+
+
+def encoder(calls):
+    def encode(texts, hashes):
+        calls.append(list(texts))
+        vectors = np.array([[len(t), t.count("a"), t.count("e"), 1.0] for t in texts], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return encode
+
+
+def build(tmp_path, texts, salt="model"):
+    # writes a previous build's embeddings and hashes the way the builders do
+    calls = []
+    hashes = content_hashes(texts, salt)
+    embeddings = EmbeddingCache(np.zeros(0, dtype=np.uint64), None).embed(texts, hashes, encoder(calls), DIM)
+    np.save(tmp_path / "embeddings.npy", embeddings)
+    save_hashes(tmp_path / "hashes.npy", hashes)
+    return embeddings
+
+
+def test_rebuild_encodes_only_changed_texts(tmp_path):
+    old = ["alien", "heat", "ronin", "fargo"]
+    embeddings = build(tmp_path, old)
+    cache = EmbeddingCache.load(tmp_path / "embeddings.npy", tmp_path / "hashes.npy")
+
+    new = ["fargo", "heat (1995)", "alien", "brazil"]
+    calls = []
+    result = cache.embed(new, content_hashes(new, "model"), encoder(calls), DIM)
+
+    assert calls == [["heat (1995)", "brazil"]]
+    assert (cache.reused, cache.encoded) == (2, 2)
+    np.testing.assert_array_equal(result[0], embeddings[3])
+    np.testing.assert_array_equal(result[2], embeddings[0])
+    np.testing.assert_array_equal(result[[1, 3]], encoder([])(["heat (1995)", "brazil"], None))
+
+
+def test_salt_changes_invalidate_every_row(tmp_path):
+    texts = ["alien", "heat"]
+    build(tmp_path, texts)
+    cache = EmbeddingCache.load(tmp_path / "embeddings.npy", tmp_path / "hashes.npy")
+    calls = []
+    cache.embed(texts, content_hashes(texts, "other-model"), encoder(calls), DIM)
+    assert calls == [texts]
+    assert (cache.reused, cache.encoded) == (0, 2)
+
+
+def test_missing_or_mismatched_files_give_an_empty_cache(tmp_path):
+    assert len(EmbeddingCache.load(tmp_path / "embeddings.npy", tmp_path / "hashes.npy").sorted_hashes) == 0
+    build(tmp_path, ["alien", "heat"])
+    save_hashes(tmp_path / "hashes.npy", content_hashes(["alien"], "model"))
+    assert len(EmbeddingCache.load(tmp_path / "embeddings.npy", tmp_path / "hashes.npy").sorted_hashes) == 0
+
+
+def test_hashes_match(tmp_path):
+    hashes = content_hashes(["alien", "heat"], "model")
+    save_hashes(tmp_path / "hashes.npy", hashes)
+    assert hashes_match(tmp_path / "hashes.npy", hashes)
+    assert not hashes_match(tmp_path / "hashes.npy", hashes[::-1])
+    assert not hashes_match(tmp_path / "missing.npy", hashes)
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pytest
+
+from lib.embedding_cache import content_hashes
+from lib.embedding_pipeline import EmbeddingPipeline, append_rows, load_checkpoint
+
+DIM = 3
+
+
+class FakeModel:
+    # deterministic vectors, failing after fail_after texts to stand in for an interrupted build
+    def __init__(self, fail_after: int | None = None):
+        self.fail_after = fail_after
+        self.encoded: list[str] = []
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return DIM
+
+    def encode(self, batch, batch_size, show_progress_bar):
+        if self.fail_after is not None and len(self.encoded) + len(batch) > self.fail_after:
+            raise KeyboardInterrupt
+        self.encoded.extend(batch)
+        vectors = np.array([[len(t), sum(map(ord, t)) % 7 + 1, 1.0] for t in batch], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+TEXTS = [f"movie {i} " + "x" * (i % 13) for i in range(50)]
+
+
+def test_resumes_after_interruption(tmp_path):
+    path = tmp_path / "embeddings.npy"
+    hashes = content_hashes(TEXTS, "model")
+    with pytest.raises(KeyboardInterrupt):
+        with EmbeddingPipeline(FakeModel(fail_after=20), path, batch_size=4, workers=1, checkpoint_rows=8) as pipeline:
+            pipeline.encode(TEXTS, hashes)
+    assert os.path.exists(tmp_path / "embeddings.partial.npy")
+
+    model = FakeModel()
+    with EmbeddingPipeline(model, path, batch_size=4, workers=1, checkpoint_rows=8) as pipeline:
+        resumed = pipeline.encode(TEXTS, hashes)
+        pipeline.finish()
+
+    assert pipeline.resumed == 16
+    assert pipeline.encoded == len(model.encoded) == len(TEXTS) - 16
+    assert not os.path.exists(tmp_path / "embeddings.partial.npy")
+    with EmbeddingPipeline(FakeModel(), tmp_path / "fresh.npy", batch_size=4, workers=1, checkpoint_rows=8) as pipeline:
+        np.testing.assert_allclose(resumed, pipeline.encode(TEXTS, hashes))
+
+
+def test_checkpoint_cut_between_files_drops_unpaired_rows(tmp_path):
+    vectors_path, hashes_path = tmp_path / "e.partial.npy", tmp_path / "e.partial.hashes.npy"
+    append_rows(vectors_path, np.eye(DIM, dtype=np.float32))
+    append_rows(hashes_path, np.array([1, 2], dtype=np.uint64))
+
+    checkpoint = load_checkpoint(vectors_path, hashes_path, DIM)
+    assert checkpoint.lookup(np.array([1, 2, 3], dtype=np.uint64)).tolist() == [0, 1, -1]
+    assert np.load(vectors_path).shape == (2, DIM)
+
+
+def test_checkpoint_from_other_dimensions_is_discarded(tmp_path):
+    vectors_path, hashes_path = tmp_path / "e.partial.npy", tmp_path / "e.partial.hashes.npy"
+    append_rows(vectors_path, np.ones((2, DIM + 1), dtype=np.float32))
+    append_rows(hashes_path, np.array([1, 2], dtype=np.uint64))
+
+    assert len(load_checkpoint(vectors_path, hashes_path, DIM).sorted_hashes) == 0
+    assert not os.path.exists(vectors_path) and not os.path.exists(hashes_path)
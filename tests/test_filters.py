@@ -0,0 +1,54 @@
+import pytest
+
+from lib.filters import Bitmap, DocFilter, matches
+from lib.keyword_search import InvertedIndex
+
+FILTERS = [
+    (None, ["year>=2000"]),
+    (None, ["year<1990", "title~ship"]),
+    (range(1, 2000, 7), ()),
+    (range(1, 2000, 3), ["year!=2005"]),
+    ([5, 6, 7], ["title~nothing"]),
+]
+
+
+@pytest.fixture(scope="module")
+def filtered_index(make_documents):
+    documents = [dict(d, year=1970 + d["id"] % 50) for d in make_documents(1500)]
+    idx = InvertedIndex()
+    idx.index_documents(documents)
+    return idx, {d["id"]: d for d in documents}
+
+
+def post_filter(results, documents, doc_filter):
+    return [
+        (doc_id, score) for doc_id, score in results
+        if (doc_filter.ids is None or doc_id in doc_filter.ids)
+        and all(matches(documents[doc_id], p) for p in doc_filter.predicates)
+    ]
+
+
+@pytest.mark.parametrize("mode", ["exhaustive", "wand", "bmw", "bm25f"])
+@pytest.mark.parametrize("limit", [1, 10, 100])
+@pytest.mark.parametrize("query", ["robot", "space ship", "dragon island storm war"])
+@pytest.mark.parametrize("ids, predicates", FILTERS)
+def test_filtered_search_matches_post_filtering(filtered_index, mode, limit, query, ids, predicates):
+    idx, documents = filtered_index
+    doc_filter = DocFilter(ids, predicates)
+    everything = idx.bm25_search(query, len(documents), mode)
+    assert idx.bm25_search(query, limit, mode, doc_filter) == post_filter(everything, documents, doc_filter)[:limit]
+
+
+def test_bitmap_set_operations():
+    a = Bitmap.from_ids([1, 5, 70000, 70001, 200000])
+    b = Bitmap.from_ids(list(range(0, 80000, 5)))
+    assert (a & b).to_array().tolist() == [5, 70000]
+    assert (a | b).to_array().tolist() == sorted({1, 5, 70000, 70001, 200000} | set(range(0, 80000, 5)))
+    assert 70001 in a and 70002 not in a
+
+
+def test_filter_needs_ids_or_predicates():
+    with pytest.raises(ValueError):
+        DocFilter()
+    with pytest.raises(ValueError):
+        DocFilter(predicates=["year"])
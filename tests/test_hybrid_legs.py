@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import threading
+import time
+
+import pytest
+
+from lib import hybrid_search, search_utils
+from lib.hybrid_search import HybridSearch
+
+
+@pytest.fixture
+def stalled_search(search_legs):
+    # keyword leg answers at once, semantic leg blocks until the test ends
+    release = threading.Event()
+    search = object.__new__(HybridSearch)
+    search.leg_timeout = 0.2
+    search._keyword_index = lambda: SimpleNamespace(docmap={})
+    search._bm25_search = lambda query, limit, doc_filter=None, idx=None: [(1, 2.5)]
+    search.semantic_search = SimpleNamespace(search_chunks=lambda query, limit, doc_filter: release.wait())
+    yield search
+    release.set()
+
+
+def test_stalled_leg_does_not_starve_other_leg(stalled_search):
+    for i in range(search_utils.HYBRID_LEG_WORKERS + 2):
+        keyword, semantic, dropped, _ = stalled_search._retrieve(f"query {i}", 10, None)
+        assert keyword == [(1, 2.5)]
+        assert semantic == []
+        assert dropped == ("semantic",)
+    assert hybrid_search.search_leg("semantic").abandoned == search_utils.HYBRID_LEG_MAX_ABANDONED
+
+
+def test_stalled_leg_does_not_starve_concurrent_queries(stalled_search):
+    queries = 3 * search_utils.HYBRID_LEG_WORKERS
+    with ThreadPoolExecutor(max_workers=queries) as pool:
+        results = list(pool.map(lambda i: stalled_search._retrieve(f"query {i}", 10, None), range(queries)))
+    assert all(keyword == [(1, 2.5)] and dropped == ("semantic",) for keyword, _, dropped, _ in results)
+
+
+def test_timeout_counts_from_leg_start():
+    # a run queued behind a slow one still gets its whole timeout once it starts
+    leg = hybrid_search.SearchLeg("test", workers=1)
+    leg.submit(time.sleep, 0.3)
+    queued = leg.submit(lambda: "done")
+    assert queued.result(0.2) == "done"
+    leg.executor.shutdown(wait=True)
@@ -0,0 +1,49 @@
+import pytest
+
+from lib import hybrid_search
+from lib.hybrid_search import HybridSearch
+from lib.keyword_search import InvertedIndex
+
+
+class FakeSemanticSearch:
+    # scores the startup catalog by how many query words each description contains
+    chunk_generation = 1
+
+    def load_or_create_chunk_embeddings(self, documents):
+        self.documents = documents
+        self.document_map = {d["id"]: d for d in documents}
+
+    def lowercases_text(self):
+        return True
+
+    def search_chunks(self, query, limit, doc_filter=None):
+        scored = [(sum(w in d["description"].split() for w in query.split()), d) for d in self.documents]
+        scored = sorted((s for s in scored if s[0]), key=lambda s: -s[0])[:limit]
+        return [{"id": d["id"], "title": d["title"], "score": float(s), "metadata": {}} for s, d in scored]
+
+
+@pytest.fixture
+def search(index_dir, make_documents, search_legs, monkeypatch):
+    monkeypatch.setattr(hybrid_search, "ChunkedSemanticSearch", FakeSemanticSearch)
+    documents = make_documents(200)
+    idx = InvertedIndex()
+    idx.index_documents(documents)
+    idx.save()
+    return HybridSearch(documents)
+
+
+def test_fusion_finds_documents_added_after_startup(search):
+    added = {"id": 9001, "title": "love love", "description": "love love love love love love"}
+    InvertedIndex().add_documents([added])
+
+    rrf = search.rrf_search("love", 60, 300)
+    assert rrf[9001]["doc"] == added
+    weighted = search.weighted_search("love", 0.5, 300)
+    assert weighted[9001]["doc"] == added
+
+
+def test_fusion_falls_back_to_catalog_for_semantic_only_hits(search):
+    InvertedIndex().delete_documents([1])
+    results = search.rrf_search(search.documents[0]["description"], 60, 200)
+    assert results[1]["bm25_rank"] is None
+    assert results[1]["doc"] == search.documents[0]
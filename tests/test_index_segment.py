@@ -0,0 +1,66 @@
+import pytest
+
+from lib.index_segment import IndexSegment, write_segment
+from lib.keyword_search import InvertedIndex
+
+
+@pytest.mark.parametrize("positions", [False, True])
+def test_segment_round_trip(tmp_path, make_documents, positions):
+    idx = InvertedIndex(positions)
+    idx.index_documents(make_documents(300))
+    path = tmp_path / "segment"
+    write_segment(path, idx.index, idx.docmap, idx.doc_lengths, idx.avg_doc_length, idx.title_lengths)
+    segment = IndexSegment(path)
+
+    assert list(segment.terms) == sorted(idx.index)
+    for term, postings in idx.index.items():
+        read = segment.terms[term]
+        assert list(read.doc_ids) == list(postings.doc_ids)
+        assert list(read.tfs) == list(postings.tfs)
+        assert list(read.block_max) == list(postings.block_max)
+        assert (read.idf, read.max_score) == (postings.idf, postings.max_score)
+        assert (read.positions is None) == (not positions)
+        if positions:
+            assert list(read.positions) == list(postings.positions)
+    assert "missing" not in segment.terms
+    assert dict(segment.docs) == idx.docmap
+    assert list(segment.doc_lengths) == list(idx.doc_lengths)
+    assert list(segment.title_lengths) == list(idx.title_lengths)
+    assert segment.avg_doc_length == idx.avg_doc_length
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "segment"
+    path.write_bytes(b"not a segment, just some bytes")
+    with pytest.raises(ValueError):
+        IndexSegment(path)
+
+
+def test_doc_store_is_a_mapping(tmp_path):
+    idx = InvertedIndex()
+    idx.index_documents([{"id": 2, "title": "Robot", "description": "robot war"}, {"id": 7, "title": "Ghost", "description": "ghost house"}])
+    path = tmp_path / "segment"
+    write_segment(path, idx.index, idx.docmap, idx.doc_lengths, idx.avg_doc_length, idx.title_lengths)
+    docs = IndexSegment(path).docs
+
+    assert list(docs) == [2, 7]
+    for key in ["2", 2.5, None, -1, 3, 8, 10**12]:
+        assert key not in docs
+        assert docs.get(key) is None
+        with pytest.raises(KeyError):
+            docs[key]
+    assert docs[7]["title"] == "Ghost"
+
+
+def test_large_doc_ids_do_not_inflate_segments(tmp_path):
+    sizes = []
+    for doc_id in (5, 50_000_000):
+        idx = InvertedIndex()
+        idx.index_documents([{"id": 1, "title": "Robot", "description": "robot war"}, {"id": doc_id, "title": "Ghost", "description": "ghost house"}])
+        path = tmp_path / f"segment-{doc_id}"
+        write_segment(path, idx.index, idx.docmap, idx.doc_lengths, idx.avg_doc_length, idx.title_lengths)
+        sizes.append(path.stat().st_size)
+        segment = IndexSegment(path)
+        assert segment.docs[doc_id]["title"] == "Ghost"
+        assert segment.doc_lengths[doc_id] == idx.doc_lengths[doc_id]
+    assert sizes[1] - sizes[0] < 100
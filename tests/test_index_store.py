@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+from lib.keyword_search import InvertedIndex
+
+QUERIES = ["robot", "space ship", "love paris ghost", "dragon island storm war"]
+
+
+def test_updates_then_merge_match_full_rebuild(index_dir, make_documents):
+    documents = make_documents(600)
+    added = make_documents(700, seed=1)[600:]
+    updated = [dict(documents[4], description="robot robot storm"), dict(documents[200], title="paris")]
+    deleted = [3, 50, 51, 420]
+
+    idx = InvertedIndex()
+    idx.index_documents(documents)
+    idx.save()
+    idx.add_documents(added[:50])
+    idx.delete_documents(deleted)
+    idx.add_documents(added[50:] + updated)
+    assert len(idx.store.read_manifest()["segments"]) == 3
+    assert idx.merge()
+    assert len(idx.store.read_manifest()["segments"]) == 1
+
+    final = {d["id"]: d for d in documents + added + updated}
+    for doc_id in deleted:
+        del final[doc_id]
+    rebuilt = InvertedIndex()
+    rebuilt.index_documents(sorted(final.values(), key=lambda d: d["id"]))
+
+    assert dict(idx.docmap) == rebuilt.docmap
+    assert list(idx.index) == sorted(rebuilt.index)
+    for term, postings in rebuilt.index.items():
+        merged = idx.index[term]
+        assert list(merged.doc_ids) == list(postings.doc_ids)
+        assert list(merged.tfs) == list(postings.tfs)
+        assert merged.idf == pytest.approx(postings.idf)
+    assert idx.avg_doc_length == pytest.approx(rebuilt.avg_doc_length)
+    for query in QUERIES:
+        for mode in ("exhaustive", "wand", "bmw"):
+            merged, full = idx.bm25_search(query, 10, mode), rebuilt.bm25_search(query, 10, mode)
+            assert [doc_id for doc_id, _ in merged] == [doc_id for doc_id, _ in full]
+            assert [score for _, score in merged] == pytest.approx([score for _, score in full])
+
+
+@pytest.fixture
+def updated_index(index_dir, make_documents):
+    documents = make_documents(300)
+    idx = InvertedIndex()
+    idx.index_documents(documents[:200])
+    idx.save()
+    idx.add_documents(documents[200:])
+    idx.delete_documents([7])
+    return idx
+
+
+def test_merge_commits_once(updated_index):
+    generation = updated_index.generation
+    assert updated_index.merge()
+    assert updated_index.generation == generation + 1
+    assert not updated_index.merge()
+    assert updated_index.generation == generation + 1
+
+
+def test_failed_merge_leaves_manifest(updated_index, monkeypatch):
+    from lib import index_store
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    manifest = updated_index.store.read_manifest()
+    monkeypatch.setattr(index_store, "write_segment", fail)
+    with pytest.raises(OSError):
+        updated_index.merge()
+    assert updated_index.store.read_manifest() == manifest
+    assert not any(name.endswith(".merging") for name in os.listdir(updated_index.store.path))
+
+
+def test_snapshot_terms_skip_deleted_only_terms(updated_index):
+    updated_index.add_documents([{"id": 9001, "title": "Zyzzyva", "description": "zyzzyva"}])
+    updated_index.delete_documents([9001])
+    assert "zyzzyva" not in list(updated_index.index)
+    assert sorted(updated_index.index) == sorted(updated_index.document_frequencies())
@@ -0,0 +1,96 @@
+import math
+
+import pytest
+
+from lib.keyword_search import InvertedIndex
+
+QUERIES = ["robot", "space ship", "love paris ghost", "dragon island storm war", "detective house", "unknown"]
+
+
+@pytest.fixture(scope="module")
+def built_index(make_documents):
+    idx = InvertedIndex()
+    idx.index_documents(make_documents(1500))
+    return idx
+
+
+@pytest.mark.parametrize("mode", ["wand", "bmw"])
+@pytest.mark.parametrize("limit", [1, 5, 10, 100])
+@pytest.mark.parametrize("query", QUERIES)
+def test_pruned_search_matches_exhaustive(built_index, mode, limit, query):
+    # same documents, same scores and the same order among ties
+    assert built_index.bm25_search(query, limit, mode) == built_index.bm25_search(query, limit, "exhaustive")
+
+
+def test_ties_order_by_doc_id(built_index):
+    results = built_index.bm25_search("robot", 100, "exhaustive")
+    assert any(a[1] == b[1] for a, b in zip(results, results[1:]))
+    for a, b in zip(results, results[1:]):
+        assert a[1] > b[1] or (a[1] == b[1] and a[0] < b[0])
+
+
+def test_parallel_build_matches_serial(make_documents):
+    documents = make_documents(3000)
+    serial, parallel = InvertedIndex(positions=True), InvertedIndex(positions=True)
+    serial.index_documents(documents, 1)
+    parallel.index_documents(documents, 2)
+
+    assert list(parallel.index) == list(serial.index)
+    for term, postings in serial.index.items():
+        other = parallel.index[term]
+        assert (list(other.doc_ids), list(other.tfs), list(other.positions)) == (list(postings.doc_ids), list(postings.tfs), list(postings.positions))
+        assert (other.idf, other.max_score, list(other.block_max)) == (postings.idf, postings.max_score, list(postings.block_max))
+    assert list(parallel.doc_lengths) == list(serial.doc_lengths)
+    assert list(parallel.title_lengths) == list(serial.title_lengths)
+    assert (parallel.avg_doc_length, parallel.avg_title_length) == (serial.avg_doc_length, serial.avg_title_length)
+    assert dict(parallel.docmap) == dict(serial.docmap)
+    for query in QUERIES:
+        assert parallel.bm25_search(query, 10) == serial.bm25_search(query, 10)
+
+
+@pytest.fixture(scope="module")
+def positional_index():
+    idx = InvertedIndex(positions=True)
+    idx.index_documents([
+        {"id": 1, "title": "Launch", "description": "The space ship lands"},
+        {"id": 2, "title": "Return", "description": "A ship lost in space"},
+        {"id": 3, "title": "Drift", "description": "Space big ship"},
+        {"id": 4, "title": "Orbit", "description": "Space red blue green yellow ship"},
+    ])
+    return idx
+
+
+@pytest.mark.parametrize("mode", ["exhaustive", "wand", "bmw"])
+@pytest.mark.parametrize("query, expected", [
+    ('"space ship"', {1}),
+    ('"ship space"', set()),
+    ("space NEAR/2 ship", {1, 3}),
+    ("ship NEAR/3 space", {1, 2, 3}),
+    ("space NEAR/5 ship", {1, 2, 3, 4}),
+    ('"space ship" lands', {1}),
+])
+def test_phrase_and_near_queries(positional_index, mode, query, expected):
+    assert {doc_id for doc_id, _ in positional_index.bm25_search(query, 10, mode)} == expected
+
+
+def test_phrase_query_needs_positions():
+    idx = InvertedIndex(positions=False)
+    idx.index_documents([{"id": 1, "title": "Launch", "description": "The space ship lands"}])
+    with pytest.raises(ValueError):
+        idx.bm25_search('"space ship"', 10)
+
+
+@pytest.mark.parametrize("query", QUERIES[:-1])
+def test_vectorized_scores_match_per_document_bm25(built_index, query):
+    terms = query.split()
+    expected = {doc_id: sum(built_index.bm25(doc_id, t) for t in terms) for doc_id in built_index.docmap}
+    expected = {doc_id: score for doc_id, score in expected.items() if score > 0}
+    results = dict(built_index.bm25_search(query, len(built_index.docmap), "exhaustive"))
+    assert results.keys() == expected.keys()
+    for doc_id, score in expected.items():
+        assert results[doc_id] == pytest.approx(score)
+
+
+def test_idf_uses_document_frequency(built_index):
+    n, df = len(built_index.docmap), len(built_index.index["robot"].doc_ids)
+    assert built_index.get_bm25_idf("robot") == pytest.approx(math.log((n - df + 0.5) / (df + 0.5) + 1))
@@ -0,0 +1,40 @@
+import sys
+import types
+
+import numpy as np
+import pytest
+
+from lib import models
+
+
+def test_only_int8_backends_get_their_own_encoder_key():
+    assert models.encoder_key("all-MiniLM-L6-v2", "torch") == "all-MiniLM-L6-v2"
+    assert models.encoder_key("all-MiniLM-L6-v2", "onnx") == "all-MiniLM-L6-v2"
+    assert models.encoder_key("all-MiniLM-L6-v2", "torch-int8") != models.encoder_key("all-MiniLM-L6-v2", "onnx-int8")
+
+
+def test_agreement_check_rejects_drifting_backend():
+    reference = np.random.default_rng(0).normal(size=(20, 8))
+    close = reference + 0.001 * np.random.default_rng(1).normal(size=reference.shape)
+    assert models.check_agreement(reference, close, 0.99)["min_cosine"] > 0.99
+    far = close.copy()
+    far[3] = -far[3]
+    with pytest.raises(ValueError):
+        models.check_agreement(reference, far, 0.99)
+
+
+def test_models_load_once_per_backend(monkeypatch):
+    loaded = []
+
+    class SentenceTransformer:
+        def __init__(self, name, **kwargs):
+            loaded.append((name, kwargs))
+
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(SentenceTransformer=SentenceTransformer))
+    monkeypatch.setattr(models, "_models", {})
+    first = models.sentence_transformer("model", "onnx")
+    assert models.sentence_transformer("model", "onnx") is first
+    assert models.sentence_transformer("model") is not first
+    assert loaded == [("model", {"backend": "onnx"}), ("model", {})]
+    with pytest.raises(ValueError):
+        models.sentence_transformer("model", "tensorrt")
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from lib.query_cache import QueryEmbeddingCache
+
+
+def encoder(calls, vector):
+    def encode():
+        calls.append(1)
+        return vector
+    return encode
+
+
+def test_repeated_query_is_encoded_once(tmp_path):
+    cache = QueryEmbeddingCache(tmp_path / "queries.db")
+    calls = []
+    vector = np.array([0.25, 0.5, 1.0], dtype=np.float32)
+    first = cache.get_or_encode("model", "space ship", encoder(calls, vector))
+    second = cache.get_or_encode("model", "space ship", encoder(calls, vector))
+    cache.get_or_encode("other-model", "space ship", encoder(calls, vector))
+
+    assert len(calls) == 2
+    np.testing.assert_array_equal(first, vector)
+    assert second is first
+    assert not first.flags.writeable
+    assert (cache.stats()["memory_hits"], cache.stats()["misses"]) == (1, 2)
+    cache.close()
+
+
+@pytest.mark.parametrize("dtype", ["float32", "float16"])
+def test_vectors_persist_across_processes(tmp_path, dtype):
+    vector = np.array([0.25, 0.5, 1.0], dtype=np.float32)
+    writer = QueryEmbeddingCache(tmp_path / "queries.db", dtype=dtype)
+    writer.get_or_encode("model", "space ship", encoder([], vector))
+    writer.close()
+
+    calls = []
+    reader = QueryEmbeddingCache(tmp_path / "queries.db", dtype=dtype)
+    stored = reader.get_or_encode("model", "space ship", encoder(calls, vector))
+    assert calls == []
+    assert stored.dtype == np.float32
+    np.testing.assert_array_equal(stored, vector)
+    assert reader.stats()["disk_hits"] == 1
+    reader.close()
+
+
+def test_lru_evicts_oldest_query():
+    cache = QueryEmbeddingCache(None, maxsize=2)
+    calls = []
+    for query in ["a", "b", "c", "a"]:
+        cache.get_or_encode("model", query, encoder(calls, np.ones(2, dtype=np.float32)))
+    assert len(calls) == 4
+    assert cache.stats()["size"] == 2
@@ -0,0 +1,40 @@
+from lib.keyword_search import InvertedIndex
+from lib.result_cache import ResultCache
+
+
+def test_generation_change_invalidates_entry():
+    cache = ResultCache()
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return value
+
+    assert cache.get_or_compute("q", 1, lambda: compute("old")) == "old"
+    assert cache.get_or_compute("q", 1, lambda: compute("other")) == "old"
+    assert cache.get_or_compute("q", 2, lambda: compute("new")) == "new"
+    assert cache.get_or_compute("q", 2, lambda: compute("other")) == "new"
+    assert calls == ["old", "new"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["invalidations"]) == (2, 2, 1)
+
+
+def test_search_after_update_is_not_served_from_cache(index_dir, make_documents):
+    idx = InvertedIndex()
+    idx.index_documents(make_documents(200))
+    idx.save()
+    idx.load()
+    before = idx.bm25_search("zeppelin", 10)
+    assert before == []
+    assert idx.bm25_search("zeppelin", 10) == before
+    assert idx.cache.stats()["hits"] == 1
+
+    generation = idx.generation
+    idx.add_documents([{"id": 500, "title": "Zeppelin", "description": "A zeppelin over paris"}])
+    assert idx.generation != generation
+    assert [doc_id for doc_id, _ in idx.bm25_search("zeppelin", 10)] == [500]
+    assert idx.cache.stats()["invalidations"] == 1
+
+    idx.delete_documents([500])
+    assert idx.bm25_search("zeppelin", 10) == []
+    assert idx.cache.stats()["invalidations"] == 2
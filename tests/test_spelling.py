@@ -0,0 +1,42 @@
+import pytest
+
+from lib import config, spelling
+from lib.keyword_search import InvertedIndex
+
+
+@pytest.fixture
+def index(index_dir, make_documents, monkeypatch):
+    monkeypatch.setattr(config, "SPELLING_CACHE_FILE_PATH", index_dir / "spelling.npz")
+    monkeypatch.setattr(spelling, "_index", None)
+    monkeypatch.setattr(spelling, "_corrector", None)
+    idx = InvertedIndex()
+    idx.index_documents(make_documents(200))
+    idx.save()
+    return idx
+
+
+def test_vocabulary_is_the_index_term_table(index):
+    # document frequencies leave out tombstoned documents
+    index.delete_documents([1, 2, 3, 4, 5])
+    corrector = spelling.load_or_build_corrector(index)
+    assert dict(zip(corrector.words.tolist(), corrector.dfs.tolist())) == {t: len(p) for t, p in index.index.items() if not t.startswith("title:")}
+
+
+def test_corrects_against_indexed_terms(index):
+    assert spelling.correct_query("Dragn in spaec") == "Dragon in space"
+    assert spelling.correct_query("detectives") == "detectives"
+
+
+def test_rebuilds_after_index_update(index):
+    assert spelling.correct_query("vulcano") == "vulcano"
+    first = spelling._corrector
+    index.add_documents([{"id": 5000, "title": "Volcano", "description": "a volcano erupts"}])
+    assert spelling.correct_query("vulcano") == "volcano"
+    assert spelling._corrector is not first
+    # the corrector is reused while the index is unchanged
+    corrector = spelling._corrector
+    spelling.correct_query("robto")
+    assert spelling._corrector is corrector
+
+    InvertedIndex().delete_documents([5000])
+    assert spelling.correct_query("vulcano") == "vulcano"
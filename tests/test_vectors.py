@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from lib.vectors import cosine_scores, normalize_rows, top_k_rows
+
+
+@pytest.fixture(scope="module")
+def embeddings():
+    rng = np.random.default_rng(0)
+    raw = rng.normal(size=(500, 16)).astype(np.float32)
+    raw[7] = 0
+    return raw
+
+
+def test_cosine_scores_match_per_row_cosine(embeddings):
+    query = np.random.default_rng(1).normal(size=16).astype(np.float32)
+    norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(query)
+    expected = np.divide(embeddings @ query, norms, out=np.zeros(len(embeddings), dtype=np.float32), where=norms > 0)
+    unit = normalize_rows(embeddings)
+    np.testing.assert_allclose(cosine_scores(unit, query), expected, atol=1e-5)
+    rows = np.array([3, 7, 400])
+    np.testing.assert_allclose(cosine_scores(unit, query, rows), expected[rows], atol=1e-5)
+    assert not cosine_scores(unit, np.zeros(16, dtype=np.float32)).any()
+
+
+@pytest.mark.parametrize("limit", [0, 1, 5, 50, 499, 500, 600])
+def test_top_k_rows_matches_stable_sort(limit):
+    # rounded scores, so ties straddle the cutoff
+    scores = np.round(np.random.default_rng(2).random(500), 2).astype(np.float32)
+    expected = np.argsort(-scores, kind="stable")[:limit]
+    assert top_k_rows(scores, limit).tolist() == expected.tolist()